@@ -0,0 +1,51 @@
+"""Connectivity metrics of the grpc.aio client channels"""
+import asyncio
+
+import grpc
+
+from grpc_prometheus_metrics import channel_metrics
+
+
+class AioChannelConnectivityMonitor(channel_metrics.ChannelConnectivityMonitor):
+    """
+    Exports the connectivity of the monitored ``grpc.aio`` channels by target.
+
+    ``grpc.aio`` channels have no connectivity callbacks, each monitored channel is
+    watched by a task waiting for its state changes.
+    """
+
+    def monitor(self, channel, target):
+        """Watches the connectivity of a ``grpc.aio.Channel`` from a task of the running loop."""
+        tracker = channel_metrics.ChannelTracker(self._metrics, self.target_label(target))
+        task = asyncio.get_running_loop().create_task(self._watch(channel, tracker))
+        with self._lock:
+            self._trackers[channel] = (tracker, task)
+        return tracker
+
+    def unmonitor(self, channel):
+        with self._lock:
+            tracker, task = self._trackers.pop(channel, (None, None))
+        if tracker is None:
+            return
+        task.cancel()
+        tracker.close()
+
+    async def _watch(self, channel, tracker):
+        state = channel.get_state(try_to_connect=False)
+        tracker.update(state)
+        while state is not grpc.ChannelConnectivity.SHUTDOWN:
+            await channel.wait_for_state_change(state)
+            previous_state, state = state, channel.get_state(try_to_connect=False)
+            if (
+                previous_state is grpc.ChannelConnectivity.IDLE
+                and state is grpc.ChannelConnectivity.READY
+            ):
+                # An idle channel connects through CONNECTING, which it may have left
+                # before the task woke up: the time to READY then runs from the wake-up
+                tracker.update(grpc.ChannelConnectivity.CONNECTING)
+            tracker.update(state)
+        # A shut down channel is not monitored anymore, the task holding it kept its entry
+        with self._lock:
+            if self._trackers.get(channel, (None,))[0] is tracker:
+                del self._trackers[channel]
+        tracker.close()
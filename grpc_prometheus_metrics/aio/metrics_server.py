@@ -0,0 +1,163 @@
+"""Expose prometheus metrics over HTTP from the asyncio event loop of a grpc.aio server"""
+import asyncio
+import logging
+import zlib
+
+from timeit import default_timer
+from urllib.parse import parse_qs, urlsplit
+
+from prometheus_client import exposition
+from prometheus_client.openmetrics import exposition as openmetrics_exposition
+from prometheus_client.registry import REGISTRY
+
+from grpc_prometheus_metrics.family_exposition import OPENMETRICS_EOF
+from grpc_prometheus_metrics.family_exposition import encode_family
+
+
+_LOGGER = logging.getLogger(__name__)
+
+_MAX_REQUEST_LINE = 8192
+_MAX_HEADERS = 100
+
+
+class AioMetricsServer:
+    """
+    Minimal HTTP/1.1 metrics endpoint running on the current event loop.
+
+    The registry is rendered one metric family at a time and the loop is given back
+    whenever rendering or compressing has taken longer than ``max_slice_seconds``, so a
+    big scrape never starves the RPC handlers sharing the loop. A single metric family
+    is the smallest unit of work, because prometheus_client collects it in one go.
+    """
+
+    def __init__(self, registry=REGISTRY, path="/metrics", max_slice_seconds=0.005):
+        self._registry = registry
+        self._path = path
+        self._max_slice_seconds = max_slice_seconds
+        self._server = None
+
+    async def start(self, port, addr="0.0.0.0"):
+        self._server = await asyncio.start_server(self._handle_connection, addr, port)
+        return self._server
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers = request
+                keep_alive = version == "HTTP/1.1" and headers.get("connection") != "close"
+                await self._respond(writer, method, target, headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except Exception as e:  # pylint: disable=broad-except
+            _LOGGER.error(e)
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line or len(request_line) > _MAX_REQUEST_LINE:
+            return None
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3:
+            return None
+
+        headers = {}
+        for _ in range(_MAX_HEADERS):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return parts[0], parts[1], parts[2], headers
+
+    async def _respond(self, writer, method, target, headers, keep_alive):
+        url = urlsplit(target)
+        if method not in ("GET", "HEAD"):
+            await self._write_response(writer, "405 Method Not Allowed", [], b"", keep_alive)
+            return
+        if url.path != self._path:
+            await self._write_response(writer, "404 Not Found", [], b"", keep_alive)
+            return
+
+        encoder, content_type = exposition.choose_encoder(headers.get("accept"))
+        gzipped = exposition.gzip_accepted(headers.get("accept-encoding"))
+        body = await self._render(
+            encoder,
+            content_type.startswith(openmetrics_exposition.CONTENT_TYPE_LATEST.split(";")[0]),
+            parse_qs(url.query).get("name[]"),
+            gzipped,
+        )
+
+        response_headers = [("Content-Type", content_type)]
+        if gzipped:
+            response_headers.append(("Content-Encoding", "gzip"))
+        if method == "HEAD":
+            response_headers.append(("Content-Length", str(len(body))))
+            body = b""
+        await self._write_response(writer, "200 OK", response_headers, body, keep_alive)
+
+    async def _render(self, encoder, openmetrics, names, gzipped):
+        """Renders the registry into the response body, yielding to the loop between slices."""
+        registry = self._registry
+        if names:
+            registry = registry.restricted_registry(names)
+        compressor = zlib.compressobj(wbits=31) if gzipped else None
+
+        chunks = []
+        slice_start = default_timer()
+        for family in registry.collect():
+            output = encode_family(encoder, family, openmetrics)
+            chunks.append(compressor.compress(output) if compressor else output)
+
+            if default_timer() - slice_start >= self._max_slice_seconds:
+                await asyncio.sleep(0)
+                slice_start = default_timer()
+
+        if openmetrics:
+            chunks.append(compressor.compress(OPENMETRICS_EOF) if compressor else OPENMETRICS_EOF)
+        if compressor:
+            chunks.append(compressor.flush())
+        return b"".join(chunks)
+
+    async def _write_response(self, writer, status, headers, body, keep_alive):
+        if not any(name == "Content-Length" for name, _ in headers):
+            headers = headers + [("Content-Length", str(len(body)))]
+        if not keep_alive:
+            headers = headers + [("Connection", "close")]
+        head = "HTTP/1.1 {}\r\n{}\r\n\r\n".format(
+            status, "\r\n".join("{}: {}".format(name, value) for name, value in headers)
+        )
+        writer.write(head.encode("latin-1"))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+
+async def start_http_server(
+    port, addr="0.0.0.0", registry=REGISTRY, path="/metrics", max_slice_seconds=0.005
+):
+    """
+    Starts serving the metrics of ``registry`` on the running event loop.
+
+    Pass the same registry given to ``PromAioServerInterceptor``. Returns the
+    ``AioMetricsServer``; call ``await server.stop()`` on shutdown.
+    """
+    server = AioMetricsServer(registry=registry, path=path, max_slice_seconds=max_slice_seconds)
+    await server.start(port, addr)
+    return server
@@ -0,0 +1,30 @@
+"""Serve prometheus metrics over the gRPC port of the instrumented grpc.aio server"""
+import asyncio
+
+from prometheus_client import exposition
+from prometheus_client.registry import REGISTRY
+
+from grpc_prometheus_metrics import metrics_service
+
+
+class AioMetricsService(metrics_service.MetricsService):
+    """The ``grpc_prometheus_metrics.Metrics`` service for ``grpc.aio`` servers."""
+
+    async def Snapshot(self, request, context):  # pylint: disable=invalid-name,unused-argument
+        return exposition.generate_latest(self._registry)
+
+    async def Watch(self, request, context):  # pylint: disable=invalid-name,unused-argument
+        previous = {}
+        yield metrics_service.render(metrics_service.collect_changed(self._registry, previous))
+        while True:
+            await asyncio.sleep(self._interval)
+            changed_families = metrics_service.collect_changed(self._registry, previous)
+            if changed_families:
+                yield metrics_service.render(changed_families)
+
+
+def add_metrics_service_to_server(server, registry=REGISTRY, interval=15.0):
+    """Adds the metrics service to a ``grpc.aio.server``, next to the instrumented services."""
+    service = AioMetricsService(registry=registry, interval=interval)
+    metrics_service.register_metrics_service(server, service)
+    return service
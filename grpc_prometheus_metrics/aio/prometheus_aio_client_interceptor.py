@@ -1,12 +1,53 @@
 """Interceptor a client call with prometheus"""
+import asyncio
+import threading
 
 from timeit import default_timer
 
 import grpc
-from prometheus_client.registry import REGISTRY
 
+from grpc_prometheus_metrics import exemplars
 from grpc_prometheus_metrics import grpc_utils
+from grpc_prometheus_metrics.client_metrics import HANDLING_TIME_HISTOGRAMS
+from grpc_prometheus_metrics.client_metrics import MethodMetrics
 from grpc_prometheus_metrics.client_metrics import init_metrics
+from grpc_prometheus_metrics.server_metrics import DEFAULT_REGISTRY
+from grpc_prometheus_metrics.server_metrics import histogram_options
+
+
+class _Configuration:
+    """
+    Reconfigurable options of the interceptor and the per method state built from them.
+    A reconfiguration replaces the whole configuration, which a call reads once, when it
+    starts, as does a replacement of the metrics of the registry by another interceptor.
+    """
+
+    __slots__ = (
+        "options",
+        "generation",
+        "enable_client_handling_time_histogram",
+        "exemplar_sampler",
+        "enable_client_attempt_metrics",
+        "method_filter",
+        "method_metrics",
+    )
+
+    def __init__(self, options, generation):
+        self.options = options
+        # Generation of the metrics whose children the configuration holds
+        self.generation = generation
+        self.enable_client_handling_time_histogram = options[
+            "enable_client_handling_time_histogram"
+        ]
+        self.exemplar_sampler = None
+        if options["exemplar_extractor"] is not None:
+            self.exemplar_sampler = exemplars.ExemplarSampler(
+                options["exemplar_extractor"], options["exemplar_min_interval"]
+            )
+        self.enable_client_attempt_metrics = options["enable_client_attempt_metrics"]
+        self.method_filter = options["method_filter"]
+        # (method, metadata label value) -> MethodMetrics
+        self.method_metrics = {}
 
 
 class PromAioUnaryUnaryClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
@@ -18,53 +59,160 @@ class PromAioUnaryUnaryClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
         self,
         enable_client_handling_time_histogram=False,
         legacy=False,
-        registry=REGISTRY,
+        registry=DEFAULT_REGISTRY,
+        sink=None,
+        exemplar_extractor=None,
+        exemplar_min_interval=1.0,
+        enable_client_attempt_metrics=False,
+        const_labels=None,
+        metadata_label=None,
+        method_filter=None,
+        handling_time_buckets=None,
     ):
-        self._enable_client_handling_time_histogram = enable_client_handling_time_histogram
         self._legacy = legacy
-        self._metrics = init_metrics(registry)
+        self._metrics = init_metrics(
+            registry,
+            sink,
+            const_labels,
+            None if metadata_label is None else metadata_label.extra_labels(),
+            histogram_options(handling_time_buckets, HANDLING_TIME_HISTOGRAMS),
+        )
+        self._metadata_label = metadata_label
+        self._reconfigure_lock = threading.Lock()
+        self._configuration = _Configuration(
+            {
+                "enable_client_handling_time_histogram": enable_client_handling_time_histogram,
+                "exemplar_extractor": exemplar_extractor,
+                "exemplar_min_interval": exemplar_min_interval,
+                "enable_client_attempt_metrics": enable_client_attempt_metrics,
+                "method_filter": method_filter,
+                "handling_time_buckets": handling_time_buckets,
+            },
+            self._metrics.generation,
+        )
 
-    async def intercept_unary_unary(self, continuation, client_call_details, request):
-        grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(client_call_details)
-        grpc_type = grpc_utils.UNARY
+    def reconfigure(self, **options):
+        """
+        Changes the features of the interceptor on a live client, e.g.
+        ``reconfigure(enable_client_handling_time_histogram=True)``.
 
-        self._metrics["grpc_client_started_counter"].labels(
-            grpc_type=grpc_type, grpc_service=grpc_service_name, grpc_method=grpc_method_name
-        ).inc()
+        The options are the arguments of the constructor, except ``legacy``, ``registry``,
+        ``sink``, ``const_labels`` and ``metadata_label``. The metric children of the
+        methods are bound again at their next call, and the calls in flight finish with the
+        configuration they started with. New ``handling_time_buckets`` replace the handling
+        time histogram in the registry, which restarts its series, for all its interceptors.
+        """
+        unknown = set(options) - set(self._configuration.options)
+        if unknown:
+            raise TypeError("Not reconfigurable: {}".format(", ".join(sorted(unknown))))
+        with self._reconfigure_lock:
+            new_options = dict(self._configuration.options, **options)
+            if "handling_time_buckets" in options:
+                self._metrics.replace_options(
+                    histogram_options(
+                        new_options["handling_time_buckets"], HANDLING_TIME_HISTOGRAMS
+                    )
+                )
+            self._configuration = _Configuration(new_options, self._metrics.generation)
+
+    def _get_configuration(self):
+        configuration = self._configuration
+        if configuration.generation != self._metrics.generation:
+            # Another interceptor of the registry replaced metrics whose children are held
+            with self._reconfigure_lock:
+                configuration = self._configuration
+                generation = self._metrics.generation
+                if configuration.generation != generation:
+                    configuration = _Configuration(configuration.options, generation)
+                    self._configuration = configuration
+        return configuration
 
-        start = default_timer()
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        configuration = self._get_configuration()
+        if (
+            configuration.method_filter is not None
+            and not configuration.method_filter.instrumented(client_call_details.method)
+        ):
+            return await continuation(client_call_details, request)
+        method_metrics = self._get_method_metrics(configuration, client_call_details)
+        method_metrics.started.inc()
+
+        start = None if method_metrics.latency is None else default_timer()
+        trailing_metadata = None
+        handler = None
         try:
             handler = await continuation(client_call_details, request)
             code = await handler.code()
+            if configuration.enable_client_attempt_metrics:
+                trailing_metadata = await handler.trailing_metadata()
         except grpc.aio.AioRpcError as exc:
             code = exc.code()
+            trailing_metadata = exc.trailing_metadata()
             raise exc
+        except asyncio.CancelledError:
+            # The call is cancelled by the client while the interceptor waits for its end,
+            # which only cancels the interceptor
+            if handler is not None:
+                handler.cancel()
+            code = grpc.StatusCode.CANCELLED
+            raise
         finally:
-            if self._legacy:
-                self._metrics["legacy_grpc_client_completed_latency_seconds_histogram"].labels(
-                    grpc_type=grpc_type,
-                    grpc_service=grpc_service_name,
-                    grpc_method=grpc_method_name,
-                ).observe(max(default_timer() - start, 0))
-            elif self._enable_client_handling_time_histogram:
-                self._metrics["grpc_client_handled_histogram"].labels(
-                    grpc_type=grpc_type,
-                    grpc_service=grpc_service_name,
-                    grpc_method=grpc_method_name,
-                ).observe(max(default_timer() - start, 0))
-
-            if self._legacy:
-                self._metrics["legacy_grpc_client_completed_counter"].labels(
-                    grpc_type=grpc_type,
-                    grpc_service=grpc_service_name,
-                    grpc_method=grpc_method_name,
-                    code=code.name,
-                ).inc()
-            else:
-                self._metrics["grpc_client_handled_counter"].labels(
-                    grpc_type=grpc_type,
-                    grpc_service=grpc_service_name,
-                    grpc_method=grpc_method_name,
-                    grpc_code=code.name,
-                ).inc()
+            if configuration.enable_client_attempt_metrics:
+                self._count_retry_pushback(method_metrics.labels, trailing_metadata)
+            if start is not None:
+                self._observe_with_exemplar(
+                    configuration, method_metrics.latency, start, client_call_details
+                )
+            self._inc_with_exemplar(
+                configuration, method_metrics.handled(code.name), client_call_details
+            )
         return handler
+
+    def _get_method_metrics(self, configuration, client_call_details):
+        label_value = None
+        if self._metadata_label is not None:
+            label_value = self._metadata_label.value(client_call_details.metadata)
+        method_metrics_cache = configuration.method_metrics
+        cache_key = (client_call_details.method, label_value)
+        method_metrics = method_metrics_cache.get(cache_key)
+        if method_metrics is None:
+            method_metrics = method_metrics_cache[cache_key] = MethodMetrics(
+                self._metrics,
+                grpc_utils.UNARY,
+                client_call_details.method,
+                legacy=self._legacy,
+                handling_time=configuration.enable_client_handling_time_histogram,
+                metadata_label=self._metadata_label,
+                label_value=label_value,
+            )
+        return method_metrics
+
+    def _count_retry_pushback(self, labels, trailing_metadata):
+        """Counts the retry pushbacks of the server, a negative pushback stops the retries."""
+        pushback = grpc_utils.get_metadata_value(trailing_metadata, grpc_utils.RETRY_PUSHBACK_KEY)
+        if pushback is None:
+            return
+        try:
+            stop = int(pushback) < 0
+        except ValueError:
+            stop = True
+        self._metrics["grpc_client_retry_pushback_counter"].labels(
+            pushback="stop" if stop else "delay", **labels
+        ).inc()
+
+    def _observe_with_exemplar(self, configuration, histogram, start, client_call_details):
+        histogram.observe(
+            max(default_timer() - start, 0),
+            self._sample_exemplar(configuration, histogram, client_call_details.metadata),
+        )
+
+    def _inc_with_exemplar(self, configuration, counter, client_call_details):
+        counter.inc(
+            exemplar=self._sample_exemplar(configuration, counter, client_call_details.metadata)
+        )
+
+    @staticmethod
+    def _sample_exemplar(configuration, series, metadata):
+        if configuration.exemplar_sampler is None:
+            return None
+        return configuration.exemplar_sampler.sample(series, metadata)
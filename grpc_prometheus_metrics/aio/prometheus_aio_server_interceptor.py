@@ -1,19 +1,85 @@
 """Interceptor a client call with prometheus"""
+import asyncio
 import logging
+import threading
+import time
 
 from timeit import default_timer
 from typing import Awaitable, Callable
 
 from grpc.aio._interceptor import ServerInterceptor
 import grpc
-from prometheus_client.registry import REGISTRY
 
+from grpc_prometheus_metrics import exemplars  # type: ignore
 from grpc_prometheus_metrics import grpc_utils  # type: ignore
 from grpc_prometheus_metrics import server_metrics  # type: ignore
+from grpc_prometheus_metrics import slow_calls  # type: ignore
 
 
 _LOGGER = logging.getLogger(__name__)
 
+# Terminations this close to the deadline are attributed to the deadline
+_DEADLINE_TOLERANCE = 0.01
+
+
+class _Configuration:
+    """
+    Reconfigurable options of the interceptor and the per method state built from them.
+    A reconfiguration replaces the whole configuration, which a call reads once, when it
+    starts, as does a replacement of the metrics of the registry by another interceptor.
+    """
+
+    __slots__ = (
+        "options",
+        "generation",
+        "enable_handling_time_histogram",
+        "skip_exceptions",
+        "log_exceptions",
+        "unary_only",
+        "exemplar_sampler",
+        "slow_call_recorder",
+        "heavy_hitters",
+        "enable_deadline_metrics",
+        "load_shedder",
+        "enable_attempt_metrics",
+        "method_filter",
+        "fast_path",
+        "fast_handlers",
+    )
+
+    def __init__(self, options, generation):
+        self.options = options
+        # Generation of the metrics whose children the configuration holds
+        self.generation = generation
+        self.enable_handling_time_histogram = options["enable_handling_time_histogram"]
+        self.skip_exceptions = options["skip_exceptions"]
+        self.log_exceptions = options["log_exceptions"]
+        self.unary_only = options["unary_only"]
+        self.exemplar_sampler = None
+        if options["exemplar_extractor"] is not None:
+            self.exemplar_sampler = exemplars.ExemplarSampler(
+                options["exemplar_extractor"], options["exemplar_min_interval"]
+            )
+        self.slow_call_recorder = options["slow_call_recorder"]
+        self.heavy_hitters = options["heavy_hitters"]
+        self.enable_deadline_metrics = options["enable_deadline_metrics"]
+        self.load_shedder = options["load_shedder"]
+        self.enable_attempt_metrics = options["enable_attempt_metrics"]
+        self.method_filter = options["method_filter"]
+        # Without the per call features, the calls take specialized wrappers doing only the
+        # enabled work, cached per method with their metric children
+        self.fast_path = not (
+            self.skip_exceptions
+            or self.exemplar_sampler is not None
+            or self.slow_call_recorder is not None
+            or self.heavy_hitters is not None
+            or self.enable_deadline_metrics
+            or self.load_shedder is not None
+            or self.enable_attempt_metrics
+        )
+        # method, or (method, metadata label value) -> (original handler, wrapped handler)
+        self.fast_handlers = {}
+
 
 # We were forced to write this class because
 #   https://github.com/lchenn/py-grpc-prometheus/issues/13
@@ -27,22 +93,88 @@ class PromAioServerInterceptor(ServerInterceptor):
         legacy=False,
         skip_exceptions=False,
         log_exceptions=True,
-        registry=REGISTRY,
+        registry=server_metrics.DEFAULT_REGISTRY,
         unary_only=False,
+        sink=None,
+        exemplar_extractor=None,
+        exemplar_min_interval=1.0,
+        slow_call_recorder=None,
+        heavy_hitters=None,
+        enable_deadline_metrics=False,
+        load_shedder=None,
+        enable_attempt_metrics=False,
+        metadata_label=None,
+        method_filter=None,
+        handling_time_buckets=None,
     ) -> None:
-        self._enable_handling_time_histogram = enable_handling_time_histogram
         self._legacy = legacy
-        self._grpc_server_handled_total_counter = server_metrics.get_grpc_server_handled_counter(
-            self._legacy, registry
+        # The metrics are created at their first use
+        self._metrics = server_metrics.init_metrics(
+            registry,
+            sink,
+            None if metadata_label is None else metadata_label.extra_labels(),
+            server_metrics.histogram_options(handling_time_buckets),
         )
-        self._metrics = server_metrics.init_metrics(registry)
-        self._skip_exceptions = skip_exceptions
-        self._log_exceptions = log_exceptions
-        self._unary_only = unary_only
-
+        self._handled_counter_key = (
+            "legacy_grpc_server_handled_counter" if legacy else "grpc_server_handled_counter"
+        )
+        self._metadata_label = metadata_label
         # This is a constraint of current grpc.StatusCode design
         # https://groups.google.com/g/grpc-io/c/EdIXjMEaOyw/m/d3DeqmrJAAAJ
         self._code_to_status_mapping = {x.value[0]: x for x in grpc.StatusCode}
+        self._reconfigure_lock = threading.Lock()
+        self._configuration = _Configuration(
+            {
+                "enable_handling_time_histogram": enable_handling_time_histogram,
+                "handling_time_buckets": handling_time_buckets,
+                "skip_exceptions": skip_exceptions,
+                "log_exceptions": log_exceptions,
+                "unary_only": unary_only,
+                "exemplar_extractor": exemplar_extractor,
+                "exemplar_min_interval": exemplar_min_interval,
+                "slow_call_recorder": slow_call_recorder,
+                "heavy_hitters": heavy_hitters,
+                "enable_deadline_metrics": enable_deadline_metrics,
+                "load_shedder": load_shedder,
+                "enable_attempt_metrics": enable_attempt_metrics,
+                "method_filter": method_filter,
+            },
+            self._metrics.generation,
+        )
+
+    def reconfigure(self, **options):
+        """
+        Changes the features of the interceptor on a live server, e.g.
+        ``reconfigure(enable_handling_time_histogram=True)``.
+
+        The options are the arguments of the constructor, except ``legacy``, ``registry``,
+        ``sink`` and ``metadata_label``. The wrapped handlers of the methods are rebuilt at
+        their next call, and the calls in flight finish with the configuration they started
+        with. New ``handling_time_buckets`` replace the handling time histogram in the
+        registry, which restarts its series, for all its interceptors.
+        """
+        unknown = set(options) - set(self._configuration.options)
+        if unknown:
+            raise TypeError("Not reconfigurable: {}".format(", ".join(sorted(unknown))))
+        with self._reconfigure_lock:
+            new_options = dict(self._configuration.options, **options)
+            if "handling_time_buckets" in options:
+                self._metrics.replace_options(
+                    server_metrics.histogram_options(new_options["handling_time_buckets"])
+                )
+            self._configuration = _Configuration(new_options, self._metrics.generation)
+
+    def _get_configuration(self):
+        configuration = self._configuration
+        if configuration.generation != self._metrics.generation:
+            # Another interceptor of the registry replaced metrics whose children are held
+            with self._reconfigure_lock:
+                configuration = self._configuration
+                generation = self._metrics.generation
+                if configuration.generation != generation:
+                    configuration = _Configuration(configuration.options, generation)
+                    self._configuration = configuration
+        return configuration
 
     async def intercept_service(
         self,
@@ -59,15 +191,49 @@ class PromAioServerInterceptor(ServerInterceptor):
         https://grpc.io/grpc/python/grpc.html#service-side-interceptor
         """
 
+        configuration = self._get_configuration()
+        handler = await continuation(handler_call_details)
+        if (
+            configuration.unary_only
+            and handler
+            and (handler.request_streaming or handler.response_streaming)
+        ):
+            return handler
+        if (
+            configuration.method_filter is not None
+            and not configuration.method_filter.instrumented(handler_call_details.method)
+        ):
+            return handler
+
+        label_value = None
+        if self._metadata_label is not None:
+            label_value = self._metadata_label.value(handler_call_details.invocation_metadata)
+
+        if configuration.fast_path:
+            return self._get_fast_handler(
+                configuration, handler, handler_call_details.method, label_value
+            )
+
         grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(handler_call_details)
 
         def metrics_wrapper(behavior, request_streaming, response_streaming):
             async def new_behavior(request_or_iterator, servicer_context):
                 response_or_iterator = None
+                grpc_code = None
+                call_counts = None
+                call_deadline = None
+                attempt_histogram = None
                 try:
                     start = default_timer()
                     grpc_type = grpc_utils.get_method_type(request_streaming, response_streaming)
                     try:
+                        if not response_streaming and (
+                            configuration.slow_call_recorder is not None
+                            or configuration.heavy_hitters is not None
+                        ):
+                            # Messages and bytes received and sent, the streamed requests
+                            # are counted
+                            call_counts = [int(not request_streaming), 1, 0, 0]
                         if request_streaming:
                             request_or_iterator = grpc_utils.wrap_iterator_inc_counter(
                                 request_or_iterator,
@@ -76,12 +242,40 @@ class PromAioServerInterceptor(ServerInterceptor):
                                 grpc_service_name,
                                 grpc_method_name,
                             )
+                            if call_counts is not None:
+                                request_or_iterator = grpc_utils.wrap_iterator_count(
+                                    request_or_iterator,
+                                    call_counts,
+                                    0,
+                                    None if configuration.heavy_hitters is None else 2,
+                                )
                         else:
                             self._metrics["grpc_server_started_counter"].labels(
-                                grpc_type=grpc_type,
-                                grpc_service=grpc_service_name,
-                                grpc_method=grpc_method_name,
+                                **self._metric_labels(
+                                    "grpc_server_started_counter",
+                                    {
+                                        "grpc_type": grpc_type,
+                                        "grpc_service": grpc_service_name,
+                                        "grpc_method": grpc_method_name,
+                                    },
+                                    label_value,
+                                )
                             ).inc()
+                        if configuration.enable_deadline_metrics:
+                            call_deadline = self._track_deadline(
+                                servicer_context,
+                                start,
+                                grpc_type,
+                                grpc_service_name,
+                                grpc_method_name,
+                            )
+                        if configuration.enable_attempt_metrics:
+                            attempt_histogram = self._count_attempt(
+                                handler_call_details,
+                                grpc_type,
+                                grpc_service_name,
+                                grpc_method_name,
+                            )
 
                         # Invoke the original rpc behavior.
                         response_or_iterator = await behavior(request_or_iterator, servicer_context)
@@ -97,59 +291,116 @@ class PromAioServerInterceptor(ServerInterceptor):
                             )
 
                         else:
+                            grpc_code = self._compute_status_code(servicer_context).name
                             self.increase_grpc_server_handled_total_counter(
                                 grpc_type,
                                 grpc_service_name,
                                 grpc_method_name,
-                                self._compute_status_code(servicer_context).name,
+                                grpc_code,
+                                handler_call_details.invocation_metadata,
+                                label_value,
+                                configuration=configuration,
                             )
                         return response_or_iterator
                     except grpc.RpcError as e:
+                        grpc_code = self._compute_error_code(e).name
                         self.increase_grpc_server_handled_total_counter(
                             grpc_type,
                             grpc_service_name,
                             grpc_method_name,
-                            self._compute_error_code(e).name,
+                            grpc_code,
+                            handler_call_details.invocation_metadata,
+                            label_value,
+                            configuration=configuration,
                         )
                         raise e
+                    except asyncio.CancelledError:
+                        # The call was cancelled, or missed its deadline, like the sync servers
+                        grpc_code = grpc.StatusCode.CANCELLED.name
+                        self.increase_grpc_server_handled_total_counter(
+                            grpc_type,
+                            grpc_service_name,
+                            grpc_method_name,
+                            grpc_code,
+                            handler_call_details.invocation_metadata,
+                            label_value,
+                            configuration=configuration,
+                        )
+                        raise
 
                     finally:
 
                         if not response_streaming:
+                            histogram = None
+                            histogram_key = None
                             if self._legacy:
-                                self._metrics["legacy_grpc_server_handled_latency_seconds"].labels(
-                                    grpc_type=grpc_type,
-                                    grpc_service=grpc_service_name,
-                                    grpc_method=grpc_method_name,
-                                ).observe(max(default_timer() - start, 0))
-                            elif self._enable_handling_time_histogram:
-                                self._metrics["grpc_server_handled_histogram"].labels(
-                                    grpc_type=grpc_type,
-                                    grpc_service=grpc_service_name,
-                                    grpc_method=grpc_method_name,
-                                ).observe(max(default_timer() - start, 0))
+                                histogram_key = "legacy_grpc_server_handled_latency_seconds"
+                            elif configuration.enable_handling_time_histogram:
+                                histogram_key = "grpc_server_handled_histogram"
+                            if histogram_key is not None:
+                                histogram = self._metrics[histogram_key].labels(
+                                    **self._metric_labels(
+                                        histogram_key,
+                                        {
+                                            "grpc_type": grpc_type,
+                                            "grpc_service": grpc_service_name,
+                                            "grpc_method": grpc_method_name,
+                                        },
+                                        label_value,
+                                    )
+                                )
+                            if histogram is not None:
+                                histogram.observe(
+                                    max(default_timer() - start, 0),
+                                    self._sample_exemplar(
+                                        configuration,
+                                        histogram,
+                                        handler_call_details.invocation_metadata,
+                                    ),
+                                )
+                            if attempt_histogram is not None:
+                                attempt_histogram.observe(max(default_timer() - start, 0))
+                            if call_deadline is not None:
+                                self._record_wasted_time(
+                                    call_deadline, grpc_type, handler_call_details
+                                )
+                            if call_counts is not None:
+                                self._record_call(
+                                    configuration,
+                                    handler_call_details,
+                                    servicer_context,
+                                    start,
+                                    grpc_code or grpc.StatusCode.UNKNOWN.name,
+                                    call_counts,
+                                    None if request_streaming else request_or_iterator,
+                                    response_or_iterator,
+                                )
                 except Exception as e:  # pylint: disable=broad-except
                     # Allow user to skip the exceptions in order to maintain
                     # the basic functionality in the server
                     # The logging function in exception can be toggled with log_exceptions
                     # in order to suppress the noise in logging
-                    if self._skip_exceptions:
-                        if self._log_exceptions:
+                    if configuration.skip_exceptions:
+                        if configuration.log_exceptions:
                             _LOGGER.error(e)
                         if response_or_iterator is None:
                             return response_or_iterator
                         return behavior(request_or_iterator, servicer_context)
                     raise e
 
+            if configuration.load_shedder is not None:
+                return self._shed_load(
+                    configuration,
+                    new_behavior,
+                    request_streaming,
+                    response_streaming,
+                    handler_call_details,
+                    grpc_service_name,
+                    grpc_method_name,
+                    label_value,
+                )
             return new_behavior
 
-        handler = await continuation(handler_call_details)
-        if (
-            self._unary_only
-            and handler
-            and (handler.request_streaming or handler.response_streaming)
-        ):
-            return handler
         optional_any = self._wrap_rpc_behavior(handler, metrics_wrapper)
 
         return optional_any
@@ -158,10 +409,14 @@ class PromAioServerInterceptor(ServerInterceptor):
         if servicer_context.cancelled():
             return grpc.StatusCode.CANCELLED
 
-        if servicer_context.code() is None:
+        code = servicer_context.code()
+        if code is None:
             return grpc.StatusCode.OK
+        # Recent grpc versions return the status code itself
+        if isinstance(code, grpc.StatusCode):
+            return code
 
-        return self._code_to_status_mapping[servicer_context.code()]
+        return self._code_to_status_mapping[code]
 
     def _compute_error_code(self, grpc_exception):
         if isinstance(grpc_exception, grpc.aio.Call):
@@ -170,22 +425,328 @@ class PromAioServerInterceptor(ServerInterceptor):
         return grpc.StatusCode.UNKNOWN
 
     def increase_grpc_server_handled_total_counter(
-        self, grpc_type, grpc_service_name, grpc_method_name, grpc_code
+        self,
+        grpc_type,
+        grpc_service_name,
+        grpc_method_name,
+        grpc_code,
+        invocation_metadata=None,
+        label_value=None,
+        configuration=None,
+    ):
+        labels = {
+            "grpc_type": grpc_type,
+            "grpc_service": grpc_service_name,
+            "grpc_method": grpc_method_name,
+            "code" if self._legacy else "grpc_code": grpc_code,
+        }
+        counter = self._metrics[self._handled_counter_key].labels(
+            **self._metric_labels(self._handled_counter_key, labels, label_value)
+        )
+        counter.inc(
+            exemplar=self._sample_exemplar(
+                configuration or self._get_configuration(), counter, invocation_metadata
+            )
+        )
+
+    def _metric_labels(self, key, labels, label_value):
+        """Adds the metadata label value to the labels of the metrics taking it."""
+        if self._metadata_label is None:
+            return labels
+        return self._metadata_label.labels(key, labels, label_value)
+
+    def _get_fast_handler(self, configuration, handler, method, label_value=None):
+        if handler is None:
+            return None
+        fast_handlers = configuration.fast_handlers
+        cache_key = method if label_value is None else (method, label_value)
+        cached = fast_handlers.get(cache_key)
+        if cached is not None and cached[0] is handler:
+            return cached[1]
+        wrapped_handler = self._wrap_rpc_behavior(
+            handler, self._fast_metrics_wrapper(configuration, method, label_value)
+        )
+        fast_handlers[cache_key] = (handler, wrapped_handler)
+        return wrapped_handler
+
+    def _fast_metrics_wrapper(self, configuration, method, label_value=None):
+        """
+        Returns the metrics wrapper specialized for the RPC kind, the enabled metrics and
+        the metadata label value.
+        """
+        grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_name(method)
+        metric_labels = self._metric_labels
+
+        def metrics_wrapper(behavior, request_streaming, response_streaming):
+            labels = {
+                "grpc_type": grpc_utils.get_method_type(request_streaming, response_streaming),
+                "grpc_service": grpc_service_name,
+                "grpc_method": grpc_method_name,
+            }
+            handled = grpc_utils.code_children(
+                self._metrics[self._handled_counter_key],
+                metric_labels(self._handled_counter_key, labels, label_value),
+                "code" if self._legacy else "grpc_code",
+            )
+            compute_error_code = self._compute_error_code
+            compute_status_code = self._compute_status_code
+
+            if request_streaming:
+                received = self._metrics["grpc_server_stream_msg_received"].labels(**labels)
+
+                def count_request(request_iterator):
+                    return grpc_utils.wrap_iterator_inc(request_iterator, received)
+
+            else:
+                started = self._metrics["grpc_server_started_counter"].labels(
+                    **metric_labels("grpc_server_started_counter", labels, label_value)
+                )
+
+                def count_request(request):
+                    started.inc()
+                    return request
+
+            if response_streaming:
+                sent = self._metrics["grpc_server_stream_msg_sent"].labels(**labels)
+
+                async def stream_behavior(request_or_iterator, servicer_context):
+                    try:
+                        return grpc_utils.wrap_iterator_inc(
+                            await behavior(count_request(request_or_iterator), servicer_context),
+                            sent,
+                        )
+                    except grpc.RpcError as e:
+                        handled(compute_error_code(e).name).inc()
+                        raise e
+
+                return stream_behavior
+
+            histogram_key = None
+            if self._legacy:
+                histogram_key = "legacy_grpc_server_handled_latency_seconds"
+            elif configuration.enable_handling_time_histogram:
+                histogram_key = "grpc_server_handled_histogram"
+
+            if histogram_key is None:
+
+                async def counted_behavior(request_or_iterator, servicer_context):
+                    try:
+                        response = await behavior(
+                            count_request(request_or_iterator), servicer_context
+                        )
+                    except grpc.RpcError as e:
+                        handled(compute_error_code(e).name).inc()
+                        raise e
+                    except asyncio.CancelledError:
+                        handled(grpc.StatusCode.CANCELLED.name).inc()
+                        raise
+                    handled(compute_status_code(servicer_context).name).inc()
+                    return response
+
+                return counted_behavior
+
+            latency = self._metrics[histogram_key].labels(
+                **metric_labels(histogram_key, labels, label_value)
+            )
+
+            async def timed_behavior(request_or_iterator, servicer_context):
+                start = default_timer()
+                try:
+                    response = await behavior(count_request(request_or_iterator), servicer_context)
+                except grpc.RpcError as e:
+                    handled(compute_error_code(e).name).inc()
+                    raise e
+                except asyncio.CancelledError:
+                    handled(grpc.StatusCode.CANCELLED.name).inc()
+                    raise
+                finally:
+                    latency.observe(max(default_timer() - start, 0))
+                handled(compute_status_code(servicer_context).name).inc()
+                return response
+
+            return timed_behavior
+
+        return metrics_wrapper
+
+    def _shed_load(
+        self,
+        configuration,
+        behavior,
+        request_streaming,
+        response_streaming,
+        handler_call_details,
+        grpc_service_name,
+        grpc_method_name,
+        label_value=None,
     ):
-        if self._legacy:
-            self._grpc_server_handled_total_counter.labels(
+        """Wraps the behavior to reject the calls over the concurrency limit of the method."""
+        limiter = configuration.load_shedder.limiter(handler_call_details.method)
+
+        async def shedding_behavior(request_or_iterator, servicer_context):
+            if not limiter.acquire():
+                # Counted as the calls the behavior would have handled: started unless the
+                # requests are streamed, handled unless the responses are
+                grpc_type = grpc_utils.get_method_type(request_streaming, response_streaming)
+                if not request_streaming:
+                    self._metrics["grpc_server_started_counter"].labels(
+                        **self._metric_labels(
+                            "grpc_server_started_counter",
+                            {
+                                "grpc_type": grpc_type,
+                                "grpc_service": grpc_service_name,
+                                "grpc_method": grpc_method_name,
+                            },
+                            label_value,
+                        )
+                    ).inc()
+                if not response_streaming:
+                    self.increase_grpc_server_handled_total_counter(
+                        grpc_type,
+                        grpc_service_name,
+                        grpc_method_name,
+                        grpc.StatusCode.RESOURCE_EXHAUSTED.name,
+                        handler_call_details.invocation_metadata,
+                        label_value,
+                        configuration=configuration,
+                    )
+                await servicer_context.abort(
+                    grpc.StatusCode.RESOURCE_EXHAUSTED, "Concurrency limit exceeded"
+                )
+
+            start = default_timer()
+
+            def release(_=None):
+                # Missing the deadline is the sign of an overloaded server
+                time_remaining = grpc_utils.get_time_remaining(servicer_context)
+                limiter.release(
+                    default_timer() - start, time_remaining is not None and time_remaining <= 0
+                )
+
+            try:
+                response_or_iterator = await behavior(request_or_iterator, servicer_context)
+            except BaseException:
+                release()
+                raise
+            if response_streaming:
+                return grpc_utils.wrap_iterator_done(response_or_iterator, release)
+            release()
+            return response_or_iterator
+
+        return shedding_behavior
+
+    def _count_attempt(self, handler_call_details, grpc_type, grpc_service_name, grpc_method_name):
+        """Counts the attempt of the RPC and returns its attempt latency histogram."""
+        attempt = str(grpc_utils.get_attempt(handler_call_details.invocation_metadata))
+        self._metrics["grpc_server_attempts_counter"].labels(
+            grpc_type=grpc_type,
+            grpc_service=grpc_service_name,
+            grpc_method=grpc_method_name,
+            attempt=attempt,
+        ).inc()
+        return self._metrics["grpc_server_attempt_handling_histogram"].labels(
+            grpc_type=grpc_type,
+            grpc_service=grpc_service_name,
+            grpc_method=grpc_method_name,
+            attempt=attempt,
+        )
+
+    def _track_deadline(
+        self, servicer_context, start, grpc_type, grpc_service_name, grpc_method_name
+    ):
+        """Observes the time left before the deadline and notes when the RPC terminates."""
+        # Deadline and termination time of the call, on the default_timer clock
+        call_deadline = [None, None]
+        time_remaining = grpc_utils.get_time_remaining(servicer_context)
+        if time_remaining is not None:
+            self._metrics["grpc_server_deadline_remaining_seconds"].labels(
                 grpc_type=grpc_type,
                 grpc_service=grpc_service_name,
                 grpc_method=grpc_method_name,
-                code=grpc_code,
-            ).inc()
+            ).observe(time_remaining)
+            call_deadline[0] = start + time_remaining
+
+        def on_terminated(_):
+            call_deadline[1] = default_timer()
+
+        servicer_context.add_done_callback(on_terminated)
+        return call_deadline
+
+    def _record_wasted_time(self, call_deadline, grpc_type, handler_call_details):
+        """Counts the handling time spent after the RPC was terminated by the client."""
+        end = default_timer()
+        deadline, terminated = call_deadline
+        if terminated is None or terminated >= end:
+            return
+
+        if deadline is not None and terminated >= deadline - _DEADLINE_TOLERANCE:
+            reason = "deadline_exceeded"
         else:
-            self._grpc_server_handled_total_counter.labels(
-                grpc_type=grpc_type,
-                grpc_service=grpc_service_name,
-                grpc_method=grpc_method_name,
-                grpc_code=grpc_code,
-            ).inc()
+            reason = "cancelled"
+        grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(handler_call_details)
+        self._metrics["grpc_server_wasted_seconds"].labels(
+            grpc_type=grpc_type,
+            grpc_service=grpc_service_name,
+            grpc_method=grpc_method_name,
+            reason=reason,
+        ).inc(end - terminated)
+        self._metrics["grpc_server_wasted_counter"].labels(
+            grpc_type=grpc_type,
+            grpc_service=grpc_service_name,
+            grpc_method=grpc_method_name,
+            reason=reason,
+        ).inc()
+
+    def _record_call(
+        self,
+        configuration,
+        handler_call_details,
+        servicer_context,
+        start,
+        grpc_code,
+        call_counts,
+        request=None,
+        response=None,
+    ):
+        """Records a finished call in the slow calls and the heavy hitters."""
+        duration = max(default_timer() - start, 0)
+        method = handler_call_details.method
+        recorder = configuration.slow_call_recorder
+        heavy_hitters = configuration.heavy_hitters
+        is_slow = recorder is not None and duration >= recorder.threshold(method)
+        if heavy_hitters is None and not is_slow:
+            return
+
+        request_bytes = grpc_utils.message_size(request)
+        response_bytes = grpc_utils.message_size(response)
+        if heavy_hitters is not None:
+            # The streamed messages are counted at index 2 and 3
+            request_bytes = call_counts[2] + (request_bytes or 0)
+            response_bytes = call_counts[3] + (response_bytes or 0)
+            heavy_hitters.add(
+                servicer_context.peer(), method, request_bytes + response_bytes, duration
+            )
+
+        if not is_slow:
+            return
+        recorder.add(
+            slow_calls.SlowCall(
+                method=method,
+                peer=servicer_context.peer(),
+                code=grpc_code,
+                duration=duration,
+                messages_received=call_counts[0],
+                messages_sent=call_counts[1],
+                request_bytes=request_bytes,
+                response_bytes=response_bytes,
+                timestamp=time.time(),
+            )
+        )
+
+    @staticmethod
+    def _sample_exemplar(configuration, series, invocation_metadata):
+        if configuration.exemplar_sampler is None:
+            return None
+        return configuration.exemplar_sampler.sample(series, invocation_metadata)
 
     def _wrap_rpc_behavior(self, handler, fn):
         """Returns a new rpc handler that wraps the given function"""
@@ -0,0 +1,83 @@
+"""Export prometheus metrics to a file from the asyncio event loop of a grpc.aio server"""
+import asyncio
+import logging
+
+from timeit import default_timer
+
+from prometheus_client.registry import REGISTRY
+
+from grpc_prometheus_metrics import textfile_exporter
+from grpc_prometheus_metrics.family_exposition import OPENMETRICS_EOF
+from grpc_prometheus_metrics.family_exposition import encode_family
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AioTextfileExporter(textfile_exporter.TextfileExporter):
+    """
+    The ``TextfileExporter`` as a task of the current event loop, without a thread.
+
+    The registry is rendered one metric family at a time and the loop is given back
+    whenever rendering has taken longer than ``max_slice_seconds``, like the
+    ``AioMetricsServer``. The file is written by the default executor.
+    """
+
+    def __init__(
+        self,
+        path,
+        registry=REGISTRY,
+        interval=15.0,
+        openmetrics=False,
+        max_cpu_fraction=0.05,
+        max_slice_seconds=0.005,
+    ):
+        super().__init__(path, registry, interval, openmetrics, max_cpu_fraction)
+        self._openmetrics = openmetrics
+        self._max_slice_seconds = max_slice_seconds
+        self._task = None
+
+    async def render_async(self):
+        """Renders the registry, yielding to the loop between slices."""
+        chunks = []
+        slice_start = default_timer()
+        for family in self._registry.collect():
+            chunks.append(encode_family(self._encoder, family, self._openmetrics))
+
+            if default_timer() - slice_start >= self._max_slice_seconds:
+                await asyncio.sleep(0)
+                slice_start = default_timer()
+
+        if self._openmetrics:
+            chunks.append(OPENMETRICS_EOF)
+        return b"".join(chunks)
+
+    async def write_async(self):
+        output = await self.render_async()
+        return await asyncio.get_running_loop().run_in_executor(None, self.write_output, output)
+
+    async def start(self):  # pylint: disable=invalid-overridden-method
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run_async())
+        return self
+
+    async def stop(self):  # pylint: disable=invalid-overridden-method
+        """Cancels the task and writes the file a last time."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.write_async()
+
+    async def _run_async(self):
+        while True:
+            # The wall time of a render spread over the loop overestimates its CPU time
+            start = default_timer()
+            try:
+                await self.write_async()
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.error(e)
+            await asyncio.sleep(self.next_wait(default_timer() - start))
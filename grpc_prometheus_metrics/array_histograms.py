@@ -0,0 +1,178 @@
+"""Histograms of all the series of a metric in a single array"""
+import threading
+import time
+
+from array import array
+from bisect import bisect_left
+from functools import partial
+from itertools import accumulate
+
+from prometheus_client import Counter
+from prometheus_client import Histogram
+from prometheus_client.metrics_core import Metric
+from prometheus_client.registry import REGISTRY
+from prometheus_client.samples import Exemplar
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+
+from grpc_prometheus_metrics.compact_metrics import upper_bounds_of
+
+
+class _ArrayHistogramChild:
+    """Row of a series in the array of its histogram, whose ``observe()`` updates it."""
+
+    __slots__ = ("_histogram", "_offset", "observe")
+
+    def __init__(self, histogram, offset):
+        self._histogram = histogram
+        self._offset = offset
+        self.observe = partial(histogram.observe, offset)
+
+    @property
+    def _upper_bounds(self):
+        return self._histogram.upper_bounds
+
+    def restore(self, cumulative_counts, total):
+        """Adds the cumulative bucket counts and the sum of a snapshot to the series."""
+        self._histogram.restore(self._offset, cumulative_counts, total)
+
+
+class _ArrayHistogram:
+    """
+    Mimics the ``labels()`` API of the prometheus_client histograms used by the
+    interceptors. The bucket counts of every series, not cumulative, and their sum are the
+    rows of one array, which grows by a row per new series.
+    """
+
+    def __init__(self, name, documentation, labelnames, upper_bounds):
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._type = "histogram"
+        self.upper_bounds = upper_bounds
+        self._le = [floatToGoString(bound) for bound in upper_bounds]
+        self._width = len(upper_bounds) + 1
+        self._lock = threading.Lock()
+        self._data = array("d")
+        self._empty_row = array("d", bytes(8 * self._width))
+        # Label values of each row, and label values -> child
+        self._rows = []
+        self._children = {}
+        # (offset, bucket index) -> last exemplar
+        self._exemplars = {}
+
+    def labels(self, **labels):
+        if len(labels) != len(self._labelnames):
+            raise ValueError("Incorrect label names")
+        try:
+            labelvalues = tuple(str(labels[name]) for name in self._labelnames)
+        except KeyError:
+            raise ValueError("Incorrect label names") from None
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.get(labelvalues)
+                if child is None:
+                    child = self._new_child(len(self._data))
+                    self._data.extend(self._empty_row)
+                    self._rows.append(labelvalues)
+                    self._children[labelvalues] = child
+        return child
+
+    def _new_child(self, offset):
+        return _ArrayHistogramChild(self, offset)
+
+    def observe(self, offset, amount, exemplar=None):
+        index = bisect_left(self.upper_bounds, amount)
+        data = self._data
+        with self._lock:
+            data[offset + index] += 1
+            data[offset + self._width - 1] += amount
+        if exemplar:
+            self._exemplars[offset, index] = Exemplar(exemplar, amount, time.time())
+
+    def restore(self, offset, cumulative_counts, total):
+        data = self._data
+        with self._lock:
+            previous = 0.0
+            for index, count in enumerate(cumulative_counts):
+                data[offset + index] += count - previous
+                previous = count
+            data[offset + self._width - 1] += total
+
+    def describe(self):
+        return [Metric(self._name, self._documentation, self._type)]
+
+    def collect(self):
+        family = Metric(self._name, self._documentation, self._type)
+        # A single copy of the array, the RPCs are not blocked while the samples are built
+        with self._lock:
+            data = self._data[:]
+            rows = list(self._rows)
+        exemplars = dict(self._exemplars)
+        samples = family.samples
+        width = self._width
+        buckets = list(enumerate(self._le))
+        bucket_name = self._name + "_bucket"
+        count_name = self._name + "_count"
+        sum_name = self._name + "_sum"
+        # The sum of negative observations is not exported, as by prometheus_client
+        has_sum = self.upper_bounds[0] >= 0
+        for row, labelvalues in enumerate(rows):
+            offset = row * width
+            labels = dict(zip(self._labelnames, labelvalues))
+            cumulative_counts = list(accumulate(data[offset : offset + width - 1]))
+            samples.extend(
+                [
+                    Sample(
+                        bucket_name,
+                        dict(labels, le=le),
+                        cumulative_counts[index],
+                        None,
+                        exemplars.get((offset, index)),
+                    )
+                    for index, le in buckets
+                ]
+            )
+            samples.append(Sample(count_name, labels, cumulative_counts[-1], None, None))
+            if has_sum:
+                samples.append(Sample(sum_name, labels, data[offset + width - 1], None, None))
+        return [family]
+
+
+class ArrayHistograms:
+    """
+    Stores the interceptor histograms of a registry as arrays, for services with many
+    methods.
+
+    The bucket counts and the sum of all the series of a histogram are the rows of a single
+    array, and an observation is a binary search of the precomputed bounds and two
+    increments under one lock. A scrape copies the array at once and builds the samples
+    from it, without taking a lock per series or bucket. The histograms are registered in
+    the registry and scraped like the prometheus_client ones, without their ``_created``
+    samples. The counters are the prometheus_client ones, or those of the ``counters`` sink.
+
+    Pass it as the ``sink`` of the interceptors.
+    """
+
+    def __init__(self, registry=REGISTRY, counters=None):
+        self._registry = registry
+        self._counters = counters
+
+    def counter(self, name, documentation, labelnames, **kwargs):
+        if self._counters is not None:
+            return self._counters.counter(name, documentation, labelnames, **kwargs)
+        return Counter(name, documentation, labelnames, registry=self._registry, **kwargs)
+
+    def histogram(self, name, documentation, labelnames, buckets=Histogram.DEFAULT_BUCKETS):
+        metric = _ArrayHistogram(name, documentation, labelnames, upper_bounds_of(buckets))
+        self._registry.register(metric)
+        return metric
+
+    def unregister(self, metric):
+        if isinstance(metric, _ArrayHistogram) or self._counters is None:
+            self._registry.unregister(metric)
+        else:
+            unregister = getattr(self._counters, "unregister", None)
+            if unregister is not None:
+                unregister(metric)
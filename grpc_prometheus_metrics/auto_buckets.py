@@ -0,0 +1,425 @@
+"""Buckets of the handling time histograms chosen from the latencies of a warmup"""
+import math
+import threading
+import time
+import weakref
+
+from array import array
+from bisect import bisect_left
+from functools import partial
+from itertools import accumulate
+from timeit import default_timer
+
+from prometheus_client import Histogram
+from prometheus_client.metrics_core import Metric
+from prometheus_client.registry import REGISTRY
+from prometheus_client.samples import Exemplar
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+
+from grpc_prometheus_metrics import client_metrics
+from grpc_prometheus_metrics import server_metrics
+from grpc_prometheus_metrics.array_histograms import ArrayHistograms
+from grpc_prometheus_metrics.array_histograms import _ArrayHistogram
+from grpc_prometheus_metrics.array_histograms import _ArrayHistogramChild
+from grpc_prometheus_metrics.compact_metrics import upper_bounds_of
+
+
+# Names of the histograms whose buckets are tuned by default
+HANDLING_TIME_HISTOGRAM_NAMES = tuple(
+    server_metrics.SERVER_METRICS[key][1] for key in server_metrics.HANDLING_TIME_HISTOGRAMS
+) + tuple(client_metrics.CLIENT_METRICS[key][1] for key in client_metrics.HANDLING_TIME_HISTOGRAMS)
+
+# Quantiles of the slowest buckets of a layout, below the bucket of twice the maximum
+TAIL_QUANTILES = (0.9, 0.99, 0.999)
+
+# The observations of a sketch at or below it are counted as zeros
+_MIN_VALUE = 1e-9
+
+# The layout source of the series tuned from their warmup, of the others, and of the series
+# given the layout of a snapshot
+OBSERVED = "observed"
+DEFAULT = "default"
+RESTORED = "restored"
+
+_LOCK = threading.Lock()
+# Registry -> _BucketLayoutCollector of its AutoBucketHistograms
+_LAYOUT_COLLECTORS = weakref.WeakKeyDictionary()
+
+
+class LatencySketch:
+    """
+    Counts the observations in logarithmic bins, so a quantile is known within a relative
+    ``accuracy`` in a few hundred bins, whatever the number of observations (DDSketch).
+    """
+
+    __slots__ = ("_gamma", "_log_gamma", "bins", "zeros", "count", "max")
+
+    def __init__(self, accuracy=0.01):
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        # Bin key -> count of the observations in (gamma ** (key - 1), gamma ** key]
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        if value <= _MIN_VALUE:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+    def values(self):
+        """Returns the observations by value, one value per bin, in increasing order."""
+        values = [(0.0, self.zeros)] if self.zeros else []
+        values.extend(
+            (2 * self._gamma**key / (self._gamma + 1), self.bins[key])
+            for key in sorted(self.bins)
+        )
+        return values
+
+    def quantile(self, quantile):
+        rank = quantile * (self.count - 1)
+        seen = 0
+        for value, count in self.values():
+            seen += count
+            if rank < seen:
+                return min(value, self.max)
+        return self.max
+
+
+def bucket_layout(sketch, budget):
+    """
+    Returns at most ``budget`` upper bounds, +Inf excluded, from the quantiles of the
+    sketch: evenly spaced ones up to the 90th percentile, the ``TAIL_QUANTILES``, then
+    twice the maximum. The bounds are rounded to two significant digits.
+    """
+    tail = TAIL_QUANTILES[: max(budget - 1, 0)]
+    body = budget - len(tail) - 1
+    quantiles = [TAIL_QUANTILES[0] * rank / (body + 1) for rank in range(1, body + 1)]
+    values = [sketch.quantile(quantile) for quantile in quantiles + list(tail)]
+    values.append(2 * sketch.max)
+
+    upper_bounds = []
+    for value in values:
+        bound = float("%.2g" % value)
+        if bound > 0 and (not upper_bounds or bound > upper_bounds[-1]):
+            upper_bounds.append(bound)
+    return upper_bounds
+
+
+class _Warmup:
+    """Sketch of the latencies of a series, and their sum, until its layout is chosen."""
+
+    __slots__ = ("child", "sketch", "total", "started")
+
+    def __init__(self, child):
+        self.child = child
+        self.sketch = LatencySketch()
+        self.total = 0.0
+        # Time of the first observation
+        self.started = None
+
+
+class _AutoBucketHistogramChild(_ArrayHistogramChild):
+    """Row of a series, whose ``observe()`` feeds its warmup until its layout is chosen."""
+
+    __slots__ = ()
+
+    def __init__(self, histogram, offset):
+        super().__init__(histogram, offset)
+        self.observe = partial(histogram.warmup_observe, self)
+
+    @property
+    def _upper_bounds(self):
+        return self._histogram.row_upper_bounds(self._offset)
+
+    def seed_layout(self, upper_bounds):
+        """
+        Ends the warmup of the series with the upper bounds of its layout in a snapshot, +Inf
+        included. Ignored if the layout is already chosen, or does not fit the budget.
+        """
+        self._histogram.seed_layout(self._offset, [float(bound) for bound in upper_bounds])
+
+
+class _AutoBucketHistogram(_ArrayHistogram):
+    """
+    Array histogram whose series each have their own upper bounds, at most ``budget`` of
+    them and +Inf. The rows are as wide as the largest layout, the default one included.
+    """
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames,
+        upper_bounds,
+        budget,
+        warmup_seconds,
+        warmup_observations,
+        min_observations,
+    ):
+        super().__init__(name, documentation, labelnames, upper_bounds)
+        self._budget = budget
+        self._warmup_seconds = warmup_seconds
+        self._warmup_observations = warmup_observations
+        self._min_observations = min_observations
+        self._width = max(budget + 1, len(upper_bounds)) + 1
+        self._empty_row = array("d", bytes(8 * self._width))
+        # Offset -> warmup of the series whose layout is not chosen yet
+        self._warmups = {}
+        # Offset -> upper bounds, their le labels and the source of the chosen layouts
+        self._layouts = {}
+
+    def _new_child(self, offset):
+        child = _AutoBucketHistogramChild(self, offset)
+        self._warmups[offset] = _Warmup(child)
+        return child
+
+    def warmup_observe(self, child, amount, exemplar=None):
+        with self._lock:
+            warmup = self._warmups.get(child._offset)  # pylint: disable=protected-access
+            if warmup is not None:
+                now = default_timer()
+                if warmup.started is None:
+                    warmup.started = now
+                warmup.sketch.add(amount)
+                warmup.total += amount
+                if (
+                    warmup.sketch.count >= self._warmup_observations
+                    or now - warmup.started >= self._warmup_seconds
+                ):
+                    self._freeze(warmup)
+                return
+        # The layout was chosen by another thread
+        child.observe(amount, exemplar)
+
+    def seed_layout(self, offset, upper_bounds):
+        with self._lock:
+            warmup = self._warmups.get(offset)
+            # The series saved during their warmup only have the +Inf bucket
+            if (
+                warmup is not None
+                and 2 <= len(upper_bounds) < self._width
+                and upper_bounds[-1] == math.inf
+                and upper_bounds == sorted(upper_bounds)
+            ):
+                self._freeze(warmup, upper_bounds, RESTORED)
+
+    def _freeze(self, warmup, upper_bounds=None, source=None):
+        """
+        Chooses the layout of a series, unless given, and replaces the observe() of its
+        child.
+        """
+        offset = warmup.child._offset  # pylint: disable=protected-access
+        del self._warmups[offset]
+        if upper_bounds is None:
+            if warmup.sketch.count >= self._min_observations:
+                upper_bounds = bucket_layout(warmup.sketch, self._budget) + [math.inf]
+                source = OBSERVED
+            else:
+                upper_bounds = self.upper_bounds
+                source = DEFAULT
+        # The warmup observations are counted in the buckets of their sketch bins
+        for value, count in warmup.sketch.values():
+            self._data[offset + bisect_left(upper_bounds, value)] += count
+        self._data[offset + self._width - 1] += warmup.total
+        self._layouts[offset] = (
+            upper_bounds,
+            [floatToGoString(bound) for bound in upper_bounds],
+            source,
+        )
+        warmup.child.observe = partial(self.observe_row, offset, upper_bounds)
+
+    def _freeze_expired(self):
+        now = default_timer()
+        for warmup in list(self._warmups.values()):
+            if warmup.started is not None and now - warmup.started >= self._warmup_seconds:
+                self._freeze(warmup)
+
+    def observe_row(self, offset, upper_bounds, amount, exemplar=None):
+        index = bisect_left(upper_bounds, amount)
+        data = self._data
+        with self._lock:
+            data[offset + index] += 1
+            data[offset + self._width - 1] += amount
+        if exemplar:
+            self._exemplars[offset, index] = Exemplar(exemplar, amount, time.time())
+
+    def row_upper_bounds(self, offset):
+        layout = self._layouts.get(offset)
+        return layout[0] if layout is not None else None
+
+    def layouts(self):
+        """Returns the labels, upper bounds and source of the layout of each tuned series."""
+        with self._lock:
+            self._freeze_expired()
+            return [
+                (dict(zip(self._labelnames, self._rows[offset // self._width])), bounds, source)
+                for offset, (bounds, _, source) in self._layouts.items()
+            ]
+
+    def collect(self):
+        family = Metric(self._name, self._documentation, self._type)
+        with self._lock:
+            self._freeze_expired()
+            data = self._data[:]
+            rows = list(self._rows)
+            layouts = dict(self._layouts)
+            warmups = {
+                offset: (warmup.sketch.count, warmup.total)
+                for offset, warmup in self._warmups.items()
+            }
+        exemplars = dict(self._exemplars)
+        samples = family.samples
+        width = self._width
+        bucket_name = self._name + "_bucket"
+        # The sum of negative observations is not exported, as by prometheus_client
+        has_sum = self.upper_bounds[0] >= 0
+        for row, labelvalues in enumerate(rows):
+            offset = row * width
+            labels = dict(zip(self._labelnames, labelvalues))
+            layout = layouts.get(offset)
+            if layout is None:
+                # Only the +Inf bucket until the layout is chosen, so no bucket disappears
+                count, total = warmups[offset]
+                samples.append(Sample(bucket_name, dict(labels, le="+Inf"), count, None, None))
+            else:
+                upper_bounds, le_labels, _ = layout
+                cumulative_counts = list(accumulate(data[offset : offset + len(upper_bounds)]))
+                samples.extend(
+                    [
+                        Sample(
+                            bucket_name,
+                            dict(labels, le=le),
+                            cumulative_counts[index],
+                            None,
+                            exemplars.get((offset, index)),
+                        )
+                        for index, le in enumerate(le_labels)
+                    ]
+                )
+                count, total = cumulative_counts[-1], data[offset + width - 1]
+            samples.append(Sample(self._name + "_count", labels, count, None, None))
+            if has_sum:
+                samples.append(Sample(self._name + "_sum", labels, total, None, None))
+        return [family]
+
+
+class _BucketLayoutCollector:
+    """Exports the layouts of the ``AutoBucketHistograms`` of a registry as a single family."""
+
+    def __init__(self):
+        self.sinks = weakref.WeakSet()
+
+    @staticmethod
+    def _family():
+        return Metric(
+            "grpc_histogram_bucket_layout",
+            "Upper bounds of the buckets of the histogram series tuned from their warmup.",
+            "info",
+        )
+
+    def describe(self):
+        return [self._family()]
+
+    def collect(self):
+        family = self._family()
+        for sink in list(self.sinks):
+            for name, labels, upper_bounds, source in sink.layouts():
+                family.samples.append(
+                    Sample(
+                        "grpc_histogram_bucket_layout_info",
+                        dict(
+                            labels,
+                            histogram=name,
+                            buckets=",".join(floatToGoString(bound) for bound in upper_bounds),
+                            source=source,
+                        ),
+                        1.0,
+                        None,
+                        None,
+                    )
+                )
+        return [family]
+
+
+class AutoBucketHistograms(ArrayHistograms):
+    """
+    Chooses the buckets of the handling time histograms of each method from its latencies.
+
+    Every series of the histograms named in ``names`` starts with a warmup, during which
+    its latencies are only counted in a sketch, without their exemplars, and exported as
+    the +Inf bucket, count and sum. The warmup ends after ``warmup_observations``
+    observations, or ``warmup_seconds`` after the first one. The series then gets at most
+    ``bucket_budget`` upper bounds at quantiles of its latencies, see ``bucket_layout()``,
+    or the ``buckets`` of the histogram if it had fewer than ``min_observations``. The
+    warmup observations are counted in the new buckets, and the layout never changes
+    afterwards, so the series of the buckets do not churn. A ``MetricsSnapshot`` restores
+    the layout of a series with its buckets, without a warmup. The layouts of the sinks of
+    a registry are exported by ``grpc_histogram_bucket_layout_info``.
+
+    The other histograms are the ``ArrayHistograms`` ones. Pass it as the ``sink`` of the
+    interceptors.
+    """
+
+    def __init__(
+        self,
+        registry=REGISTRY,
+        counters=None,
+        warmup_seconds=60.0,
+        warmup_observations=1000,
+        bucket_budget=12,
+        min_observations=100,
+        names=HANDLING_TIME_HISTOGRAM_NAMES,
+    ):
+        if bucket_budget < 1:
+            raise ValueError("The bucket budget must be at least one bucket")
+        super().__init__(registry, counters)
+        self._warmup_seconds = warmup_seconds
+        self._warmup_observations = warmup_observations
+        self._bucket_budget = bucket_budget
+        self._min_observations = min_observations
+        self._names = frozenset(names)
+        self._histograms = []
+        with _LOCK:
+            collector = _LAYOUT_COLLECTORS.get(registry)
+            if collector is None:
+                collector = _LAYOUT_COLLECTORS[registry] = _BucketLayoutCollector()
+                registry.register(collector)
+        collector.sinks.add(self)
+
+    def histogram(self, name, documentation, labelnames, buckets=Histogram.DEFAULT_BUCKETS):
+        if name not in self._names:
+            return super().histogram(name, documentation, labelnames, buckets)
+        metric = _AutoBucketHistogram(
+            name,
+            documentation,
+            labelnames,
+            upper_bounds_of(buckets),
+            self._bucket_budget,
+            self._warmup_seconds,
+            self._warmup_observations,
+            self._min_observations,
+        )
+        self._registry.register(metric)
+        self._histograms.append(metric)
+        return metric
+
+    def unregister(self, metric):
+        super().unregister(metric)
+        if metric in self._histograms:
+            self._histograms.remove(metric)
+
+    def layouts(self):
+        """Returns the histogram name, labels, upper bounds and source of the tuned series."""
+        return [
+            (metric._name,) + layout  # pylint: disable=protected-access
+            for metric in list(self._histograms)
+            for layout in metric.layouts()
+        ]
@@ -0,0 +1,183 @@
+"""Records the interceptor metrics off the request path, from a background thread"""
+import logging
+import threading
+
+from array import array
+from functools import partial
+
+from prometheus_client import Counter
+from prometheus_client import Histogram
+from prometheus_client.metrics_core import CounterMetricFamily
+from prometheus_client.registry import REGISTRY
+
+
+_LOGGER = logging.getLogger(__name__)
+
+_COUNTER = 0
+_HISTOGRAM = 1
+
+
+class _RecorderChild:
+    """Child whose ``inc()`` and ``observe()`` append an event to the recorder buffer."""
+
+    __slots__ = ("inc", "observe")
+
+    def __init__(self, recorder, series):
+        self.inc = self.observe = partial(recorder.record, series)
+
+
+class _RecorderMetric:
+    """Mimics the ``labels()`` API of the prometheus_client metrics used by the interceptors."""
+
+    def __init__(self, recorder, metric, kind):
+        self._recorder = recorder
+        self.metric = metric
+        self._kind = kind
+        self._children = {}
+
+    def labels(self, **labels):
+        cache_key = tuple(labels.items())
+        child = self._children.get(cache_key)
+        if child is None:
+            series = self._recorder.add_series(self._kind, self.metric.labels(**labels))
+            child = self._children.setdefault(cache_key, _RecorderChild(self._recorder, series))
+        return child
+
+
+class BackgroundRecorder:
+    """
+    Records the interceptor metrics in a ring buffer aggregated into the registry by a
+    background thread.
+
+    The RPCs only append an event (series id, value) to the preallocated buffer of
+    ``buffer_size`` events, under a single lock, instead of taking the locks of the
+    prometheus_client metrics and looking up the histogram buckets. Every
+    ``flush_interval`` seconds the thread sums the counter events per series and observes
+    the histogram events. The events arriving while the buffer is full are dropped and
+    counted by ``grpc_recorder_dropped_events_total``. The buffer is also flushed when the
+    registry is collected, so a scrape sees every event recorded before it.
+
+    Pass the recorder as the ``sink`` of the interceptors.
+    """
+
+    def __init__(self, registry=REGISTRY, buffer_size=65536, flush_interval=0.25):
+        if buffer_size < 1:
+            raise ValueError("The buffer must hold at least one event")
+        self._registry = registry
+        self._buffer_size = buffer_size
+        self._flush_interval = flush_interval
+
+        # Series id -> kind and child of the registry metric
+        self._kinds = []
+        self._children = []
+        # Ring buffer of the events not aggregated yet
+        self._series = array("l", bytes(array("l").itemsize * buffer_size))
+        self._values = array("d", bytes(array("d").itemsize * buffer_size))
+        self._head = 0
+        self._length = 0
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        registry.register(self)
+
+    def counter(self, name, documentation, labelnames, **kwargs):
+        metric = Counter(name, documentation, labelnames, registry=self._registry, **kwargs)
+        return _RecorderMetric(self, metric, _COUNTER)
+
+    def histogram(self, name, documentation, labelnames, **kwargs):
+        metric = Histogram(name, documentation, labelnames, registry=self._registry, **kwargs)
+        return _RecorderMetric(self, metric, _HISTOGRAM)
+
+    def unregister(self, metric):
+        """Unregisters a metric of the recorder, its buffered events are still aggregated."""
+        self._registry.unregister(metric.metric)
+
+    def add_series(self, kind, child):
+        """Returns the id of a new series recorded into the child of a registry metric."""
+        with self._lock:
+            self._kinds.append(kind)
+            self._children.append(child)
+            return len(self._children) - 1
+
+    def record(self, series, value=1, exemplar=None):
+        if exemplar:
+            # The exemplars are rate limited, they go to the registry right away
+            if self._kinds[series] == _COUNTER:
+                self._children[series].inc(value, exemplar)
+            else:
+                self._children[series].observe(value, exemplar)
+            return
+        with self._lock:
+            if self._length == self._buffer_size:
+                self.dropped += 1
+                return
+            index = self._head + self._length
+            if index >= self._buffer_size:
+                index -= self._buffer_size
+            self._series[index] = series
+            self._values[index] = value
+            self._length += 1
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="grpc-prometheus-recorder", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the background thread and aggregates the events recorded so far."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.error(e)
+
+    def flush(self):
+        """Aggregates the buffered events into the registry."""
+        with self._flush_lock:
+            with self._lock:
+                head, length = self._head, self._length
+            # The RPCs only write past the buffered events, which are read without the lock
+            counts = {}
+            kinds = self._kinds
+            children = self._children
+            for offset in range(length):
+                index = head + offset
+                if index >= self._buffer_size:
+                    index -= self._buffer_size
+                series = self._series[index]
+                if kinds[series] == _COUNTER:
+                    counts[series] = counts.get(series, 0) + self._values[index]
+                else:
+                    children[series].observe(self._values[index])
+            for series, amount in counts.items():
+                children[series].inc(amount)
+            with self._lock:
+                self._head = (head + length) % self._buffer_size
+                self._length -= length
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        # The recorder is registered before its metrics, so they are collected after it
+        self.flush()
+        dropped = CounterMetricFamily(
+            "grpc_recorder_dropped_events",
+            "Total number of metric events dropped because the recorder buffer was full.",
+        )
+        dropped.add_metric([], self.dropped)
+        yield dropped
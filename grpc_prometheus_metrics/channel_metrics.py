@@ -0,0 +1,171 @@
+"""Connectivity metrics of the client channels"""
+import threading
+import weakref
+
+from timeit import default_timer
+
+import grpc
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client.registry import REGISTRY
+
+
+OTHER = "other"
+
+TIME_TO_READY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    float("inf"),
+)
+
+
+def state_name(connectivity):
+    """e.g. grpc.ChannelConnectivity.TRANSIENT_FAILURE -> transient_failure"""
+    return connectivity.value[1]
+
+
+class ChannelTracker:
+    """
+    Follows the connectivity of a channel and updates the metrics of its target.
+
+    The time to READY runs from the first CONNECTING state after the channel was idle,
+    ready or just monitored, to READY, reconnection back-offs included.
+    """
+
+    def __init__(self, metrics, target):
+        self._metrics = metrics
+        self._target = target
+        self.state = None
+        self._connecting_since = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def update(self, connectivity):
+        # Called back from the channel polling thread, maybe still after close()
+        with self._lock:
+            if not self._closed:
+                self._update(connectivity)
+
+    def _update(self, connectivity):
+        state = state_name(connectivity)
+        if state == self.state:
+            return
+        previous_state = self.state
+        metrics = self._metrics
+        if previous_state is not None:
+            metrics["grpc_client_channel_state"].labels(
+                target=self._target, state=previous_state
+            ).dec()
+            metrics["grpc_client_channel_transitions"].labels(
+                target=self._target, from_state=previous_state, to_state=state
+            ).inc()
+        if state != state_name(grpc.ChannelConnectivity.SHUTDOWN):
+            metrics["grpc_client_channel_state"].labels(target=self._target, state=state).inc()
+        self.state = state
+
+        if connectivity is grpc.ChannelConnectivity.CONNECTING:
+            if self._connecting_since is None:
+                self._connecting_since = default_timer()
+        elif connectivity is grpc.ChannelConnectivity.READY:
+            if self._connecting_since is not None:
+                metrics["grpc_client_channel_time_to_ready"].labels(target=self._target).observe(
+                    max(default_timer() - self._connecting_since, 0)
+                )
+            self._connecting_since = None
+        elif connectivity is not grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+            self._connecting_since = None
+
+    def close(self):
+        """
+        Removes the channel from the state gauge once it is no longer monitored, without
+        recording a transition the channel did not make.
+        """
+        with self._lock:
+            if self.state is not None and self.state != state_name(
+                grpc.ChannelConnectivity.SHUTDOWN
+            ):
+                self._metrics["grpc_client_channel_state"].labels(
+                    target=self._target, state=self.state
+                ).dec()
+            self.state = None
+            self._connecting_since = None
+            self._closed = True
+
+
+class ChannelConnectivityMonitor:
+    """
+    Exports the connectivity of the monitored client channels by target.
+
+    The targets past the first ``max_targets`` ones are exported as ``other``, whatever
+    the number of channels the client creates.
+    """
+
+    def __init__(self, registry=REGISTRY, max_targets=100, buckets=TIME_TO_READY_BUCKETS):
+        self._max_targets = max_targets
+        self._targets = set()
+        self._lock = threading.Lock()
+        # Channel -> (tracker, subscription), a collected channel is not monitored anymore
+        self._trackers = weakref.WeakKeyDictionary()
+        self._metrics = {
+            "grpc_client_channel_state": Gauge(
+                "grpc_client_channel_state",
+                "Number of monitored client channels in each connectivity state.",
+                ["target", "state"],
+                registry=registry,
+            ),
+            "grpc_client_channel_transitions": Counter(
+                "grpc_client_channel_transitions_total",
+                "Total number of connectivity state transitions of the client channels.",
+                ["target", "from_state", "to_state"],
+                registry=registry,
+            ),
+            "grpc_client_channel_time_to_ready": Histogram(
+                "grpc_client_channel_time_to_ready_seconds",
+                "Histogram of the time (seconds) taken by the client channels to connect, "
+                "from CONNECTING to READY.",
+                ["target"],
+                buckets=buckets,
+                registry=registry,
+            ),
+        }
+
+    def target_label(self, target):
+        with self._lock:
+            if target in self._targets:
+                return target
+            if len(self._targets) < self._max_targets:
+                self._targets.add(target)
+                return target
+        return OTHER
+
+    def monitor(self, channel, target):
+        """Subscribes to the connectivity of a ``grpc.Channel``, without connecting it."""
+        tracker = ChannelTracker(self._metrics, self.target_label(target))
+        callback = tracker.update
+        with self._lock:
+            self._trackers[channel] = (tracker, callback)
+        channel.subscribe(callback, try_to_connect=False)
+        # A channel collected while monitored leaves the state gauge
+        weakref.finalize(channel, tracker.close)
+        return tracker
+
+    def unmonitor(self, channel):
+        with self._lock:
+            tracker, callback = self._trackers.pop(channel, (None, None))
+        if tracker is None:
+            return
+        channel.unsubscribe(callback)
+        tracker.close()
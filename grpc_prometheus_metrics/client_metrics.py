@@ -1,70 +1,178 @@
-from prometheus_client import Counter
-from prometheus_client import Histogram
-
-
-__METRICS = None
-
-
-def init_metrics(registry):
-    global __METRICS
-    if __METRICS is not None:
-        return __METRICS
-
-    __METRICS = {
-        "grpc_client_started_counter": Counter(
-            "grpc_client_started_total",
-            "Total number of RPCs started on the client",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "grpc_client_handled_counter": Counter(
-            "grpc_client_handled_total",
-            "Total number of RPCs completed on the client, " "regardless of success or failure.",
-            ["grpc_type", "grpc_service", "grpc_method", "grpc_code"],
-            registry=registry,
-        ),
-        "grpc_client_stream_msg_received": Counter(
-            "grpc_client_msg_received_total",
-            "Total number of RPC stream messages received by the client.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "grpc_client_stream_msg_sent": Counter(
-            "grpc_client_msg_sent_total",
-            "Total number of gRPC stream messages sent by the client.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "grpc_client_handled_histogram": Histogram(
-            "grpc_client_handling_seconds",
-            "Histogram of response latency (seconds) of the gRPC until" "it is finished by the application.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "grpc_client_stream_recv_histogram": Histogram(
-            "grpc_client_msg_recv_handling_seconds",
-            "Histogram of response latency (seconds) of the gRPC single message receive.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "grpc_client_stream_send_histogram": Histogram(
-            "grpc_client_msg_send_handling_seconds",
-            "Histogram of response latency (seconds) of the gRPC single message send.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        # Legacy metrics for backwards compatibility
-        "legacy_grpc_client_completed_counter": Counter(
-            "grpc_client_completed",
-            "Total number of RPCs completed on the client, " "regardless of success or failure.",
-            ["grpc_type", "grpc_service", "grpc_method", "code"],
-            registry=registry,
-        ),
-        "legacy_grpc_client_completed_latency_seconds_histogram": Histogram(
-            "grpc_client_completed_latency_seconds",
-            "Histogram of rpc response latency (in seconds) for completed rpcs.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-    }
-    return __METRICS
+from grpc_prometheus_metrics import grpc_utils
+from grpc_prometheus_metrics.server_metrics import LazyMetrics
+
+
+# Metric key -> (kind, name, documentation, label names)
+CLIENT_METRICS = {
+    "grpc_client_started_counter": (
+        "counter",
+        "grpc_client_started_total",
+        "Total number of RPCs started on the client",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_client_handled_counter": (
+        "counter",
+        "grpc_client_handled_total",
+        "Total number of RPCs completed on the client, regardless of success or failure.",
+        ["grpc_type", "grpc_service", "grpc_method", "grpc_code"],
+    ),
+    "grpc_client_stream_msg_received": (
+        "counter",
+        "grpc_client_msg_received_total",
+        "Total number of RPC stream messages received by the client.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_client_stream_msg_sent": (
+        "counter",
+        "grpc_client_msg_sent_total",
+        "Total number of gRPC stream messages sent by the client.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_client_handled_histogram": (
+        "histogram",
+        "grpc_client_handling_seconds",
+        "Histogram of response latency (seconds) of the gRPC until it is finished by the "
+        "application.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_client_stream_recv_histogram": (
+        "histogram",
+        "grpc_client_msg_recv_handling_seconds",
+        "Histogram of response latency (seconds) of the gRPC single message receive.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_client_stream_send_histogram": (
+        "histogram",
+        "grpc_client_msg_send_handling_seconds",
+        "Histogram of response latency (seconds) of the gRPC single message send.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_client_retry_pushback_counter": (
+        "counter",
+        "grpc_client_retry_pushback_total",
+        "Total number of RPCs completed with a retry pushback of the server, delaying "
+        "or stopping the retries of the client.",
+        ["grpc_type", "grpc_service", "grpc_method", "pushback"],
+    ),
+    # Legacy metrics for backwards compatibility
+    "legacy_grpc_client_completed_counter": (
+        "counter",
+        "grpc_client_completed",
+        "Total number of RPCs completed on the client, regardless of success or failure.",
+        ["grpc_type", "grpc_service", "grpc_method", "code"],
+    ),
+    "legacy_grpc_client_completed_latency_seconds_histogram": (
+        "histogram",
+        "grpc_client_completed_latency_seconds",
+        "Histogram of rpc response latency (in seconds) for completed rpcs.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+}
+
+
+# The handling time histograms, whose buckets the interceptors take
+HANDLING_TIME_HISTOGRAMS = (
+    "grpc_client_handled_histogram",
+    "legacy_grpc_client_completed_latency_seconds_histogram",
+)
+
+
+def init_metrics(registry, sink=None, const_labels=None, extra_labels=None, options=None):
+    """
+    Returns the client metrics of the registry, or of the sink if given.
+
+    The interceptors of a registry share its metric objects, which are created and
+    registered at their first use, so the metrics of the disabled features are never
+    exported. ``const_labels`` (e.g. ``{"target": "localhost:50051"}``) are added to
+    every series, and ``extra_labels`` names to some metrics by metric key; the
+    interceptors of a registry must use the same label names. ``options`` are the
+    constructor arguments of some metrics, by metric key.
+    """
+    return LazyMetrics(CLIENT_METRICS, registry, sink, const_labels, extra_labels, options)
+
+
+class MethodMetrics:
+    """
+    Children of the client metrics of a method, bound to its labels once, and to the
+    metadata label value if any.
+
+    Only the metrics of the enabled features and of the RPC type are bound, the others
+    are None so the interceptors skip them, timer reads included.
+    """
+
+    __slots__ = (
+        "labels",
+        "started",
+        "handled",
+        "latency",
+        "received",
+        "sent",
+        "receive_latency",
+        "send_latency",
+    )
+
+    def __init__(
+        self,
+        metrics,
+        grpc_type,
+        method,
+        legacy=False,
+        handling_time=False,
+        receive_time=False,
+        send_time=False,
+        metadata_label=None,
+        label_value=None,
+    ):
+        grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_name(method)
+        labels = self.labels = {
+            "grpc_type": grpc_type,
+            "grpc_service": grpc_service_name,
+            "grpc_method": grpc_method_name,
+        }
+
+        def metric_labels(key):
+            if metadata_label is None:
+                return labels
+            return metadata_label.labels(key, labels, label_value)
+
+        self.started = metrics["grpc_client_started_counter"].labels(
+            **metric_labels("grpc_client_started_counter")
+        )
+        self.handled = None
+        self.latency = None
+        self.received = None
+        self.sent = None
+        self.receive_latency = None
+        self.send_latency = None
+
+        if grpc_type == grpc_utils.UNARY:
+            if legacy:
+                self.handled = grpc_utils.code_children(
+                    metrics["legacy_grpc_client_completed_counter"],
+                    metric_labels("legacy_grpc_client_completed_counter"),
+                    "code",
+                )
+            else:
+                self.handled = grpc_utils.code_children(
+                    metrics["grpc_client_handled_counter"],
+                    metric_labels("grpc_client_handled_counter"),
+                    "grpc_code",
+                )
+        if legacy:
+            if grpc_type != grpc_utils.BIDI_STREAMING:
+                self.latency = metrics[
+                    "legacy_grpc_client_completed_latency_seconds_histogram"
+                ].labels(**metric_labels("legacy_grpc_client_completed_latency_seconds_histogram"))
+        elif handling_time and grpc_type != grpc_utils.BIDI_STREAMING:
+            self.latency = metrics["grpc_client_handled_histogram"].labels(
+                **metric_labels("grpc_client_handled_histogram")
+            )
+
+        if grpc_type in (grpc_utils.SERVER_STREAMING, grpc_utils.BIDI_STREAMING):
+            self.received = metrics["grpc_client_stream_msg_received"].labels(**labels)
+            if receive_time and not legacy:
+                self.receive_latency = metrics["grpc_client_stream_recv_histogram"].labels(**labels)
+        if grpc_type in (grpc_utils.CLIENT_STREAMING, grpc_utils.BIDI_STREAMING):
+            self.sent = metrics["grpc_client_stream_msg_sent"].labels(**labels)
+            if send_time and not legacy:
+                self.send_latency = metrics["grpc_client_stream_send_histogram"].labels(**labels)
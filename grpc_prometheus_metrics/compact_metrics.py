@@ -0,0 +1,184 @@
+"""Compact in-memory storage for the interceptor metrics of many series"""
+import math
+import threading
+import time
+
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+from prometheus_client import Histogram
+from prometheus_client.metrics_core import Metric
+from prometheus_client.registry import REGISTRY
+from prometheus_client.samples import Exemplar
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+
+
+def upper_bounds_of(buckets):
+    """Returns the upper bounds of the buckets, ending with +Inf, as prometheus_client does."""
+    upper_bounds = [float(bound) for bound in buckets]
+    if upper_bounds != sorted(upper_bounds):
+        raise ValueError("Buckets not in sorted order")
+    if upper_bounds and upper_bounds[-1] != math.inf:
+        upper_bounds.append(math.inf)
+    if len(upper_bounds) < 2:
+        raise ValueError("Must have at least two buckets")
+    return upper_bounds
+
+
+class _CompactCounterChild:
+    """Counter value of a series, incremented under the lock of its metric."""
+
+    __slots__ = ("_lock", "value", "exemplar")
+
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+        self.exemplar = None
+
+    def inc(self, amount=1, exemplar=None):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts.")
+        with self._lock:
+            self.value += amount
+        if exemplar:
+            self.exemplar = Exemplar(exemplar, amount, time.time())
+
+
+class _CompactHistogramChild:
+    """
+    Bucket counts of a series, not cumulative, followed by their sum in a single array.
+    The upper bounds and the lock are the ones of the metric.
+    """
+
+    __slots__ = ("_lock", "_upper_bounds", "counts", "exemplars")
+
+    def __init__(self, lock, upper_bounds):
+        self._lock = lock
+        self._upper_bounds = upper_bounds
+        self.counts = array("d", bytes(8 * (len(upper_bounds) + 1)))
+        # Bucket index -> last exemplar, only for the series observed with exemplars
+        self.exemplars = None
+
+    def observe(self, amount, exemplar=None):
+        index = bisect_left(self._upper_bounds, amount)
+        counts = self.counts
+        with self._lock:
+            counts[index] += 1
+            counts[-1] += amount
+        if exemplar:
+            if self.exemplars is None:
+                self.exemplars = {}
+            self.exemplars[index] = Exemplar(exemplar, amount, time.time())
+
+    def restore(self, cumulative_counts, total):
+        """Adds the cumulative bucket counts and the sum of a snapshot to the series."""
+        counts = self.counts
+        with self._lock:
+            previous = 0.0
+            for index, count in enumerate(cumulative_counts):
+                counts[index] += count - previous
+                previous = count
+            counts[-1] += total
+
+
+class _CompactMetric:
+    """
+    Mimics the ``labels()`` API of the prometheus_client metrics used by the interceptors,
+    and collects the samples of its children as they would.
+    """
+
+    def __init__(self, name, documentation, labelnames, kind, upper_bounds=None):
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._type = kind
+        self._upper_bounds = upper_bounds
+        self._lock = threading.Lock()
+        # Label values -> child
+        self._children = {}
+
+    def labels(self, **labels):
+        if len(labels) != len(self._labelnames):
+            raise ValueError("Incorrect label names")
+        try:
+            labelvalues = tuple(str(labels[name]) for name in self._labelnames)
+        except KeyError:
+            raise ValueError("Incorrect label names") from None
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.get(labelvalues)
+                if child is None:
+                    if self._type == "counter":
+                        child = _CompactCounterChild(self._lock)
+                    else:
+                        child = _CompactHistogramChild(self._lock, self._upper_bounds)
+                    self._children[labelvalues] = child
+        return child
+
+    def describe(self):
+        return [Metric(self._name, self._documentation, self._type)]
+
+    def collect(self):
+        family = Metric(self._name, self._documentation, self._type)
+        with self._lock:
+            children = list(self._children.items())
+        for labelvalues, child in children:
+            labels = dict(zip(self._labelnames, labelvalues))
+            if self._type == "counter":
+                family.samples.append(
+                    Sample(self._name + "_total", labels, child.value, None, child.exemplar)
+                )
+            else:
+                self._histogram_samples(family.samples, labels, child)
+        return [family]
+
+    def _histogram_samples(self, samples, labels, child):
+        with self._lock:
+            counts = child.counts[:]
+        exemplars = child.exemplars or {}
+        bucket_name = self._name + "_bucket"
+        cumulative_counts = list(accumulate(counts[:-1]))
+        for index, (bound, count) in enumerate(zip(self._upper_bounds, cumulative_counts)):
+            bucket_labels = dict(labels, le=floatToGoString(bound))
+            samples.append(Sample(bucket_name, bucket_labels, count, None, exemplars.get(index)))
+        samples.append(Sample(self._name + "_count", labels, cumulative_counts[-1], None, None))
+        # The sum of negative observations is not exported, as by prometheus_client
+        if self._upper_bounds[0] >= 0:
+            samples.append(Sample(self._name + "_sum", labels, counts[-1], None, None))
+
+
+class CompactMetrics:
+    """
+    Stores the interceptor metrics in less memory per series than prometheus_client.
+
+    The children of the metrics only hold their value, a counter, or an array of their
+    bucket counts and sum, a histogram, with ``__slots__``. The label names, the upper
+    bounds of the buckets and a single lock are shared by the series of a metric. The
+    metrics are registered in the registry and scraped as the prometheus_client ones,
+    without their ``_created`` samples.
+
+    Pass it as the ``sink`` of the interceptors.
+    """
+
+    def __init__(self, registry=REGISTRY):
+        self._registry = registry
+
+    def counter(self, name, documentation, labelnames):
+        if name.endswith("_total"):
+            name = name[: -len("_total")]
+        metric = _CompactMetric(name, documentation, labelnames, "counter")
+        self._registry.register(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames, buckets=Histogram.DEFAULT_BUCKETS):
+        metric = _CompactMetric(
+            name, documentation, labelnames, "histogram", upper_bounds_of(buckets)
+        )
+        self._registry.register(metric)
+        return metric
+
+    def unregister(self, metric):
+        self._registry.unregister(metric)
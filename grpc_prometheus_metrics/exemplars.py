@@ -0,0 +1,48 @@
+"""Exemplars linking the interceptor metrics to traces"""
+from time import monotonic
+
+
+TRACEPARENT_KEY = "traceparent"
+
+
+def traceparent_extractor(metadata):
+    """
+    Extracts the trace and span ids of a W3C ``traceparent`` metadata entry.
+
+    e.g. traceparent: 00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01
+    """
+    for key, value in metadata or ():
+        if key == TRACEPARENT_KEY:
+            parts = value.split("-")
+            if len(parts) >= 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                return {"trace_id": parts[1], "span_id": parts[2]}
+            return None
+    return None
+
+
+class ExemplarSampler:
+    """
+    Rate limits the exemplars attached to each series.
+
+    A series gets a new exemplar at most once every ``min_interval`` seconds, and the
+    metadata is only parsed by the ``extractor`` when the series is due, so calls in
+    between pay a single dict lookup. ``extractor`` receives the invocation metadata and
+    returns the exemplar labels, or None. OpenMetrics limits the exemplar labels to 128
+    characters in total.
+    """
+
+    def __init__(self, extractor=traceparent_extractor, min_interval=1.0):
+        self._extractor = extractor
+        self._min_interval = min_interval
+        self._last_sampled = {}
+
+    def sample(self, series, metadata):
+        now = monotonic()
+        last_sampled = self._last_sampled.get(series)
+        if last_sampled is not None and now - last_sampled < self._min_interval:
+            return None
+
+        exemplar = self._extractor(metadata)
+        if exemplar:
+            self._last_sampled[series] = now
+        return exemplar
@@ -0,0 +1,24 @@
+"""Renders a registry one metric family at a time, so the rendering can be sliced"""
+
+OPENMETRICS_EOF = b"# EOF\n"
+
+
+class SingleFamilyCollector:
+    """Lets the prometheus_client encoders render one metric family at a time."""
+
+    def __init__(self, family):
+        self._family = family
+
+    def collect(self):
+        return [self._family]
+
+
+def encode_family(encoder, family, openmetrics):
+    """
+    Renders one metric family with a prometheus_client encoder. The OpenMetrics ``# EOF``
+    line is left out, it ends the whole exposition once, see ``OPENMETRICS_EOF``.
+    """
+    output = encoder(SingleFamilyCollector(family))
+    if openmetrics and output.endswith(OPENMETRICS_EOF):
+        output = output[: -len(OPENMETRICS_EOF)]
+    return output
@@ -4,6 +4,16 @@ CLIENT_STREAMING = "CLIENT_STREAMING"
 BIDI_STREAMING = "BIDI_STREAMING"
 UNKNOWN = "UNKNOWN"
 
+# grpc reports a time remaining of about 292 years for the RPCs without deadline
+_NO_DEADLINE_TIME_REMAINING = 100 * 365 * 24 * 60 * 60
+
+# Metadata of the gRPC retry policies, see
+# https://github.com/grpc/proposal/blob/master/A6-client-retries.md
+PREVIOUS_RPC_ATTEMPTS_KEY = "grpc-previous-rpc-attempts"
+RETRY_PUSHBACK_KEY = "grpc-retry-pushback-ms"
+# gRPC caps the attempts of the retry and hedging policies to 5
+MAX_ATTEMPTS = 5
+
 
 def wrap_iterator_inc_counter(iterator, counter, grpc_type, grpc_service_name, grpc_method_name):
     """Wraps an iterator and collect metrics."""
@@ -15,6 +25,96 @@ def wrap_iterator_inc_counter(iterator, counter, grpc_type, grpc_service_name, g
         yield item
 
 
+def wrap_iterator_inc(iterator, counter):
+    """Wraps an iterator and increments a labeled counter for each of its items."""
+
+    inc = counter.inc
+    for item in iterator:
+        inc()
+        yield item
+
+
+def code_children(metric, labels, code_label):
+    """
+    Returns a function returning the child of the metric for a status code, created at
+    the first call with that code.
+    """
+    children = {}
+
+    def child(grpc_code):
+        metric_child = children.get(grpc_code)
+        if metric_child is None:
+            metric_child = children[grpc_code] = metric.labels(**labels, **{code_label: grpc_code})
+        return metric_child
+
+    return child
+
+
+def wrap_iterator_count(iterator, counts, index, size_index=None):
+    """
+    Wraps an iterator and counts its items in counts[index], and their serialized
+    size in counts[size_index] if given.
+    """
+
+    for item in iterator:
+        counts[index] += 1
+        if size_index is not None:
+            counts[size_index] += message_size(item) or 0
+        yield item
+
+
+def wrap_iterator_done(iterator, callback):
+    """Wraps an iterator and calls back with the raised exception, or None, once it ends."""
+
+    error = None
+    try:
+        for item in iterator:
+            yield item
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        callback(error)
+
+
+def message_size(message):
+    """Returns the serialized size of a protobuf message, None for other objects."""
+    byte_size = getattr(message, "ByteSize", None)
+    if byte_size is None:
+        return None
+    return byte_size()
+
+
+def get_time_remaining(servicer_context):
+    """Returns the seconds left before the deadline of the RPC, None without deadline."""
+    time_remaining = servicer_context.time_remaining()
+    if time_remaining is None or time_remaining > _NO_DEADLINE_TIME_REMAINING:
+        return None
+    return time_remaining
+
+
+def get_metadata_value(metadata, metadata_key):
+    """Returns the value of the first metadata entry with the given key, or None."""
+    for key, value in metadata or ():
+        if key == metadata_key:
+            return value
+    return None
+
+
+def get_attempt(invocation_metadata):
+    """
+    Returns the attempt number of an RPC under a retry or hedging policy, 1 for the first
+    attempt, capped to MAX_ATTEMPTS.
+    """
+    previous_attempts = get_metadata_value(invocation_metadata, PREVIOUS_RPC_ATTEMPTS_KEY)
+    if previous_attempts is None:
+        return 1
+    try:
+        return max(1, min(int(previous_attempts) + 1, MAX_ATTEMPTS))
+    except ValueError:
+        return 1
+
+
 def get_method_type(request_streaming, response_streaming):
     """
     Infers the method type from if the request or the response is streaming.
@@ -36,8 +136,15 @@ def split_method_call(handler_call_details):
     Infers the grpc service and method name from the handler_call_details.
     """
 
+    return split_method_name(handler_call_details.method)
+
+
+def split_method_name(method):
+    """
+    Infers the grpc service and method name from a full method name.
+    """
+
     # e.g. /package.ServiceName/MethodName
-    method = handler_call_details.method
     if isinstance(method, bytes):
         method = method.decode()
     parts = method.split("/")
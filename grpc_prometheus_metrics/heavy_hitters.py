@@ -0,0 +1,144 @@
+"""Track the peers and methods generating the most load with bounded memory"""
+import heapq
+import itertools
+import threading
+
+from prometheus_client.metrics_core import GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+
+from grpc_prometheus_metrics import grpc_utils
+
+
+OTHER = "other"
+
+
+def peer_address(peer):
+    """
+    Drops the port of a gRPC peer, which changes with every client connection.
+
+    e.g. ipv4:127.0.0.1:53412 -> ipv4:127.0.0.1, ipv6:[::1]:53412 -> ipv6:[::1]
+    """
+    if peer.startswith(("ipv4:", "ipv6:")):
+        return peer.rpartition(":")[0]
+    return peer
+
+
+class SpaceSaving:
+    """
+    Weighted Space-Saving sketch keeping the ``capacity`` heaviest keys.
+
+    When the sketch is full, a new key replaces the lightest one and inherits its weight,
+    so the weight of a tracked key is over-estimated by at most the weight it inherited.
+
+    The lightest key is found with a min-heap of the tracked keys, whose entries are only
+    updated when they reach its top: the weights never decrease, so an outdated entry is a
+    lower bound of the weight of its key and is pushed back with the current one. Adding to
+    a tracked key costs O(1), replacing a key amortized O(log capacity).
+    """
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._weights = {}
+        # (weight when pushed, insertion order, key), the order breaks ties between weights
+        self._heap = []
+        self._order = itertools.count()
+        self.total = 0
+
+    def add(self, key, weight):
+        if weight < 0:
+            raise ValueError("Weights must be non-negative")
+        self.total += weight
+        weights = self._weights
+        if key in weights:
+            weights[key] += weight
+        elif len(weights) < self._capacity:
+            weights[key] = weight
+            heapq.heappush(self._heap, (weight, next(self._order), key))
+        else:
+            heap = self._heap
+            while True:
+                pushed_weight, _, lightest = heap[0]
+                current_weight = weights[lightest]
+                if current_weight == pushed_weight:
+                    break
+                heapq.heapreplace(heap, (current_weight, next(self._order), lightest))
+            weight += weights.pop(lightest)
+            weights[key] = weight
+            heapq.heapreplace(heap, (weight, next(self._order), key))
+
+    def top(self, k):
+        """Returns the k heaviest keys with their weight, heaviest first."""
+        return sorted(self._weights.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class HeavyHitterTracker:
+    """
+    Top-K (peer, method) pairs by request count, bytes and total handling time.
+
+    The sketches track ``capacity`` pairs (4 * k by default) to keep the top k accurate,
+    and are exported on collect as k series plus an ``other`` series per metric, whatever
+    the number of clients. The bytes are the serialized sizes of the protobuf messages.
+    Pass the tracker as ``heavy_hitters`` of the server interceptors.
+    """
+
+    def __init__(self, k=20, capacity=None, registry=REGISTRY, peer_key=peer_address):
+        self._k = k
+        self._peer_key = peer_key
+        self._lock = threading.Lock()
+        capacity = capacity or 4 * k
+        self._requests = SpaceSaving(capacity)
+        self._bytes = SpaceSaving(capacity)
+        self._handling_seconds = SpaceSaving(capacity)
+        if registry is not None:
+            registry.register(self)
+
+    def add(self, peer, method, message_bytes, duration):
+        key = (self._peer_key(peer), method)
+        with self._lock:
+            self._requests.add(key, 1)
+            self._bytes.add(key, message_bytes)
+            self._handling_seconds.add(key, duration)
+
+    def top(self, k=None):
+        """Returns the top (peer, method) pairs by requests, bytes and handling seconds."""
+        with self._lock:
+            return {
+                "requests": self._requests.top(k or self._k),
+                "bytes": self._bytes.top(k or self._k),
+                "handling_seconds": self._handling_seconds.top(k or self._k),
+            }
+
+    def collect(self):
+        with self._lock:
+            snapshots = [
+                (sketch.top(self._k), sketch.total)
+                for sketch in (self._requests, self._bytes, self._handling_seconds)
+            ]
+
+        for (name, documentation), (top, total) in zip(
+            [
+                (
+                    "grpc_server_heavy_hitter_requests",
+                    "Number of RPCs of the top peers and methods, since the server started.",
+                ),
+                (
+                    "grpc_server_heavy_hitter_bytes",
+                    "Bytes received and sent by the top peers and methods, since the server "
+                    "started.",
+                ),
+                (
+                    "grpc_server_heavy_hitter_handling_seconds",
+                    "Total handling time (seconds) of the top peers and methods, since the "
+                    "server started.",
+                ),
+            ],
+            snapshots,
+        ):
+            family = GaugeMetricFamily(
+                name, documentation, labels=["peer", "grpc_service", "grpc_method"]
+            )
+            for (peer, method), weight in top:
+                grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_name(method)
+                family.add_metric([peer, grpc_service_name, grpc_method_name], weight)
+            family.add_metric([OTHER, OTHER, OTHER], max(total - sum(w for _, w in top), 0))
+            yield family
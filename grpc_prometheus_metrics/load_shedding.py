@@ -0,0 +1,162 @@
+"""Adaptive per method concurrency limits to shed the load of overloaded servers"""
+import math
+import threading
+
+from prometheus_client.metrics_core import CounterMetricFamily
+from prometheus_client.metrics_core import GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+
+from grpc_prometheus_metrics import grpc_utils
+
+
+class AIMDLimit:
+    """
+    Additive increase, multiplicative decrease concurrency limit.
+
+    The limit grows by one after each successful call using at least half of it, and is
+    multiplied by ``backoff_ratio`` when a call misses its deadline or takes longer than
+    ``timeout`` seconds.
+    """
+
+    def __init__(
+        self, initial_limit=20, min_limit=1, max_limit=1000, backoff_ratio=0.9, timeout=None
+    ):
+        self.limit = initial_limit
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._backoff_ratio = backoff_ratio
+        self._timeout = timeout
+
+    def update(self, duration, in_flight, dropped):
+        if dropped or (self._timeout is not None and duration > self._timeout):
+            self.limit = max(self._min_limit, self.limit * self._backoff_ratio)
+        elif in_flight * 2 >= self.limit:
+            self.limit = min(self._max_limit, self.limit + 1)
+        return self.limit
+
+
+class GradientLimit:
+    """
+    Concurrency limit following the gradient between the long term and the current latency.
+
+    The limit shrinks when the latency grows above ``tolerance`` times its long term
+    average, which is smoothed over ``long_window`` calls, and grows by a queue of
+    sqrt(limit) otherwise. A call missing its deadline halves the gradient.
+    """
+
+    def __init__(
+        self,
+        initial_limit=20,
+        min_limit=1,
+        max_limit=1000,
+        smoothing=0.2,
+        tolerance=1.5,
+        long_window=600,
+    ):
+        self.limit = initial_limit
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._smoothing = smoothing
+        self._tolerance = tolerance
+        self._long_window = long_window
+        self._long_duration = None
+
+    def update(self, duration, in_flight, dropped):
+        if self._long_duration is None:
+            self._long_duration = duration
+        else:
+            self._long_duration += (duration - self._long_duration) / self._long_window
+            if self._long_duration > 2 * duration:
+                # Recover faster from a latency spike
+                self._long_duration *= 0.95
+
+        if not dropped and in_flight * 2 < self.limit:
+            # The limit is not reached, the latency tells nothing about it
+            return self.limit
+
+        gradient = 0.5
+        if not dropped and duration > 0:
+            gradient = max(0.5, min(1.0, self._tolerance * self._long_duration / duration))
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        new_limit = self.limit * (1 - self._smoothing) + new_limit * self._smoothing
+        self.limit = max(self._min_limit, min(self._max_limit, new_limit))
+        return self.limit
+
+
+class MethodLimiter:
+    """In flight calls of a method and their concurrency limit."""
+
+    def __init__(self, limit):
+        self._limit = limit
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    @property
+    def limit(self):
+        return self._limit.limit
+
+    def acquire(self):
+        """Returns False, and counts the rejection, when the method is over its limit."""
+        with self._lock:
+            if self.in_flight >= self._limit.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, duration, dropped=False):
+        with self._lock:
+            self._limit.update(duration, self.in_flight, dropped)
+            self.in_flight -= 1
+
+
+class LoadShedder:
+    """
+    Per method adaptive concurrency limits of the server interceptors.
+
+    ``limit_factory`` creates the limit algorithm of each method, e.g.
+    ``functools.partial(AIMDLimit, initial_limit=50)`` or :class:`GradientLimit`.
+    The calls over the limit are rejected with ``RESOURCE_EXHAUSTED`` before the
+    handler runs. Pass the shedder as ``load_shedder`` of the server interceptors.
+    """
+
+    def __init__(self, limit_factory=AIMDLimit, registry=REGISTRY):
+        self._limit_factory = limit_factory
+        self._lock = threading.Lock()
+        self._limiters = {}
+        if registry is not None:
+            registry.register(self)
+
+    def limiter(self, method):
+        limiter = self._limiters.get(method)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.setdefault(method, MethodLimiter(self._limit_factory()))
+        return limiter
+
+    def collect(self):
+        limit = GaugeMetricFamily(
+            "grpc_server_concurrency_limit",
+            "Current concurrency limit of the RPCs on the server.",
+            labels=["grpc_service", "grpc_method"],
+        )
+        in_flight = GaugeMetricFamily(
+            "grpc_server_concurrency_in_flight",
+            "Number of RPCs in flight on the server, under the concurrency limit.",
+            labels=["grpc_service", "grpc_method"],
+        )
+        shed = CounterMetricFamily(
+            "grpc_server_shed",
+            "Total number of RPCs rejected over the concurrency limit on the server.",
+            labels=["grpc_service", "grpc_method"],
+        )
+        for method, limiter in list(self._limiters.items()):
+            grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_name(method)
+            labels = [grpc_service_name, grpc_method_name]
+            limit.add_metric(labels, int(limiter.limit))
+            in_flight.add_metric(labels, limiter.in_flight)
+            shed.add_metric(labels, limiter.rejected)
+        yield limit
+        yield in_flight
+        yield shed
@@ -0,0 +1,78 @@
+"""Labels of the interceptor metrics read from the metadata of the calls"""
+import threading
+
+from grpc_prometheus_metrics import grpc_utils
+
+
+OTHER = "other"
+
+# The request and latency metrics of the server and client interceptors
+DEFAULT_METRICS = (
+    "grpc_server_started_counter",
+    "grpc_server_handled_counter",
+    "grpc_server_handled_histogram",
+    "legacy_grpc_server_handled_counter",
+    "legacy_grpc_server_handled_latency_seconds",
+    "grpc_client_started_counter",
+    "grpc_client_handled_counter",
+    "grpc_client_handled_histogram",
+    "legacy_grpc_client_completed_counter",
+    "legacy_grpc_client_completed_latency_seconds_histogram",
+)
+
+
+class MetadataLabel:
+    """
+    Adds a label read from a metadata entry of the calls, e.g. the tenant, to some metrics.
+
+    The values of ``allowlist`` are always exported. Without an allowlist, the first
+    ``max_values`` distinct values are exported, so a value never moves between its own
+    series and the others. The other values are exported as ``other``, and the calls
+    without the metadata entry with an empty label. ``metrics`` are the keys of the metrics
+    taking the label, the request and latency metrics by default.
+
+    Pass the label as ``metadata_label`` of the server and client interceptors, the
+    interceptors of a registry must use the same label on the same metrics, which their
+    constructor checks.
+    """
+
+    def __init__(
+        self,
+        metadata_key="x-tenant-id",
+        label="tenant",
+        allowlist=None,
+        max_values=100,
+        metrics=DEFAULT_METRICS,
+    ):
+        self.metadata_key = metadata_key
+        self.label = label
+        self.metrics = frozenset(metrics)
+        self._allowlist = None if allowlist is None else frozenset(allowlist)
+        self._max_values = max_values
+        self._values = set()
+        self._lock = threading.Lock()
+
+    def value(self, metadata):
+        """Returns the label value of a call from its metadata."""
+        value = grpc_utils.get_metadata_value(metadata, self.metadata_key)
+        if value is None:
+            return ""
+        if self._allowlist is not None:
+            return value if value in self._allowlist else OTHER
+        if value in self._values:
+            return value
+        with self._lock:
+            if len(self._values) < self._max_values:
+                self._values.add(value)
+                return value
+        return OTHER
+
+    def extra_labels(self):
+        """Returns the label names added to the metrics, by metric key."""
+        return {key: [self.label] for key in self.metrics}
+
+    def labels(self, key, labels, value):
+        """Returns the labels of a metric, with the label value if the metric takes it."""
+        if value is None or key not in self.metrics:
+            return labels
+        return dict(labels, **{self.label: value})
@@ -0,0 +1,49 @@
+"""Include and exclude rules selecting the methods instrumented by the interceptors"""
+import fnmatch
+import re
+
+
+# e.g. health checks and server reflection
+HEALTH_AND_REFLECTION = (
+    "/grpc.health.v1.Health/*",
+    "/grpc.reflection.v1alpha.ServerReflection/*",
+    "/grpc.reflection.v1.ServerReflection/*",
+)
+
+
+def _compile(rule):
+    """Globs are matched against the whole method path, regular expressions searched in it."""
+    if isinstance(rule, re.Pattern):
+        return rule.search
+    return re.compile(fnmatch.translate(rule)).match
+
+
+class MethodFilter:
+    """
+    Selects the methods instrumented by the interceptors from their path,
+    e.g. ``/grpc.health.v1.Health/Check``.
+
+    The rules are globs or compiled regular expressions. A method is instrumented when it
+    matches one of the ``include`` rules, or when there are none, and matches none of the
+    ``exclude`` rules. The decision is cached per method, up to ``max_methods`` methods, so
+    the interceptors hand the calls of the excluded methods over untouched.
+
+    Pass the filter as ``method_filter`` of the server and client interceptors.
+    """
+
+    def __init__(self, include=None, exclude=HEALTH_AND_REFLECTION, max_methods=10000):
+        self._include = [_compile(rule) for rule in include or ()]
+        self._exclude = [_compile(rule) for rule in exclude or ()]
+        self._max_methods = max_methods
+        self._instrumented = {}
+
+    def instrumented(self, method):
+        instrumented = self._instrumented.get(method)
+        if instrumented is None:
+            instrumented = (
+                not self._include or any(match(method) for match in self._include)
+            ) and not any(match(method) for match in self._exclude)
+            # The paths of the unknown methods are chosen by the clients
+            if len(self._instrumented) < self._max_methods:
+                self._instrumented[method] = instrumented
+        return instrumented
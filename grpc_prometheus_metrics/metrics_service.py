@@ -0,0 +1,107 @@
+"""Serve prometheus metrics over the gRPC port of the instrumented server"""
+import threading
+
+import grpc
+from prometheus_client import exposition
+from prometheus_client.metrics_core import Metric
+from prometheus_client.registry import REGISTRY
+
+
+SERVICE_NAME = "grpc_prometheus_metrics.Metrics"
+SNAPSHOT_METHOD = "/{}/Snapshot".format(SERVICE_NAME)
+WATCH_METHOD = "/{}/Watch".format(SERVICE_NAME)
+
+
+class _StaticCollector:
+    """Lets the prometheus_client encoders render an already collected list of families."""
+
+    def __init__(self, families):
+        self._families = families
+
+    def collect(self):
+        return self._families
+
+
+def collect_changed(registry, previous):
+    """
+    Collects the families of the registry keeping only the samples whose value changed.
+
+    ``previous`` maps a sample key to the last value sent and is updated in place, so the
+    first call with an empty dict returns every sample.
+    """
+    changed_families = []
+    for family in registry.collect():
+        changed = Metric(family.name, family.documentation, family.type, family.unit)
+        for sample in family.samples:
+            key = (sample.name, tuple(sorted(sample.labels.items())))
+            if previous.get(key) != sample.value:
+                previous[key] = sample.value
+                changed.samples.append(sample)
+        if changed.samples:
+            changed_families.append(changed)
+    return changed_families
+
+
+def render(families):
+    """Renders collected families with the prometheus text format."""
+    return exposition.generate_latest(_StaticCollector(families))
+
+
+class MetricsService:
+    """
+    Exposes the registry as the ``grpc_prometheus_metrics.Metrics`` service.
+
+    Both RPCs take an empty request and answer with the prometheus text format.
+    ``Snapshot`` returns the whole registry. ``Watch`` streams a full snapshot first,
+    then every ``interval`` seconds only the series that changed since the previous
+    message, and nothing when no series changed.
+    Every open ``Watch`` stream occupies one worker thread of the server.
+    """
+
+    def __init__(self, registry=REGISTRY, interval=15.0):
+        self._registry = registry
+        self._interval = interval
+
+    def Snapshot(self, request, context):  # pylint: disable=invalid-name,unused-argument
+        return exposition.generate_latest(self._registry)
+
+    def Watch(self, request, context):  # pylint: disable=invalid-name,unused-argument
+        terminated = threading.Event()
+        context.add_callback(terminated.set)
+        previous = {}
+
+        yield render(collect_changed(self._registry, previous))
+        while not terminated.wait(self._interval):
+            changed_families = collect_changed(self._registry, previous)
+            if changed_families:
+                yield render(changed_families)
+
+
+def add_metrics_service_to_server(server, registry=REGISTRY, interval=15.0):
+    """Adds the metrics service to a ``grpc.server``, next to the instrumented services."""
+    service = MetricsService(registry=registry, interval=interval)
+    register_metrics_service(server, service)
+    return service
+
+
+def register_metrics_service(server, service):
+    """Registers the ``Snapshot`` and ``Watch`` handlers of ``service`` on the server."""
+    server.add_generic_rpc_handlers(
+        (
+            grpc.method_handlers_generic_handler(
+                SERVICE_NAME,
+                {
+                    "Snapshot": grpc.unary_unary_rpc_method_handler(service.Snapshot),
+                    "Watch": grpc.unary_stream_rpc_method_handler(service.Watch),
+                },
+            ),
+        )
+    )
+
+
+class MetricsServiceStub:
+    """Client of the metrics service, the messages are the raw text exposition bytes."""
+
+    def __init__(self, channel):
+        self.Snapshot = channel.unary_unary(SNAPSHOT_METHOD)  # pylint: disable=invalid-name
+        self.Watch = channel.unary_stream(WATCH_METHOD)  # pylint: disable=invalid-name
@@ -0,0 +1,31 @@
+"""Reconfiguration of live interceptors from a signal"""
+import logging
+import signal
+import threading
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def reconfigure_on_signal(interceptors, load_options, signum=signal.SIGHUP):
+    """
+    Reconfigures the interceptors with the options returned by ``load_options()`` when the
+    process receives the signal, e.g. to reload them from a file.
+
+    The options are loaded and applied by a thread, as the reconfiguration takes locks the
+    interrupted main thread may hold. Must be called from the main thread, returns the
+    previous handler of the signal.
+    """
+
+    def reconfigure():
+        try:
+            options = load_options()
+            for interceptor in interceptors:
+                interceptor.reconfigure(**options)
+        except Exception as e:  # pylint: disable=broad-except
+            _LOGGER.error(e)
+
+    def handler(signum, frame):  # pylint: disable=unused-argument
+        threading.Thread(target=reconfigure, name="grpc-prometheus-reconfigure").start()
+
+    return signal.signal(signum, handler)
@@ -1,56 +1,350 @@
-from prometheus_client import Counter
-from prometheus_client import Histogram
-
-
-def init_metrics(registry):
-    return {
-        "grpc_server_started_counter": Counter(
-            "grpc_server_started_total",
-            "Total number of RPCs started on the server.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "grpc_server_stream_msg_received": Counter(
-            "grpc_server_msg_received_total",
-            "Total number of RPC stream messages received on the server.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "grpc_server_stream_msg_sent": Counter(
-            "grpc_server_msg_sent_total",
-            "Total number of gRPC stream messages sent by the server.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "grpc_server_handled_histogram": Histogram(
-            "grpc_server_handling_seconds",
-            "Histogram of response latency (seconds) of gRPC that had been application-level "
-            "handled by the server.",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-        "legacy_grpc_server_handled_latency_seconds": Histogram(
-            "grpc_server_handled_latency_seconds",
-            "Histogram of response latency (seconds) of gRPC that had been "
-            "application-level handled by the server",
-            ["grpc_type", "grpc_service", "grpc_method"],
-            registry=registry,
-        ),
-    }
-
-
-# Legacy metrics for backward compatibility
-def get_grpc_server_handled_counter(is_legacy, registry):
-    if is_legacy:
-        return Counter(
-            "grpc_server_handled_total",
-            "Total number of RPCs completed on the server, regardless of success or failure.",
-            ["grpc_type", "grpc_service", "grpc_method", "code"],
-            registry=registry,
-        )
-    return Counter(
+import sys
+import threading
+import weakref
+
+from functools import partial
+
+
+class _DefaultRegistry:
+    """Stands for prometheus_client.REGISTRY until the first metric is created."""
+
+    def __repr__(self):
+        return "REGISTRY"
+
+
+# Default registry of the interceptors, which do not import prometheus_client before
+# creating their first metric
+DEFAULT_REGISTRY = _DefaultRegistry()
+
+
+def resolve_registry(registry):
+    if registry is DEFAULT_REGISTRY:
+        from prometheus_client.registry import REGISTRY  # pylint: disable=import-outside-toplevel
+
+        return REGISTRY
+    return registry
+
+
+def metric_factories(registry, sink=None):
+    """Returns the counter and histogram constructors of the registry or of the sink."""
+    if sink is not None:
+        return sink.counter, sink.histogram
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import Counter
+    from prometheus_client import Histogram
+
+    registry = resolve_registry(registry)
+    return partial(Counter, registry=registry), partial(Histogram, registry=registry)
+
+
+DEADLINE_REMAINING_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    float("inf"),
+)
+
+# Metric key -> (kind, name, documentation, label names[, constructor arguments])
+SERVER_METRICS = {
+    "grpc_server_started_counter": (
+        "counter",
+        "grpc_server_started_total",
+        "Total number of RPCs started on the server.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_server_handled_counter": (
+        "counter",
         "grpc_server_handled_total",
         "Total number of RPCs completed on the server, regardless of success or failure.",
         ["grpc_type", "grpc_service", "grpc_method", "grpc_code"],
-        registry=registry,
-    )
+    ),
+    "grpc_server_stream_msg_received": (
+        "counter",
+        "grpc_server_msg_received_total",
+        "Total number of RPC stream messages received on the server.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_server_stream_msg_sent": (
+        "counter",
+        "grpc_server_msg_sent_total",
+        "Total number of gRPC stream messages sent by the server.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_server_handled_histogram": (
+        "histogram",
+        "grpc_server_handling_seconds",
+        "Histogram of response latency (seconds) of gRPC that had been application-level "
+        "handled by the server.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+    "grpc_server_deadline_remaining_seconds": (
+        "histogram",
+        "grpc_server_deadline_remaining_seconds",
+        "Histogram of the time (seconds) left before the deadline when the server starts "
+        "handling the RPC.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        {"buckets": DEADLINE_REMAINING_BUCKETS},
+    ),
+    "grpc_server_wasted_seconds": (
+        "counter",
+        "grpc_server_wasted_seconds_total",
+        "Total handling time (seconds) spent after the deadline expired or the client "
+        "cancelled the RPC.",
+        ["grpc_type", "grpc_service", "grpc_method", "reason"],
+    ),
+    "grpc_server_wasted_counter": (
+        "counter",
+        "grpc_server_wasted_total",
+        "Total number of RPCs still handled after the deadline expired or the client "
+        "cancelled the RPC.",
+        ["grpc_type", "grpc_service", "grpc_method", "reason"],
+    ),
+    "grpc_server_attempts_counter": (
+        "counter",
+        "grpc_server_attempts_total",
+        "Total number of RPC attempts received on the server, by attempt number of the "
+        "client retry or hedging policy.",
+        ["grpc_type", "grpc_service", "grpc_method", "attempt"],
+    ),
+    "grpc_server_attempt_handling_histogram": (
+        "histogram",
+        "grpc_server_attempt_handling_seconds",
+        "Histogram of response latency (seconds) of the RPC attempts handled by the "
+        "server, by attempt number.",
+        ["grpc_type", "grpc_service", "grpc_method", "attempt"],
+    ),
+    # Legacy metrics for backward compatibility
+    "legacy_grpc_server_handled_counter": (
+        "counter",
+        "grpc_server_handled_total",
+        "Total number of RPCs completed on the server, regardless of success or failure.",
+        ["grpc_type", "grpc_service", "grpc_method", "code"],
+    ),
+    "legacy_grpc_server_handled_latency_seconds": (
+        "histogram",
+        "grpc_server_handled_latency_seconds",
+        "Histogram of response latency (seconds) of gRPC that had been "
+        "application-level handled by the server",
+        ["grpc_type", "grpc_service", "grpc_method"],
+    ),
+}
+
+
+# The handling time histograms, whose buckets the interceptors take
+HANDLING_TIME_HISTOGRAMS = (
+    "grpc_server_handled_histogram",
+    "legacy_grpc_server_handled_latency_seconds",
+)
+
+
+def init_metrics(registry, sink=None, extra_labels=None, options=None):
+    """
+    Returns the server metrics of the registry, or of the sink if given.
+
+    The interceptors of a registry share its metric objects, which are created and
+    registered at their first use, so the metrics of the disabled features are never
+    exported. ``extra_labels`` are the label names added to some metrics, and ``options``
+    their constructor arguments, by metric key.
+    """
+    return LazyMetrics(SERVER_METRICS, registry, sink, extra_labels=extra_labels, options=options)
+
+
+def histogram_options(buckets, keys=HANDLING_TIME_HISTOGRAMS):
+    """Returns the constructor arguments of the histograms of the keys, default buckets if None."""
+    return {key: {} if buckets is None else {"buckets": tuple(buckets)} for key in keys}
+
+
+def get_grpc_server_handled_counter(is_legacy, registry, sink=None):
+    if is_legacy:
+        return init_metrics(registry, sink)["legacy_grpc_server_handled_counter"]
+    return init_metrics(registry, sink)["grpc_server_handled_counter"]
+
+
+_LOCK = threading.Lock()
+# Registry or sink -> _SharedMetrics of its interceptors
+_SHARED_METRICS = weakref.WeakKeyDictionary()
+# Called with the registry and the name of every metric created, e.g. to restore its series
+# from a snapshot
+METRIC_LISTENERS = []
+
+
+class _SharedMetrics:
+    """Metrics of a registry or sink, with the definitions its interceptors must share."""
+
+    def __init__(self):
+        # Metric key -> (metric, constructor arguments)
+        self.metrics = {}
+        # Metric key -> label names, and constructor arguments once set by an interceptor
+        self.label_names = {}
+        self.arguments = {}
+        # Incremented when metrics are replaced, so every interceptor binds the new ones
+        self.generation = 0
+
+
+def _owner(registry, sink):
+    """Returns the sink, or the registry, the same for DEFAULT_REGISTRY and REGISTRY."""
+    if sink is not None:
+        return sink
+    registry_module = sys.modules.get("prometheus_client.registry")
+    # Without importing prometheus_client, which is imported once a metric is created
+    if registry_module is not None and registry is registry_module.REGISTRY:
+        return DEFAULT_REGISTRY
+    return registry
+
+
+class LazyMetrics:
+    """
+    Metrics by key, created from their definition at first access.
+
+    ``const_labels`` are added to every series, and the ``extra_labels`` names to the
+    metrics of their key. ``options`` override the constructor arguments of the
+    definitions, by metric key. The interceptors of a registry share its metrics, so they
+    must use the same label names and options, or a ``ValueError`` is raised.
+    """
+
+    def __init__(
+        self,
+        definitions,
+        registry,
+        sink=None,
+        const_labels=None,
+        extra_labels=None,
+        options=None,
+    ):
+        self._definitions = definitions
+        self._registry = registry
+        self._sink = sink
+        self._const_labels = dict(const_labels or {})
+        self._extra_labels = extra_labels or {}
+        self._owner = _owner(registry, sink)
+        if self._owner is None:
+            # Metrics of no registry, not shared
+            self._shared = _SharedMetrics()
+        else:
+            with _LOCK:
+                self._shared = _SHARED_METRICS.setdefault(self._owner, _SharedMetrics())
+        self._share_definitions(options or {})
+        self._metrics = {}
+        self._generation = self._shared.generation
+
+    @property
+    def generation(self):
+        """Incremented when an interceptor of the registry replaces metrics."""
+        return self._shared.generation
+
+    def __getitem__(self, key):
+        if self._generation != self._shared.generation:
+            self._metrics = {}
+            self._generation = self._shared.generation
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = self._get_shared_metric(key)
+        return metric
+
+    def replace_options(self, options):
+        """
+        Sets the constructor arguments of some metrics, by metric key, for all the
+        interceptors of the registry. The shared metrics created with other arguments are
+        unregistered, and their series restart in the metrics created at their next use.
+        """
+        with _LOCK:
+            shared = self._shared
+            for key, key_options in options.items():
+                arguments = shared.arguments[key] = self._definition_arguments(key, key_options)
+                replaced = shared.metrics.get(key)
+                if replaced is not None and replaced[1] != arguments:
+                    del shared.metrics[key]
+                    shared.generation += 1
+                    # The registries, and the sinks backed by one
+                    owner = (
+                        self._sink if self._sink is not None else resolve_registry(self._registry)
+                    )
+                    unregister = getattr(owner, "unregister", None)
+                    if unregister is not None:
+                        unregister(replaced[0])
+
+    def _definition_arguments(self, key, options):
+        _, _, _, _, *default = self._definitions[key]
+        return dict(default[0] if default else {}, **options)
+
+    def _arguments(self, key):
+        arguments = self._shared.arguments.get(key)
+        if arguments is None:
+            return self._definition_arguments(key, {})
+        return arguments
+
+    def _label_names(self, key):
+        _, _, _, labelnames, *_ = self._definitions[key]
+        return labelnames + list(self._extra_labels.get(key, ())) + sorted(self._const_labels)
+
+    def _share_definitions(self, options):
+        """
+        Raises a ValueError if another interceptor of the registry uses other label names,
+        or other constructor arguments for the metrics of ``options``.
+        """
+        with _LOCK:
+            shared = self._shared
+            for key in self._definitions:
+                label_names = self._label_names(key)
+                shared_label_names = shared.label_names.setdefault(key, label_names)
+                if shared_label_names != label_names:
+                    raise ValueError(
+                        "The interceptors of {!r} must use the same label names, {} has "
+                        "{} and not {}".format(
+                            self._owner, self._definitions[key][1], shared_label_names, label_names
+                        )
+                    )
+            for key, key_options in options.items():
+                arguments = self._definition_arguments(key, key_options)
+                shared_arguments = shared.arguments.setdefault(key, arguments)
+                if shared_arguments != arguments:
+                    raise ValueError(
+                        "The interceptors of {!r} must use the same options, {} has {} and "
+                        "not {}".format(
+                            self._owner, self._definitions[key][1], shared_arguments, arguments
+                        )
+                    )
+
+    def _get_shared_metric(self, key):
+        kind, name, documentation, *_ = self._definitions[key]
+        with _LOCK:
+            shared = self._shared.metrics.get(key)
+            if shared is None:
+                counter, histogram = metric_factories(self._registry, self._sink)
+                factory = counter if kind == "counter" else histogram
+                arguments = self._arguments(key)
+                metric = factory(name, documentation, self._label_names(key), **arguments)
+                shared = self._shared.metrics[key] = (metric, arguments)
+                # The listeners may remove themselves
+                for listener in list(METRIC_LISTENERS):
+                    listener(resolve_registry(self._registry), name)
+        if self._const_labels:
+            return ConstLabelsMetric(shared[0], self._const_labels)
+        return shared[0]
+
+
+class ConstLabelsMetric:
+    """Adds constant labels to the children of a metric."""
+
+    def __init__(self, metric, const_labels):
+        self._metric = metric
+        self._const_labels = const_labels
+
+    def labels(self, **labels):
+        labels.update(self._const_labels)
+        return self._metric.labels(**labels)
+
+    def collect(self):
+        return self._metric.collect()
@@ -0,0 +1,91 @@
+"""Keep the last RPCs which took longer than a threshold"""
+import itertools
+import json
+import time
+
+from collections import namedtuple
+
+
+SlowCall = namedtuple(
+    "SlowCall",
+    [
+        "method",
+        "peer",
+        "code",
+        "duration",
+        "messages_received",
+        "messages_sent",
+        "request_bytes",
+        "response_bytes",
+        "timestamp",
+    ],
+)
+
+
+class SlowCallRecorder:
+    """
+    Fixed-size ring buffer of the most recent RPCs slower than their threshold.
+
+    ``method_thresholds`` maps a full method name (e.g. ``/package.Service/Method``) to
+    its threshold in seconds, the other methods use ``threshold``. Recording a call is
+    O(1) and takes no lock: the slot is reserved with an atomic counter and older calls
+    are overwritten.
+    """
+
+    def __init__(self, capacity=256, threshold=1.0, method_thresholds=None):
+        self._capacity = capacity
+        self._threshold = threshold
+        self._method_thresholds = dict(method_thresholds or {})
+        self._calls = [None] * capacity
+        self._next_slot = itertools.count()
+
+    def threshold(self, method):
+        return self._method_thresholds.get(method, self._threshold)
+
+    def add(self, call):
+        self._calls[next(self._next_slot) % self._capacity] = call
+
+    def recent(self, limit=None):
+        """Returns the recorded calls, most recent first."""
+        calls = sorted(
+            (call for call in self._calls if call is not None),
+            key=lambda call: call.timestamp,
+            reverse=True,
+        )
+        return calls[:limit]
+
+    def slowest(self, limit=10):
+        """Returns the slowest of the recorded calls, slowest first."""
+        calls = sorted(
+            (call for call in self._calls if call is not None),
+            key=lambda call: call.duration,
+            reverse=True,
+        )
+        return calls[:limit]
+
+    def clear(self):
+        self._calls = [None] * self._capacity
+
+
+def make_wsgi_app(recorder, limit=100):
+    """
+    Debug endpoint listing the recorded calls as JSON.
+
+    ``?order=slowest`` sorts them by duration instead of recency.
+    """
+
+    def slow_calls_app(environ, start_response):
+        if "order=slowest" in environ.get("QUERY_STRING", ""):
+            calls = recorder.slowest(limit)
+        else:
+            calls = recorder.recent(limit)
+        output = json.dumps(
+            {
+                "generated_at": time.time(),
+                "calls": [call._asdict() for call in calls],
+            }
+        ).encode()
+        start_response("200 OK", [("Content-Type", "application/json")])
+        return [output]
+
+    return slow_calls_app
@@ -0,0 +1,307 @@
+"""Persists the interceptor counters and histograms across restarts"""
+import atexit
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+
+from prometheus_client.registry import REGISTRY
+
+from grpc_prometheus_metrics import server_metrics
+
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"GPMS"
+VERSION = 1
+
+# Restores the snapshots written by a process of the same identity only
+MATCH = "match"
+# Restores any snapshot
+ALWAYS = "always"
+
+_COUNTER = 0
+_HISTOGRAM = 1
+
+# Little-endian fixed size fields, read in place from the mapped file
+_HEADER = struct.Struct("<4sHdI")
+_LENGTH = struct.Struct("<H")
+_KIND = struct.Struct("<B")
+_COUNT = struct.Struct("<I")
+_VALUE = struct.Struct("<d")
+
+
+def default_identity():
+    """The pod name on Kubernetes, the host name otherwise."""
+    return os.environ.get("POD_NAME") or socket.gethostname()
+
+
+def _pack_string(value):
+    data = value.encode("utf-8")
+    return _LENGTH.pack(len(data)) + data
+
+
+def _pack_values(values):
+    return struct.pack("<%dd" % len(values), *values)
+
+
+class _Reader:
+    """Reads the fields of a snapshot in order."""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._offset = 0
+
+    def unpack(self, field):
+        values = field.unpack_from(self._buffer, self._offset)
+        self._offset += field.size
+        return values
+
+    def string(self):
+        (length,) = self.unpack(_LENGTH)
+        value = bytes(self._buffer[self._offset : self._offset + length]).decode("utf-8")
+        self._offset += length
+        return value
+
+    def values(self, count):
+        values = struct.unpack_from("<%dd" % count, self._buffer, self._offset)
+        self._offset += 8 * count
+        return values
+
+
+class MetricsSnapshot:
+    """
+    Saves the counters and histograms of the interceptors to a file, and adds them back to
+    the metrics of the next process, so a deploy does not reset their series.
+
+    ``save()`` writes the families of the registry starting with one of ``prefixes`` to a
+    temporary file renamed over ``path``, so a crash never leaves a partial snapshot. After
+    ``start()``, a thread saves them every ``interval`` seconds and ``stop()`` saves them a
+    last time, also at the interpreter exit. ``restore()`` reads the snapshot at startup:
+    the metrics already created are restored right away, the others when the interceptors
+    create them at their first use. The histograms whose buckets changed are not restored.
+    The series of an ``AutoBucketHistograms`` sink get their layout in the snapshot, unless
+    saved during their warmup.
+
+    The snapshot records the ``identity`` of the process, the pod or host name by default.
+    With the ``match`` policy, only the snapshots of the same identity are restored, e.g.
+    after a container restart, as the series of another instance are still counted under
+    its own labels and restoring them would count them twice. The ``always`` policy
+    restores any snapshot. Each process must use its own path.
+    """
+
+    def __init__(
+        self,
+        path,
+        registry=REGISTRY,
+        identity=None,
+        policy=MATCH,
+        interval=60.0,
+        prefixes=("grpc_server_", "grpc_client_"),
+    ):
+        if policy not in (MATCH, ALWAYS):
+            raise ValueError("Unknown snapshot policy: %s" % policy)
+        self._path = path
+        self._registry = registry
+        self.identity = default_identity() if identity is None else identity
+        self._policy = policy
+        self._interval = interval
+        self._prefixes = tuple(prefixes)
+
+        # Family name -> kind and series not restored yet
+        self._pending = {}
+        self._restored = False
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def save(self):
+        """Writes the counters and histograms of the registry to the snapshot file."""
+        records = []
+        for family in self._registry.collect():
+            if family.type == "counter" and family.name.startswith(self._prefixes):
+                for sample in family.samples:
+                    if sample.name.endswith("_total"):
+                        records.append(
+                            _KIND.pack(_COUNTER)
+                            + self._pack_series(family.name, sample.labels)
+                            + _VALUE.pack(sample.value)
+                        )
+            elif family.type == "histogram" and family.name.startswith(self._prefixes):
+                records.extend(self._pack_histograms(family))
+
+        header = _HEADER.pack(MAGIC, VERSION, time.time(), len(records))
+        data = b"".join([header, _pack_string(self.identity)] + records)
+        temporary_path = self._path + ".tmp"
+        with self._save_lock:
+            with open(temporary_path, "wb") as snapshot_file:
+                snapshot_file.write(data)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(temporary_path, self._path)
+
+    @staticmethod
+    def _pack_series(name, labels):
+        return b"".join(
+            [_pack_string(name), _LENGTH.pack(len(labels))]
+            + [_pack_string(label) + _pack_string(value) for label, value in labels.items()]
+        )
+
+    def _pack_histograms(self, family):
+        # Labels -> upper bounds, cumulative counts and sum
+        histograms = {}
+        for sample in family.samples:
+            labels = {label: value for label, value in sample.labels.items() if label != "le"}
+            histogram = histograms.setdefault(tuple(labels.items()), ([], [], [0.0]))
+            if sample.name.endswith("_bucket"):
+                histogram[0].append(float(sample.labels["le"]))
+                histogram[1].append(sample.value)
+            elif sample.name.endswith("_sum"):
+                histogram[2][0] = sample.value
+        return [
+            _KIND.pack(_HISTOGRAM)
+            + self._pack_series(family.name, dict(labels))
+            + _COUNT.pack(len(bounds))
+            + _pack_values(bounds)
+            + _pack_values(counts)
+            + _VALUE.pack(total[0])
+            for labels, (bounds, counts, total) in histograms.items()
+        ]
+
+    def restore(self):
+        """
+        Restores the snapshot file, once. Returns the number of series read, restored or
+        waiting for the creation of their metric.
+        """
+        with self._lock:
+            if self._restored:
+                return 0
+            self._restored = True
+            try:
+                pending = self._read()
+            except FileNotFoundError:
+                return 0
+            except (OSError, ValueError, struct.error) as e:
+                _LOGGER.warning("Cannot read the metrics snapshot %s: %s", self._path, e)
+                return 0
+            if pending is None:
+                return 0
+            self._pending = pending
+            restored = sum(len(series) for _, series in pending.values())
+            for name in list(pending):
+                self._restore_family(name)
+            if self._pending:
+                server_metrics.METRIC_LISTENERS.append(self._on_metric_created)
+        return restored
+
+    def _read(self):
+        with open(self._path, "rb") as snapshot_file:
+            if os.fstat(snapshot_file.fileno()).st_size == 0:
+                raise ValueError("empty file")
+            with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                reader = _Reader(buffer)
+                magic, version, _, count = reader.unpack(_HEADER)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError("not a version %d snapshot" % VERSION)
+                identity = reader.string()
+                if self._policy == MATCH and identity != self.identity:
+                    _LOGGER.info(
+                        "Not restoring the metrics snapshot of %s in %s", identity, self.identity
+                    )
+                    return None
+                pending = {}
+                for _ in range(count):
+                    (kind,) = reader.unpack(_KIND)
+                    name = reader.string()
+                    (label_count,) = reader.unpack(_LENGTH)
+                    labels = dict((reader.string(), reader.string()) for _ in range(label_count))
+                    if kind == _COUNTER:
+                        (values,) = reader.unpack(_VALUE)
+                    else:
+                        (bucket_count,) = reader.unpack(_COUNT)
+                        values = (
+                            reader.values(bucket_count),
+                            reader.values(bucket_count),
+                            reader.unpack(_VALUE)[0],
+                        )
+                    pending.setdefault(name, (kind, []))[1].append((labels, values))
+                return pending
+
+    def _on_metric_created(self, registry, name):
+        if registry is not self._registry:
+            return
+        with self._lock:
+            self._restore_family(name)
+            if not self._pending and self._on_metric_created in server_metrics.METRIC_LISTENERS:
+                server_metrics.METRIC_LISTENERS.remove(self._on_metric_created)
+
+    def _restore_family(self, name):
+        # pylint: disable=protected-access
+        metric = self._registry._names_to_collectors.get(name)
+        if metric is None or metric._name not in self._pending:
+            return
+        kind, series = self._pending.pop(metric._name)
+        for labels, values in series:
+            try:
+                if kind == _COUNTER and metric._type == "counter":
+                    metric.labels(**labels).inc(values)
+                elif kind == _HISTOGRAM and metric._type == "histogram":
+                    if not self._restore_histogram(metric.labels(**labels), *values):
+                        _LOGGER.info(
+                            "Not restoring %s%s, its buckets changed", metric._name, labels
+                        )
+            except (ValueError, TypeError, AttributeError) as e:
+                # The label names changed, or the metric of a sink cannot be restored
+                _LOGGER.warning("Cannot restore %s%s: %s", metric._name, labels, e)
+
+    @staticmethod
+    def _restore_histogram(child, bounds, counts, total):
+        """Returns False if the buckets of the series differ from those of the snapshot."""
+        # pylint: disable=protected-access
+        # The series of the automatic buckets take their layout in the snapshot
+        seed_layout = getattr(child, "seed_layout", None)
+        if seed_layout is not None:
+            seed_layout(bounds)
+        if list(bounds) != child._upper_bounds:
+            return False
+        # The children of the compact metrics store their buckets in an array
+        restore = getattr(child, "restore", None)
+        if restore is not None:
+            restore(counts, total)
+            return True
+        previous = 0.0
+        for bucket, count in zip(child._buckets, counts):
+            bucket.inc(count - previous)
+            previous = count
+        child._sum.inc(total)
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="grpc-prometheus-snapshot", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """Stops the background thread and saves the snapshot."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            atexit.unregister(self.stop)
+        self.save()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.save()
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.error(e)
@@ -0,0 +1,191 @@
+"""Aggregating StatsD/DogStatsD sink for the interceptor metrics"""
+import logging
+import random
+import socket
+import threading
+
+
+_LOGGER = logging.getLogger(__name__)
+
+# Fits the payload of a single datagram on a 1500 bytes MTU network
+DEFAULT_MAX_PACKET_SIZE = 1432
+
+_RESERVED_CHARS = str.maketrans({c: "_" for c in ".:|@#,\n "})
+
+
+def _sanitize(value):
+    return str(value).translate(_RESERVED_CHARS)
+
+
+def _format_number(value):
+    """Formats a value in decimal notation, some servers reject exponents such as 1e-05."""
+    return ("%.6f" % value).rstrip("0").rstrip(".")
+
+
+class _StatsdChild:
+    def __init__(self, exporter, key):
+        self._exporter = exporter
+        self._key = key
+
+    def inc(self, amount=1, exemplar=None):  # pylint: disable=unused-argument
+        self._exporter.add_count(self._key, amount)
+
+    def observe(self, amount, exemplar=None):  # pylint: disable=unused-argument
+        self._exporter.add_timing(self._key, amount * 1000.0)
+
+
+class _StatsdMetric:
+    """Mimics the ``labels()`` API of the prometheus_client metrics used by the interceptors."""
+
+    def __init__(self, exporter, name, labelnames):
+        self._exporter = exporter
+        self._name = name
+        self._labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, **labels):
+        cache_key = tuple(labels.items())
+        child = self._children.get(cache_key)
+        if child is None:
+            child = _StatsdChild(self._exporter, self._exporter.series_key(self._name, labels))
+            self._children[cache_key] = child
+        return child
+
+
+class StatsdExporter:
+    """
+    Sends the interceptor metrics to StatsD instead of a prometheus registry.
+
+    Counters are summed and timings buffered in-process, then a background thread sends
+    them every ``flush_interval`` seconds packed in datagrams of at most ``max_packet_size``
+    bytes, so the RPCs never write to the socket. At most ``max_timings_per_flush`` timings
+    are kept per series and window, the rest is reflected by the StatsD sample rate.
+    With ``dogstatsd`` the labels are sent as tags, otherwise they are appended to the name.
+
+    Pass the exporter as the ``sink`` of the interceptors.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8125,
+        prefix="",
+        dogstatsd=False,
+        flush_interval=1.0,
+        max_packet_size=DEFAULT_MAX_PACKET_SIZE,
+        max_timings_per_flush=1000,
+    ):
+        self._address = (host, port)
+        self._prefix = prefix + "." if prefix else ""
+        self._dogstatsd = dogstatsd
+        self._flush_interval = flush_interval
+        self._max_packet_size = max_packet_size
+        self._max_timings_per_flush = max_timings_per_flush
+
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._timings = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def counter(self, name, documentation, labelnames, **kwargs):  # pylint: disable=unused-argument
+        if name.endswith("_total"):
+            name = name[: -len("_total")]
+        return _StatsdMetric(self, name, labelnames)
+
+    def histogram(
+        self, name, documentation, labelnames, **kwargs
+    ):  # pylint: disable=unused-argument
+        return _StatsdMetric(self, name, labelnames)
+
+    def series_key(self, name, labels):
+        """Pre-formats the part of the lines shared by every value of a series."""
+        if self._dogstatsd:
+            tags = ",".join("{}:{}".format(k, _sanitize(v)) for k, v in labels.items())
+            return self._prefix + name, "|#" + tags if tags else ""
+        return ".".join([self._prefix + name] + [_sanitize(v) for v in labels.values()]), ""
+
+    def add_count(self, key, amount):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + amount
+
+    def add_timing(self, key, milliseconds):
+        with self._lock:
+            timings = self._timings.get(key)
+            if timings is None:
+                self._timings[key] = [1, milliseconds]
+            elif len(timings) <= self._max_timings_per_flush:
+                timings[0] += 1
+                timings.append(milliseconds)
+            else:
+                # Reservoir sampling keeps an unbiased subset of the window
+                timings[0] += 1
+                index = random.randrange(timings[0])
+                if index < self._max_timings_per_flush:
+                    timings[index + 1] = milliseconds
+
+    def start(self):
+        """Starts the background thread, with a new socket when restarted after ``stop()``."""
+        if self._socket.fileno() == -1:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="grpc-prometheus-statsd", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the background thread, sends what was aggregated so far and closes the socket."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self._socket.close()
+
+    def _run(self):
+        while not self._stopped.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.error(e)
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            timings, self._timings = self._timings, {}
+
+        lines = []
+        for (stem, suffix), value in counts.items():
+            lines.append("{}:{}|c{}".format(stem, _format_number(value), suffix))
+        for (stem, suffix), values in timings.items():
+            sample_rate = ""
+            if values[0] > len(values) - 1:
+                sample_rate = "|@" + _format_number((len(values) - 1) / values[0])
+            for value in values[1:]:
+                lines.append(
+                    "{}:{}|ms{}{}".format(stem, _format_number(value), sample_rate, suffix)
+                )
+
+        for datagram in self._pack(lines):
+            try:
+                self._socket.sendto(datagram, self._address)
+            except OSError as e:
+                _LOGGER.error(e)
+
+    def _pack(self, lines):
+        packet = []
+        size = 0
+        for line in lines:
+            encoded = line.encode()
+            if packet and size + len(encoded) + 1 > self._max_packet_size:
+                yield b"\n".join(packet)
+                packet = []
+                size = 0
+            packet.append(encoded)
+            size += len(encoded) + 1
+        if packet:
+            yield b"\n".join(packet)
@@ -0,0 +1,91 @@
+"""Export prometheus metrics to a file, e.g. for the textfile collector of node-exporter"""
+import hashlib
+import logging
+import os
+import threading
+
+from timeit import default_timer
+
+from prometheus_client import exposition
+from prometheus_client.openmetrics import exposition as openmetrics_exposition
+from prometheus_client.registry import REGISTRY
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TextfileExporter:
+    """
+    Renders the registry to ``path`` every ``interval`` seconds from a background thread.
+
+    The file is written next to ``path`` and renamed over it, so a reader never sees a
+    partial file, and is not rewritten when the rendered metrics did not change. The text
+    format is read by the textfile collector of node-exporter, which only reads the
+    ``*.prom`` files of its directory; ``openmetrics=True`` renders OpenMetrics instead.
+    The interval is stretched so rendering takes at most ``max_cpu_fraction`` of the time.
+    """
+
+    def __init__(
+        self, path, registry=REGISTRY, interval=15.0, openmetrics=False, max_cpu_fraction=0.05
+    ):
+        self._path = path
+        self._registry = registry
+        self._interval = interval
+        self._encoder = (
+            openmetrics_exposition.generate_latest if openmetrics else exposition.generate_latest
+        )
+        self._max_cpu_fraction = max_cpu_fraction
+        self._digest = None
+        self.writes = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def render(self):
+        return self._encoder(self._registry)
+
+    def write(self):
+        """Renders the registry and writes the file if it changed, returns True if written."""
+        return self.write_output(self.render())
+
+    def write_output(self, output):
+        digest = hashlib.blake2b(output, digest_size=16).digest()
+        if digest == self._digest:
+            return False
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, "wb") as textfile:
+            textfile.write(output)
+        os.replace(temporary_path, self._path)
+        self._digest = digest
+        self.writes += 1
+        return True
+
+    def next_wait(self, elapsed):
+        """Seconds to wait before the next render, from the duration of the last one."""
+        return max(self._interval, elapsed / self._max_cpu_fraction)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="grpc-prometheus-textfile", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the background thread and writes the file a last time."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def _run(self):
+        wait = 0
+        while not self._stopped.wait(wait):
+            start = default_timer()
+            try:
+                self.write()
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.error(e)
+            wait = self.next_wait(default_timer() - start)
@@ -0,0 +1,101 @@
+"""
+Measures the cost of an observation and of a scrape of the handling time histogram, for
+each backend, with one series per method.
+
+    python -m tests.benchmarks.histogram_backends [--methods 300] [--observations 100000]
+"""
+import argparse
+import random
+import timeit
+
+from prometheus_client import exposition
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import server_metrics
+from grpc_prometheus_metrics.array_histograms import ArrayHistograms
+from grpc_prometheus_metrics.compact_metrics import CompactMetrics
+
+# Backend -> sink of a registry, None for the prometheus_client metrics
+BACKENDS = {
+    "prometheus_client": lambda prom_registry: None,
+    "compact": CompactMetrics,
+    "array": ArrayHistograms,
+}
+
+
+def histogram_children(backend, methods):
+    """Returns the registry and the children of the handling time histogram, per method."""
+    prom_registry = registry.CollectorRegistry()
+    _, histogram = server_metrics.metric_factories(prom_registry, BACKENDS[backend](prom_registry))
+    _, name, documentation, labelnames = server_metrics.SERVER_METRICS[
+        "grpc_server_handled_histogram"
+    ]
+    metric = histogram(name, documentation, labelnames)
+    children = [
+        metric.labels(
+            grpc_type="UNARY", grpc_service="helloworld.Greeter", grpc_method="Method%d" % index
+        )
+        for index in range(methods)
+    ]
+    return prom_registry, children
+
+
+def run(methods=300, observations=100000, scrapes=20):
+    """
+    Returns the seconds per observation, per collection of the registry and per text
+    exposition of the registry, by backend, the best of the repeated measures.
+    """
+    rng = random.Random(0)
+    latencies = [rng.lognormvariate(-5, 1.5) for _ in range(observations)]
+    results = {}
+    for backend in BACKENDS:
+        prom_registry, children = histogram_children(backend, methods)
+        calls = [
+            (children[index % methods].observe, latency) for index, latency in enumerate(latencies)
+        ]
+
+        def observe_all(calls=calls):
+            for observe, latency in calls:
+                observe(latency)
+
+        results[backend] = {
+            "observe": min(timeit.repeat(observe_all, number=1, repeat=5)) / observations,
+            "collect": min(
+                timeit.repeat(
+                    lambda prom_registry=prom_registry: list(prom_registry.collect()),
+                    number=1,
+                    repeat=scrapes,
+                )
+            ),
+            "exposition": min(
+                timeit.repeat(
+                    lambda prom_registry=prom_registry: exposition.generate_latest(prom_registry),
+                    number=1,
+                    repeat=scrapes,
+                )
+            ),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--methods", type=int, default=300)
+    parser.add_argument("--observations", type=int, default=100000)
+    args = parser.parse_args()
+    print(
+        "{:<20} {:>12} {:>12} {:>14}".format("backend", "observe us", "collect ms", "exposition ms")
+    )
+    for backend, result in run(args.methods, args.observations).items():
+        print(
+            "{:<20} {:>12.3f} {:>12.2f} {:>14.2f}".format(
+                backend,
+                result["observe"] * 1e6,
+                result["collect"] * 1e3,
+                result["exposition"] * 1e3,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Measures the overhead of the interceptors per call, without the network.
+
+The server interceptors are called as grpc does for every RPC: intercept_service, then the
+wrapped behavior with a servicer context stub. The client interceptor is called with a
+continuation returning a completed call.
+
+    python -m tests.benchmarks.interceptor_overhead [--calls 100000]
+        [--update-baselines tests/benchmarks/baselines.json]
+"""
+import argparse
+import contextlib
+import json
+import statistics
+import timeit
+
+from concurrent import futures
+from types import SimpleNamespace
+
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.array_histograms import ArrayHistograms
+from grpc_prometheus_metrics.background_recorder import BackgroundRecorder
+from grpc_prometheus_metrics.compact_metrics import CompactMetrics
+from grpc_prometheus_metrics.method_filter import MethodFilter
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+_METHOD = "/helloworld.Greeter/SayHello"
+_STREAM_METHOD = "/helloworld.Greeter/SayHelloUnaryStream"
+_STREAM_LENGTH = 10
+
+SERVER_CONFIGS = {
+    "counters": {},
+    "handling_time_histogram": {"enable_handling_time_histogram": True},
+    "legacy": {"legacy": True},
+    # The events are buffered, the recorder thread is not started
+    "handling_time_histogram_recorder": {"enable_handling_time_histogram": True, "recorder": True},
+    "handling_time_histogram_compact": {"enable_handling_time_histogram": True, "compact": True},
+    "handling_time_histogram_array": {"enable_handling_time_histogram": True, "array": True},
+    # The benchmarked method is excluded, its handler is returned untouched
+    "excluded_method": {"method_filter": MethodFilter(exclude=["/helloworld.Greeter/*"])},
+    # The exceptions skipping takes the general wrapper
+    "general_wrapper": {"enable_handling_time_histogram": True, "skip_exceptions": True},
+}
+
+CLIENT_CONFIGS = {
+    "counters": {},
+    "handling_time_histogram": {"enable_client_handling_time_histogram": True},
+    "legacy": {"legacy": True},
+    "handling_time_histogram_recorder": {
+        "enable_client_handling_time_histogram": True,
+        "recorder": True,
+    },
+    "handling_time_histogram_compact": {
+        "enable_client_handling_time_histogram": True,
+        "compact": True,
+    },
+    "handling_time_histogram_array": {
+        "enable_client_handling_time_histogram": True,
+        "array": True,
+    },
+    "excluded_method": {"method_filter": MethodFilter(exclude=["/helloworld.Greeter/*"])},
+}
+
+
+class _ServicerContext:
+    def __init__(self):
+        self._state = SimpleNamespace(client=None, code=None)
+
+
+class _Call:
+    @staticmethod
+    def code():
+        return grpc.StatusCode.OK
+
+
+def _say_hello(request, context):  # pylint: disable=unused-argument
+    return request
+
+
+def _time_per_call(function, calls):
+    return min(timeit.repeat(function, number=calls, repeat=5)) / calls
+
+
+def _intercept_service(interceptor, handler, method):
+    details = SimpleNamespace(method=method, invocation_metadata=())
+
+    def continuation(handler_call_details):  # pylint: disable=unused-argument
+        return handler
+
+    if interceptor is None:
+        return lambda: continuation(details)
+    return lambda: interceptor.intercept_service(continuation, details)
+
+
+def server_call(interceptor, calls):
+    """Returns the seconds per unary call through the server interceptor, or without it."""
+    intercept_service = _intercept_service(
+        interceptor, grpc.unary_unary_rpc_method_handler(_say_hello), _METHOD
+    )
+    request = hello_world_pb2.HelloRequest(name="benchmark")
+    context = _ServicerContext()
+
+    def call():
+        intercept_service().unary_unary(request, context)
+
+    return _time_per_call(call, calls)
+
+
+def server_stream_call(interceptor, calls):
+    """Returns the seconds per streaming call of the Greeter through the server interceptor."""
+    intercept_service = _intercept_service(
+        interceptor,
+        grpc.unary_stream_rpc_method_handler(Greeter().SayHelloUnaryStream),
+        _STREAM_METHOD,
+    )
+    request = hello_world_pb2.MultipleHelloResRequest(name="benchmark", res=_STREAM_LENGTH)
+    context = _ServicerContext()
+
+    def call():
+        for _ in intercept_service().unary_stream(request, context):
+            pass
+
+    return _time_per_call(call, calls)
+
+
+def client_call(interceptor, calls):
+    """Returns the seconds per unary call through the client interceptor, or without it."""
+    details = SimpleNamespace(method=_METHOD, metadata=None)
+    request = hello_world_pb2.HelloRequest(name="benchmark")
+    completed_call = _Call()
+
+    def continuation(client_call_details, request):  # pylint: disable=unused-argument
+        return completed_call
+
+    if interceptor is None:
+
+        def call():
+            continuation(details, request)
+
+    else:
+
+        def call():
+            interceptor.intercept_unary_unary(continuation, details, request)
+
+    return _time_per_call(call, calls)
+
+
+def client_stream_call(interceptor, calls):
+    """Returns the seconds per streaming call through the client interceptor, or without it."""
+    details = SimpleNamespace(method=_STREAM_METHOD, metadata=None)
+    request = hello_world_pb2.MultipleHelloResRequest(name="benchmark", res=_STREAM_LENGTH)
+    replies = [hello_world_pb2.HelloReply(message="Hello") for _ in range(_STREAM_LENGTH)]
+
+    def continuation(client_call_details, request):  # pylint: disable=unused-argument
+        return iter(replies)
+
+    if interceptor is None:
+
+        def call():
+            for _ in continuation(details, request):
+                pass
+
+    else:
+
+        def call():
+            for _ in interceptor.intercept_unary_stream(continuation, details, request):
+                pass
+
+    return _time_per_call(call, calls)
+
+
+def _interceptor_kwargs(config):
+    kwargs = dict(config, registry=registry.CollectorRegistry())
+    if kwargs.pop("recorder", False):
+        # A buffer large enough to never drop the events of the benchmark
+        kwargs["sink"] = BackgroundRecorder(kwargs["registry"], buffer_size=2**20)
+    if kwargs.pop("compact", False):
+        kwargs["sink"] = CompactMetrics(kwargs["registry"])
+    if kwargs.pop("array", False):
+        kwargs["sink"] = ArrayHistograms(kwargs["registry"])
+    return kwargs
+
+
+def run(calls=100000):
+    """Returns the overhead (seconds per call) of each configuration of the interceptors."""
+    results = {}
+    server_baseline = server_call(None, calls)
+    for name, kwargs in SERVER_CONFIGS.items():
+        interceptor = PromServerInterceptor(**_interceptor_kwargs(kwargs))
+        results["server_" + name] = server_call(interceptor, calls) - server_baseline
+
+    client_baseline = client_call(None, calls)
+    for name, kwargs in CLIENT_CONFIGS.items():
+        interceptor = PromClientInterceptor(**_interceptor_kwargs(kwargs))
+        results["client_" + name] = client_call(interceptor, calls) - client_baseline
+    return results
+
+
+@contextlib.contextmanager
+def greeter_stub():
+    """Yields a stub of the Greeter served on localhost, without interceptors."""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.insecure_channel("localhost:{}".format(port)) as channel:
+            yield hello_world_grpc.GreeterStub(channel)
+    finally:
+        server.stop(None)
+
+
+def round_trip(stub, streaming, calls):
+    """Returns the seconds per unary, or server streaming, round trip of the Greeter."""
+    if streaming:
+        request = hello_world_pb2.MultipleHelloResRequest(name="benchmark", res=_STREAM_LENGTH)
+        return _time_per_call(lambda: list(stub.SayHelloUnaryStream(request)), calls)
+    request = hello_world_pb2.HelloRequest(name="benchmark")
+    return _time_per_call(lambda: stub.SayHello(request), calls)
+
+
+# Path -> measure, streaming round trip, interceptor and its arguments, gated by
+# test_overhead_regression
+GATED_PATHS = {
+    "server_unary": (
+        server_call,
+        False,
+        PromServerInterceptor,
+        {"enable_handling_time_histogram": True},
+    ),
+    "server_streaming": (
+        server_stream_call,
+        True,
+        PromServerInterceptor,
+        {"enable_handling_time_histogram": True},
+    ),
+    "client_unary": (
+        client_call,
+        False,
+        PromClientInterceptor,
+        {"enable_client_handling_time_histogram": True},
+    ),
+    "client_streaming": (
+        client_stream_call,
+        True,
+        PromClientInterceptor,
+        {"enable_client_handling_time_histogram": True},
+    ),
+}
+
+
+def relative_overheads(path, calls=2000, rounds=7):
+    """
+    Returns the overhead of the interceptor on a gated path relative to the round trip of
+    the same call to the Greeter on localhost, once per round. The overhead is measured
+    without the network, as the difference with the call without interceptor, so its
+    jitter does not hide a regression, and the round trip of the same round, so a change of
+    the machine speed affects both.
+    """
+    measure, streaming, interceptor_class, kwargs = GATED_PATHS[path]
+    interceptor = interceptor_class(**_interceptor_kwargs(kwargs))
+    overheads = []
+    with greeter_stub() as stub:
+        for _ in range(rounds):
+            overhead = measure(interceptor, calls) - measure(None, calls)
+            # A round trip is about a hundred times slower than the call in-process
+            overheads.append(overhead / round_trip(stub, streaming, max(calls // 100, 1)))
+    return overheads
+
+
+def median_and_mad(values):
+    """Returns the median and the median absolute deviation of the values."""
+    median = statistics.median(values)
+    return median, statistics.median(abs(value - median) for value in values)
+
+
+def load_baselines(path):
+    with open(path, encoding="utf-8") as baselines_file:
+        return json.load(baselines_file)
+
+
+def update_baselines(path, calls=2000, rounds=15):
+    """
+    Measures the median relative overhead of the gated paths and stores it as their
+    baselines in ``path``.
+    """
+    baselines = {
+        name: round(median_and_mad(relative_overheads(name, calls, rounds))[0], 4)
+        for name in GATED_PATHS
+    }
+    with open(path, "w", encoding="utf-8") as baselines_file:
+        json.dump(baselines, baselines_file, indent=4, sort_keys=True)
+        baselines_file.write("\n")
+    return baselines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument(
+        "--update-baselines",
+        metavar="PATH",
+        help="store the relative overheads of the gated paths in PATH",
+    )
+    args = parser.parse_args()
+    if args.update_baselines:
+        for name, overhead in update_baselines(args.update_baselines).items():
+            print("{:<40} {:>8.1%} of a round trip".format(name, overhead))
+        return
+    for name, overhead in run(args.calls).items():
+        print("{:<40} {:>8.2f} us/call".format(name, overhead * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures the memory per series of the interceptor metrics, for each backend.
+
+Every metric of server_metrics and client_metrics is created alone in a registry, then
+its series are added, with one event each, while tracemalloc traces the allocations.
+
+    python -m tests.benchmarks.memory_per_series [--series 1000]
+"""
+import argparse
+import tracemalloc
+
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import client_metrics
+from grpc_prometheus_metrics import server_metrics
+from grpc_prometheus_metrics.array_histograms import ArrayHistograms
+from grpc_prometheus_metrics.compact_metrics import CompactMetrics
+
+# Backend -> sink of a registry, None for the prometheus_client metrics
+BACKENDS = {
+    "prometheus_client": lambda prom_registry: None,
+    "compact": CompactMetrics,
+    # The counters are the prometheus_client ones
+    "array": ArrayHistograms,
+}
+
+DEFINITIONS = dict(server_metrics.SERVER_METRICS, **client_metrics.CLIENT_METRICS)
+
+
+def bytes_per_series(key, backend, series=1000):
+    """Returns the bytes allocated per series of the metric of the key."""
+    kind, name, documentation, labelnames, *options = DEFINITIONS[key]
+    prom_registry = registry.CollectorRegistry()
+    counter, histogram = server_metrics.metric_factories(
+        prom_registry, BACKENDS[backend](prom_registry)
+    )
+    factory = counter if kind == "counter" else histogram
+    metric = factory(name, documentation, labelnames, **(options[0] if options else {}))
+    # The label values are the same for every backend, they are not measured
+    series_labels = [
+        {labelname: "{}-{}".format(labelname, index) for labelname in labelnames}
+        for index in range(series)
+    ]
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for labels in series_labels:
+            child = metric.labels(**labels)
+            if kind == "counter":
+                child.inc()
+            else:
+                child.observe(0.1)
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return allocated / series
+
+
+def run(series=1000):
+    """Returns the bytes per series of each metric, by metric key and backend."""
+    return {
+        key: {backend: bytes_per_series(key, backend, series) for backend in BACKENDS}
+        for key in DEFINITIONS
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--series", type=int, default=1000)
+    args = parser.parse_args()
+    print("{:<56}".format("metric (bytes/series)") + "".join("{:>18}".format(b) for b in BACKENDS))
+    for key, results in run(args.series).items():
+        print("{:<56}".format(key) + "".join("{:>18.0f}".format(v) for v in results.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -105,6 +105,55 @@ def grpc_stub():
     prom_server.shutdown()
 
 
+@pytest.fixture(scope="function")
+def grpc_channel_factory():
+    """
+    Starts servers on a free localhost port and returns a channel to each, stopped after the
+    test. A server serves the Greeter, or the generic ``handlers`` by service name when
+    given, and ``add_servicers`` are called with the server before it starts.
+    """
+    servers = []
+    channels = []
+
+    def _start(
+        server_interceptors=(),
+        client_interceptor=None,
+        handlers=None,
+        add_servicers=(),
+        max_workers=2,
+        channel_options=None,
+    ):
+        server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=max_workers), interceptors=server_interceptors
+        )
+        if handlers is None:
+            hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+        else:
+            server.add_generic_rpc_handlers(
+                tuple(
+                    grpc.method_handlers_generic_handler(service, method_handlers)
+                    for service, method_handlers in handlers.items()
+                )
+            )
+        for add_servicer in add_servicers:
+            add_servicer(server)
+        port = server.add_insecure_port("localhost:0")
+        server.start()
+        servers.append(server)
+
+        channel = grpc.insecure_channel("localhost:{}".format(port), options=channel_options)
+        channels.append(channel)
+        if client_interceptor is not None:
+            channel = grpc.intercept_channel(channel, client_interceptor)
+        return channel
+
+    yield _start
+    for channel in channels:
+        channel.close()
+    for server in servers:
+        server.stop(0)
+
+
 @pytest.fixture(scope="module")
 def stream_request_generator():
     def _generate_requests(number_of_names):
@@ -0,0 +1,93 @@
+import asyncio
+import gzip
+
+import pytest
+import grpc
+from prometheus_client import registry
+from prometheus_client.parser import text_string_to_metric_families
+
+from grpc_prometheus_metrics.aio import metrics_server
+from grpc_prometheus_metrics.aio.prometheus_aio_server_interceptor import PromAioServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_async_server import AsyncGreeter
+
+
+async def _http_get(port, path="/metrics", headers=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = ["GET {} HTTP/1.1".format(path), "Host: localhost", "Connection: close"]
+    lines += ["{}: {}".format(name, value) for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode().split("\r\n")
+    response_headers = dict(line.split(": ", 1) for line in header_lines)
+    return int(status_line.split()[1]), response_headers, body
+
+
+async def _scrape_after_calls(target_count, headers):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    server = grpc.aio.server(
+        interceptors=(
+            PromAioServerInterceptor(
+                enable_handling_time_histogram=True, unary_only=True, registry=prom_registry
+            ),
+        )
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(AsyncGreeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    await server.start()
+    http_server = await metrics_server.start_http_server(
+        0, addr="127.0.0.1", registry=prom_registry, max_slice_seconds=0
+    )
+    try:
+        async with grpc.aio.insecure_channel("localhost:{}".format(port)) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            for i in range(target_count):
+                await stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+        return await _http_get(http_server.port, headers=headers)
+    finally:
+        await http_server.stop()
+        await server.stop(0)
+
+
+@pytest.mark.parametrize("target_count", [1, 10])
+def test_aio_metrics_server_text_format(target_count):
+    status, headers, body = asyncio.run(_scrape_after_calls(target_count, {}))
+    assert status == 200
+    assert headers["Content-Type"].startswith("text/plain")
+    metrics = {m.name: m for m in text_string_to_metric_families(body.decode())}
+    assert metrics["grpc_server_started"].samples[0].value == target_count
+    assert metrics["grpc_server_handled"].samples[0].value == target_count
+
+
+def test_aio_metrics_server_gzip_openmetrics():
+    status, headers, body = asyncio.run(
+        _scrape_after_calls(
+            3, {"Accept": "application/openmetrics-text", "Accept-Encoding": "gzip"}
+        )
+    )
+    assert status == 200
+    assert headers["Content-Type"].startswith("application/openmetrics-text")
+    assert headers["Content-Encoding"] == "gzip"
+    text = gzip.decompress(body).decode()
+    # A single terminator, regardless of the family-by-family rendering
+    assert text.count("# EOF") == 1
+    assert text.endswith("# EOF\n")
+    assert "grpc_server_started_total" in text
+
+
+def test_aio_metrics_server_unknown_path():
+    async def _run():
+        http_server = await metrics_server.start_http_server(
+            0, addr="127.0.0.1", registry=registry.CollectorRegistry()
+        )
+        try:
+            return await _http_get(http_server.port, path="/other")
+        finally:
+            await http_server.stop()
+
+    status, _, _ = asyncio.run(_run())
+    assert status == 404
@@ -0,0 +1,120 @@
+import threading
+
+import pytest
+from prometheus_client import Counter
+from prometheus_client import Histogram
+from prometheus_client import registry
+from prometheus_client.openmetrics import exposition
+
+from grpc_prometheus_metrics.array_histograms import ArrayHistograms
+from grpc_prometheus_metrics.compact_metrics import CompactMetrics
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.benchmarks import histogram_backends
+
+_LABELS = {"grpc_type": "UNARY", "grpc_service": "helloworld.Greeter", "grpc_method": "A"}
+
+
+def _exposition_lines(collector_registry):
+    return [
+        line
+        for line in exposition.generate_latest(collector_registry).decode().splitlines()
+        if "_created" not in line
+    ]
+
+
+@pytest.mark.parametrize("buckets", [(0.1, 1.0), Histogram.DEFAULT_BUCKETS, (-1.0, 0.0, 1.0)])
+def test_array_exposition(buckets):
+    prom_registry = registry.CollectorRegistry()
+    histogram = Histogram(
+        "latency_seconds", "Latency.", ["kind"], buckets=buckets, registry=prom_registry
+    )
+    array_registry = registry.CollectorRegistry()
+    array_histogram = ArrayHistograms(array_registry).histogram(
+        "latency_seconds", "Latency.", ["kind"], buckets=buckets
+    )
+
+    # The rows are added between the observations of the first ones
+    for metric in (histogram, array_histogram):
+        for index, amount in enumerate((0.05, 0.1, 0.5, 3.0, 0.0, 7.5, 0.25)):
+            for kind in ("a", "b", "c")[: index % 3 + 1]:
+                metric.labels(kind=kind).observe(amount)
+
+    assert _exposition_lines(array_registry) == _exposition_lines(prom_registry)
+
+
+def test_array_concurrent_observations():
+    prom_registry = registry.CollectorRegistry()
+    histogram = ArrayHistograms(prom_registry).histogram("latency_seconds", "Latency.", ["kind"])
+
+    def observe(thread):
+        # Every thread adds its own series, growing the array during the observations
+        for index in range(2000):
+            histogram.labels(kind="shared").observe(0.2)
+            histogram.labels(kind="thread-%d-%d" % (thread, index % 50)).observe(0.02)
+
+    threads = [threading.Thread(target=observe, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert prom_registry.get_sample_value("latency_seconds_count", {"kind": "shared"}) == 16000
+    assert (
+        prom_registry.get_sample_value("latency_seconds_bucket", {"kind": "shared", "le": "0.1"})
+        == 0
+    )
+    for thread in range(8):
+        labels = {"kind": "thread-%d-7" % thread}
+        assert prom_registry.get_sample_value("latency_seconds_count", labels) == 40
+        assert prom_registry.get_sample_value("latency_seconds_sum", labels) == pytest.approx(0.8)
+
+
+def test_array_exemplars():
+    prom_registry = registry.CollectorRegistry()
+    histogram = ArrayHistograms(prom_registry).histogram("latency_seconds", "Latency.", ["kind"])
+    histogram.labels(kind="a").observe(0.01)
+    histogram.labels(kind="b").observe(0.3, {"trace_id": "def"})
+
+    exemplars = {
+        (sample.labels["kind"], sample.labels["le"]): sample.exemplar
+        for family in prom_registry.collect()
+        for sample in family.samples
+        if sample.name.endswith("_bucket")
+    }
+    assert exemplars[("b", "0.5")].labels == {"trace_id": "def"}
+    assert exemplars[("a", "0.5")] is None
+    assert exemplars[("b", "0.25")] is None
+
+
+@pytest.mark.parametrize("counters_class", [None, CompactMetrics])
+def test_array_histograms_counters(counters_class):
+    prom_registry = registry.CollectorRegistry()
+    counters = counters_class(prom_registry) if counters_class is not None else None
+    interceptor = PromServerInterceptor(
+        enable_handling_time_histogram=True,
+        registry=prom_registry,
+        sink=ArrayHistograms(prom_registry, counters=counters),
+    )
+    started = interceptor._metrics["grpc_server_started_counter"]
+    assert isinstance(started, Counter) == (counters_class is None)
+    started.labels(**_LABELS).inc()
+    interceptor._metrics["grpc_server_handled_histogram"].labels(**_LABELS).observe(0.2)
+
+    # The histogram with the previous buckets is unregistered
+    interceptor.reconfigure(handling_time_buckets=[0.5, 60.0])
+    interceptor._metrics["grpc_server_handled_histogram"].labels(**_LABELS).observe(0.2)
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 1
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handling_seconds_bucket", dict(_LABELS, le="0.5")
+        )
+        == 1
+    )
+
+
+def test_array_backend_benchmark():
+    results = histogram_backends.run(methods=50, observations=200, scrapes=5)
+    assert set(results) == set(histogram_backends.BACKENDS)
+    for result in results.values():
+        assert set(result) == {"observe", "collect", "exposition"}
+        assert all(seconds > 0 for seconds in result.values())
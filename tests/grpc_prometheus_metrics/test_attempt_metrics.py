@@ -0,0 +1,158 @@
+import itertools
+import json
+import threading
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import grpc_utils
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+
+_SERVICE_CONFIG = json.dumps(
+    {
+        "methodConfig": [
+            {
+                "name": [{"service": "Flaky"}],
+                "retryPolicy": {
+                    "maxAttempts": 4,
+                    "initialBackoff": "0.01s",
+                    "maxBackoff": "0.1s",
+                    "backoffMultiplier": 2,
+                    "retryableStatusCodes": ["UNAVAILABLE"],
+                },
+            }
+        ]
+    }
+)
+
+
+@pytest.fixture(scope="function")
+def flaky_server(grpc_channel_factory):
+    server_registry = registry.CollectorRegistry(auto_describe=True)
+    calls = itertools.count()
+    unblock = threading.Event()
+
+    def fail_twice(request, context):
+        if next(calls) < 2:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Try again")
+        return request
+
+    def push_back(request, context):
+        context.set_trailing_metadata(((grpc_utils.RETRY_PUSHBACK_KEY, "-1"),))
+        context.abort(grpc.StatusCode.UNAVAILABLE, "Overloaded")
+
+    def push_back_stream(request_iterator, context):
+        list(request_iterator)
+        unblock.wait(5)
+        push_back(None, context)
+
+    client_registry = registry.CollectorRegistry(auto_describe=True)
+    channel = grpc_channel_factory(
+        server_interceptors=(
+            PromServerInterceptor(registry=server_registry, enable_attempt_metrics=True),
+        ),
+        client_interceptor=PromClientInterceptor(
+            registry=client_registry, enable_client_attempt_metrics=True
+        ),
+        handlers={
+            "Flaky": {
+                "FailTwice": grpc.unary_unary_rpc_method_handler(fail_twice),
+                "PushBack": grpc.unary_unary_rpc_method_handler(push_back),
+                "PushBackStream": grpc.stream_unary_rpc_method_handler(push_back_stream),
+            }
+        },
+        channel_options=[("grpc.service_config", _SERVICE_CONFIG)],
+    )
+
+    yield channel, server_registry, client_registry, unblock
+    unblock.set()
+
+
+def test_attempt_metrics(flaky_server):
+    channel, server_registry, client_registry, _ = flaky_server
+    assert channel.unary_unary("/Flaky/FailTwice")(b"ok") == b"ok"
+
+    labels = {"grpc_type": "UNARY", "grpc_service": "Flaky", "grpc_method": "FailTwice"}
+    for attempt in ("1", "2", "3"):
+        assert (
+            server_registry.get_sample_value(
+                "grpc_server_attempts_total", dict(labels, attempt=attempt)
+            )
+            == 1
+        )
+        assert (
+            server_registry.get_sample_value(
+                "grpc_server_attempt_handling_seconds_count", dict(labels, attempt=attempt)
+            )
+            == 1
+        )
+    assert (
+        server_registry.get_sample_value("grpc_server_attempts_total", dict(labels, attempt="4"))
+        is None
+    )
+
+    with pytest.raises(grpc.RpcError):
+        channel.unary_unary("/Flaky/PushBack")(b"")
+    labels = {"grpc_type": "UNARY", "grpc_service": "Flaky", "grpc_method": "PushBack"}
+    # The pushback stops the retries
+    assert (
+        server_registry.get_sample_value("grpc_server_attempts_total", dict(labels, attempt="1"))
+        == 1
+    )
+    assert (
+        server_registry.get_sample_value("grpc_server_attempts_total", dict(labels, attempt="2"))
+        is None
+    )
+    assert (
+        client_registry.get_sample_value(
+            "grpc_client_retry_pushback_total", dict(labels, pushback="stop")
+        )
+        == 1
+    )
+
+
+def test_retry_pushback_of_a_future(flaky_server):
+    channel, _, client_registry, unblock = flaky_server
+    labels = {
+        "grpc_type": "CLIENT_STREAMING",
+        "grpc_service": "Flaky",
+        "grpc_method": "PushBackStream",
+    }
+
+    # The interceptor does not wait for the end of the call to return the future
+    future = channel.stream_unary("/Flaky/PushBackStream").future(iter([b""]))
+    assert not future.done()
+    assert (
+        client_registry.get_sample_value(
+            "grpc_client_retry_pushback_total", dict(labels, pushback="stop")
+        )
+        is None
+    )
+
+    # Called back after the callback of the interceptor
+    done = threading.Event()
+    future.add_done_callback(lambda _: done.set())
+    unblock.set()
+    assert done.wait(5)
+    assert future.exception().code() == grpc.StatusCode.UNAVAILABLE
+    assert (
+        client_registry.get_sample_value(
+            "grpc_client_retry_pushback_total", dict(labels, pushback="stop")
+        )
+        == 1
+    )
+
+
+@pytest.mark.parametrize(
+    "metadata, expected",
+    [
+        (None, 1),
+        ((("grpc-previous-rpc-attempts", "2"),), 3),
+        ((("grpc-previous-rpc-attempts", "1000"),), grpc_utils.MAX_ATTEMPTS),
+        ((("grpc-previous-rpc-attempts", "invalid"),), 1),
+    ],
+)
+def test_get_attempt(metadata, expected):
+    assert grpc_utils.get_attempt(metadata) == expected
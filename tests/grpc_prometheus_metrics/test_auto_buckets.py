@@ -0,0 +1,250 @@
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+import grpc
+from prometheus_client import registry
+from prometheus_client.openmetrics import exposition
+
+from grpc_prometheus_metrics import auto_buckets
+from grpc_prometheus_metrics import snapshot
+from grpc_prometheus_metrics.auto_buckets import AutoBucketHistograms
+from grpc_prometheus_metrics.auto_buckets import LatencySketch
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+
+_LABELS = {"grpc_type": "UNARY", "grpc_service": "helloworld.Greeter", "grpc_method": "SayHello"}
+_HANDLER = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+
+
+def _latencies(count, mu=-5.0, seed=0):
+    rng = random.Random(seed)
+    return [rng.lognormvariate(mu, 1.0) for _ in range(count)]
+
+
+def _buckets(prom_registry, name, labels):
+    return {
+        sample.labels["le"]: sample.value
+        for family in prom_registry.collect()
+        for sample in family.samples
+        if sample.name == name + "_bucket"
+        and all(sample.labels[label] == value for label, value in labels.items())
+    }
+
+
+def _layout_info(prom_registry):
+    return {
+        (sample.labels["histogram"], sample.labels["grpc_method"]): (
+            sample.labels["buckets"],
+            sample.labels["source"],
+        )
+        for family in prom_registry.collect()
+        for sample in family.samples
+        if sample.name == "grpc_histogram_bucket_layout_info"
+    }
+
+
+@pytest.mark.parametrize("quantile", [0.01, 0.25, 0.5, 0.9, 0.99, 0.999])
+def test_sketch_quantiles(quantile):
+    latencies = _latencies(20000)
+    sketch = LatencySketch(accuracy=0.01)
+    for latency in latencies:
+        sketch.add(latency)
+
+    expected = sorted(latencies)[int(quantile * (len(latencies) - 1))]
+    assert sketch.quantile(quantile) == pytest.approx(expected, rel=0.02)
+    assert sketch.count == 20000
+    assert len(sketch.bins) < 1000
+
+
+@pytest.mark.parametrize("budget", range(1, 16))
+def test_bucket_layout_budget(budget):
+    sketch = LatencySketch()
+    for latency in _latencies(5000):
+        sketch.add(latency)
+
+    upper_bounds = auto_buckets.bucket_layout(sketch, budget)
+    assert 1 <= len(upper_bounds) <= budget
+    assert upper_bounds == sorted(set(upper_bounds))
+    # The slowest observation is below the last bound
+    assert upper_bounds[-1] > sketch.max
+    assert all(float("%.2g" % bound) == bound for bound in upper_bounds)
+
+
+def test_layout_frozen_after_the_warmup():
+    prom_registry = registry.CollectorRegistry()
+    sink = AutoBucketHistograms(
+        prom_registry, warmup_observations=1000, bucket_budget=8, min_observations=100
+    )
+    histogram = sink.histogram("grpc_server_handling_seconds", "Latency.", ["grpc_method"]).labels(
+        grpc_method="A"
+    )
+    latencies = _latencies(3000)
+
+    for latency in latencies[:999]:
+        histogram.observe(latency)
+    # Only the +Inf bucket while warming up
+    assert _buckets(prom_registry, "grpc_server_handling_seconds", {}) == {"+Inf": 999}
+    assert _layout_info(prom_registry) == {}
+
+    histogram.observe(latencies[999])
+    buckets = _buckets(prom_registry, "grpc_server_handling_seconds", {})
+    assert 2 <= len(buckets) <= 9
+    # The warmup observations are counted in the chosen buckets
+    assert buckets["+Inf"] == 1000
+    ((name, labels, upper_bounds, source),) = sink.layouts()
+    assert (name, labels, source) == (
+        "grpc_server_handling_seconds",
+        {"grpc_method": "A"},
+        "observed",
+    )
+    assert len(upper_bounds) == len(buckets)
+    assert _layout_info(prom_registry)[("grpc_server_handling_seconds", "A")] == (
+        ",".join(buckets),
+        "observed",
+    )
+
+    # The layout is kept, whatever the next latencies
+    for latency in latencies[1000:]:
+        histogram.observe(latency * 100)
+    assert list(_buckets(prom_registry, "grpc_server_handling_seconds", {})) == list(buckets)
+    assert (
+        prom_registry.get_sample_value("grpc_server_handling_seconds_count", {"grpc_method": "A"})
+        == 3000
+    )
+    assert prom_registry.get_sample_value(
+        "grpc_server_handling_seconds_sum", {"grpc_method": "A"}
+    ) == pytest.approx(sum(latencies[:1000]) + 100 * sum(latencies[1000:]))
+
+
+def test_layout_per_method():
+    prom_registry = registry.CollectorRegistry()
+    sink = AutoBucketHistograms(prom_registry, warmup_observations=500, min_observations=100)
+    histogram = sink.histogram("grpc_server_handling_seconds", "Latency.", ["grpc_method"])
+    for fast, slow in zip(_latencies(500, mu=-7.0), _latencies(500, mu=-1.0, seed=1)):
+        histogram.labels(grpc_method="Fast").observe(fast)
+        histogram.labels(grpc_method="Slow").observe(slow)
+
+    layouts = {labels["grpc_method"]: bounds for _, labels, bounds, _ in sink.layouts()}
+    assert layouts["Fast"][-2] < layouts["Slow"][len(layouts["Slow"]) // 2]
+
+
+def test_layout_frozen_after_the_warmup_seconds():
+    prom_registry = registry.CollectorRegistry()
+    sink = AutoBucketHistograms(prom_registry, warmup_seconds=0.05, min_observations=10)
+    histogram = sink.histogram(
+        "grpc_client_handling_seconds", "Latency.", ["grpc_method"], buckets=(0.1, 1.0)
+    )
+    for latency in _latencies(20):
+        histogram.labels(grpc_method="A").observe(latency)
+    for latency in _latencies(5):
+        histogram.labels(grpc_method="B").observe(latency)
+    time.sleep(0.1)
+
+    # The expired warmups end at the scrape, the default buckets without enough observations
+    assert _layout_info(prom_registry)[("grpc_client_handling_seconds", "A")][1] == "observed"
+    assert _layout_info(prom_registry)[("grpc_client_handling_seconds", "B")] == (
+        "0.1,1.0,+Inf",
+        "default",
+    )
+    assert _buckets(prom_registry, "grpc_client_handling_seconds", {"grpc_method": "B"}) == {
+        "0.1": 5,
+        "1.0": 5,
+        "+Inf": 5,
+    }
+
+
+def test_interceptor_handling_time_histogram():
+    prom_registry = registry.CollectorRegistry()
+    sink = AutoBucketHistograms(prom_registry, warmup_observations=200, min_observations=100)
+    interceptor = PromServerInterceptor(
+        enable_handling_time_histogram=True, registry=prom_registry, sink=sink
+    )
+    details = SimpleNamespace(method="/helloworld.Greeter/SayHello", invocation_metadata=())
+    for _ in range(300):
+        handler = interceptor.intercept_service(lambda handler_call_details: _HANDLER, details)
+        handler.unary_unary(b"", SimpleNamespace(_state=SimpleNamespace(client=None, code=None)))
+
+    assert _layout_info(prom_registry)[("grpc_server_handling_seconds", "SayHello")][1] == (
+        "observed"
+    )
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) == 300
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 300
+    # The other histograms keep their buckets
+    deadline = interceptor._metrics["grpc_server_deadline_remaining_seconds"]
+    deadline.labels(**_LABELS).observe(0.2)
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_deadline_remaining_seconds_bucket", dict(_LABELS, le="0.25")
+        )
+        == 1
+    )
+
+
+def test_layout_restored_from_a_snapshot(tmp_path):
+    path = str(tmp_path / "metrics.snapshot")
+    prom_registry = registry.CollectorRegistry()
+    sink = AutoBucketHistograms(prom_registry, warmup_observations=200, min_observations=100)
+    histogram = sink.histogram("grpc_server_handling_seconds", "Latency.", ["grpc_method"])
+    for latency in _latencies(200):
+        histogram.labels(grpc_method="Tuned").observe(latency)
+    histogram.labels(grpc_method="Warming").observe(0.1)
+    snapshot.MetricsSnapshot(path, prom_registry, identity="pod-0").save()
+    buckets = _buckets(prom_registry, "grpc_server_handling_seconds", {"grpc_method": "Tuned"})
+
+    restored_registry = registry.CollectorRegistry()
+    restored_sink = AutoBucketHistograms(
+        restored_registry, warmup_observations=200, min_observations=100
+    )
+    restored = restored_sink.histogram("grpc_server_handling_seconds", "Latency.", ["grpc_method"])
+    snapshot.MetricsSnapshot(path, restored_registry, identity="pod-0").restore()
+    # The layout is kept without a warmup, the series saved while warming up are skipped
+    restored.labels(grpc_method="Tuned").observe(0.0)
+    restored_buckets = _buckets(
+        restored_registry, "grpc_server_handling_seconds", {"grpc_method": "Tuned"}
+    )
+    assert list(restored_buckets) == list(buckets)
+    assert restored_buckets == {le: count + 1 for le, count in buckets.items()}
+    assert _layout_info(restored_registry) == {
+        ("grpc_server_handling_seconds", "Tuned"): (",".join(buckets), "restored")
+    }
+    assert _buckets(
+        restored_registry, "grpc_server_handling_seconds", {"grpc_method": "Warming"}
+    ) == {"+Inf": 0}
+
+
+def test_layout_family_of_a_registry():
+    prom_registry = registry.CollectorRegistry()
+    # The sinks of the server and client interceptors
+    sinks = [
+        AutoBucketHistograms(prom_registry, warmup_observations=1, min_observations=1)
+        for _ in range(2)
+    ]
+    for sink, name in zip(sinks, ("grpc_server_handling_seconds", "grpc_client_handling_seconds")):
+        sink.histogram(name, "Latency.", ["grpc_method"]).labels(grpc_method="A").observe(0.1)
+
+    assert set(_layout_info(prom_registry)) == {
+        ("grpc_server_handling_seconds", "A"),
+        ("grpc_client_handling_seconds", "A"),
+    }
+    lines = exposition.generate_latest(prom_registry).decode().splitlines()
+    assert lines.count("# TYPE grpc_histogram_bucket_layout info") == 1
+
+
+def test_negative_buckets_without_sum():
+    prom_registry = registry.CollectorRegistry()
+    sink = AutoBucketHistograms(prom_registry, warmup_observations=1, min_observations=10)
+    histogram = sink.histogram(
+        "grpc_server_handling_seconds", "Latency.", ["grpc_method"], buckets=(-1.0, 1.0)
+    )
+    histogram.labels(grpc_method="A").observe(-0.5)
+    histogram.labels(grpc_method="B")
+
+    names = {sample.name for family in prom_registry.collect() for sample in family.samples}
+    assert "grpc_server_handling_seconds_count" in names
+    assert "grpc_server_handling_seconds_sum" not in names
+
+
+def test_bucket_budget_validation():
+    with pytest.raises(ValueError):
+        AutoBucketHistograms(registry.CollectorRegistry(), bucket_budget=0)
@@ -0,0 +1,105 @@
+from concurrent import futures
+import threading
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.background_recorder import BackgroundRecorder
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+def _samples(prom_registry):
+    # The latencies differ, only compare their count
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in prom_registry.collect()
+        for sample in family.samples
+        if not sample.name.endswith(("_bucket", "_sum", "_created"))
+        and not sample.name.startswith("grpc_recorder")
+    }
+
+
+def _run_server(prom_registry, sink=None):
+    interceptor = PromServerInterceptor(
+        enable_handling_time_histogram=True, registry=prom_registry, sink=sink
+    )
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), interceptors=(interceptor,))
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    with grpc.insecure_channel("localhost:{}".format(port)) as channel:
+        stub = hello_world_grpc.GreeterStub(channel)
+        for name in ("a", "b", "invalid"):
+            try:
+                stub.SayHello(hello_world_pb2.HelloRequest(name=name))
+            except grpc.RpcError:
+                pass
+        list(stub.SayHelloUnaryStream(hello_world_pb2.MultipleHelloResRequest(name="a", res=3)))
+    server.stop(0)
+
+
+def test_recorder_matches_the_registry():
+    direct_registry = registry.CollectorRegistry()
+    _run_server(direct_registry)
+
+    recorder_registry = registry.CollectorRegistry()
+    recorder = BackgroundRecorder(recorder_registry)
+    _run_server(recorder_registry, sink=recorder)
+
+    # The events are aggregated when the registry is collected
+    assert _samples(recorder_registry) == _samples(direct_registry)
+    assert recorder_registry.get_sample_value("grpc_recorder_dropped_events_total") == 0
+
+
+def test_recorder_counts_the_dropped_events():
+    prom_registry = registry.CollectorRegistry()
+    recorder = BackgroundRecorder(prom_registry, buffer_size=4)
+    counter = recorder.counter("events_total", "Events.", ["kind"]).labels(kind="a")
+    histogram = recorder.histogram("latency_seconds", "Latency.", ["kind"]).labels(kind="a")
+    for _ in range(5):
+        counter.inc()
+    histogram.observe(0.2)
+
+    assert prom_registry.get_sample_value("events_total", {"kind": "a"}) == 4
+    assert prom_registry.get_sample_value("latency_seconds_count", {"kind": "a"}) == 0
+    assert prom_registry.get_sample_value("grpc_recorder_dropped_events_total") == 2
+
+    # The buffer was emptied by the collection
+    histogram.observe(0.2)
+    assert prom_registry.get_sample_value("latency_seconds_count", {"kind": "a"}) == 1
+
+
+@pytest.mark.parametrize("buffer_size", [0, -1])
+def test_recorder_buffer_size_validation(buffer_size):
+    with pytest.raises(ValueError):
+        BackgroundRecorder(registry.CollectorRegistry(), buffer_size=buffer_size)
+
+
+@pytest.mark.parametrize("buffer_size", [16, 65536])
+def test_recorder_thread_aggregates_concurrent_events(buffer_size):
+    prom_registry = registry.CollectorRegistry()
+    recorder = BackgroundRecorder(prom_registry, buffer_size=buffer_size, flush_interval=0.001)
+    counter = recorder.counter("events_total", "Events.", ["kind"])
+    recorder.start()
+
+    def record():
+        child = counter.labels(kind="a")
+        for _ in range(2000):
+            child.inc()
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.stop()
+
+    recorded = prom_registry.get_sample_value("events_total", {"kind": "a"})
+    dropped = prom_registry.get_sample_value("grpc_recorder_dropped_events_total")
+    assert recorded + dropped == 8 * 2000
+    if buffer_size == 65536:
+        assert dropped == 0
@@ -0,0 +1,185 @@
+import asyncio
+from concurrent import futures
+import gc
+import time
+
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import channel_metrics
+from grpc_prometheus_metrics.aio.channel_metrics import AioChannelConnectivityMonitor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+def _start_server():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    return server, "localhost:{}".format(port)
+
+
+def _wait_for(prom_registry, name, labels):
+    # The connectivity is called back from the channel polling thread
+    for _ in range(100):
+        value = prom_registry.get_sample_value(name, labels)
+        if value:
+            return value
+        time.sleep(0.01)
+    return value
+
+
+def test_channel_connectivity_monitor():
+    server, target = _start_server()
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    monitor = channel_metrics.ChannelConnectivityMonitor(registry=prom_registry, max_targets=1)
+    channel = grpc.insecure_channel(target)
+    other_channel = grpc.insecure_channel("localhost:1")
+    monitor.monitor(channel, target)
+    monitor.monitor(other_channel, "localhost:1")
+
+    hello_world_grpc.GreeterStub(channel).SayHello(hello_world_pb2.HelloRequest(name="a"))
+    assert (
+        _wait_for(prom_registry, "grpc_client_channel_state", {"target": target, "state": "ready"})
+        == 1
+    )
+    assert (
+        _wait_for(
+            prom_registry,
+            "grpc_client_channel_transitions_total",
+            {"target": target, "from_state": "connecting", "to_state": "ready"},
+        )
+        == 1
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_channel_time_to_ready_seconds_count", {"target": target}
+        )
+        == 1
+    )
+    # Past max_targets
+    assert (
+        _wait_for(prom_registry, "grpc_client_channel_state", {"target": "other", "state": "idle"})
+        == 1
+    )
+
+    monitor.unmonitor(channel)
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_channel_state", {"target": target, "state": "ready"}
+        )
+        == 0
+    )
+    # The channel was not shut down
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_channel_transitions_total",
+            {"target": target, "from_state": "ready", "to_state": "shutdown"},
+        )
+        is None
+    )
+    channel.close()
+    other_channel.close()
+    server.stop(0)
+
+
+def test_collected_channel_is_not_monitored():
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    monitor = channel_metrics.ChannelConnectivityMonitor(registry=prom_registry)
+    channel = grpc.insecure_channel("localhost:1")
+    monitor.monitor(channel, "localhost:1")
+    assert len(monitor._trackers) == 1
+    assert (
+        _wait_for(
+            prom_registry, "grpc_client_channel_state", {"target": "localhost:1", "state": "idle"}
+        )
+        == 1
+    )
+
+    channel.close()
+    del channel
+    gc.collect()
+    assert len(monitor._trackers) == 0
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_channel_state", {"target": "localhost:1", "state": "idle"}
+        )
+        == 0
+    )
+
+
+def test_aio_closed_channel_is_not_monitored():
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    monitor = AioChannelConnectivityMonitor(registry=prom_registry)
+
+    async def _run():
+        channel = grpc.aio.insecure_channel("localhost:1")
+        tracker = monitor.monitor(channel, "localhost:1")
+        assert len(monitor._trackers) == 1
+        while tracker.state is None:
+            await asyncio.sleep(0.01)
+        assert (
+            prom_registry.get_sample_value(
+                "grpc_client_channel_state", {"target": "localhost:1", "state": "idle"}
+            )
+            == 1
+        )
+        await channel.close()
+        for _ in range(100):
+            if not monitor._trackers:
+                break
+            await asyncio.sleep(0.01)
+        # While the channel is still referenced
+        assert len(monitor._trackers) == 0
+
+    asyncio.run(_run())
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_channel_state", {"target": "localhost:1", "state": "idle"}
+        )
+        == 0
+    )
+
+
+def test_aio_channel_connectivity_monitor():
+    server, target = _start_server()
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+
+    async def _run():
+        monitor = AioChannelConnectivityMonitor(registry=prom_registry)
+        async with grpc.aio.insecure_channel(target) as channel:
+            monitor.monitor(channel, target)
+            await hello_world_grpc.GreeterStub(channel).SayHello(
+                hello_world_pb2.HelloRequest(name="a")
+            )
+            for _ in range(100):
+                if prom_registry.get_sample_value(
+                    "grpc_client_channel_state", {"target": target, "state": "ready"}
+                ):
+                    break
+                await asyncio.sleep(0.01)
+            monitor.unmonitor(channel)
+
+    asyncio.run(_run())
+    server.stop(0)
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_channel_time_to_ready_seconds_count", {"target": target}
+        )
+        == 1
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_channel_transitions_total",
+            {"target": target, "from_state": "connecting", "to_state": "ready"},
+        )
+        == 1
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_channel_state", {"target": target, "state": "ready"}
+        )
+        == 0
+    )
@@ -0,0 +1,89 @@
+from concurrent import futures
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import client_metrics
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+@pytest.fixture(scope="module")
+def greeter_target():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    yield "localhost:{}".format(port)
+    server.stop(0)
+
+
+def _say_hello(target, interceptor):
+    with grpc.intercept_channel(grpc.insecure_channel(target), interceptor) as channel:
+        hello_world_grpc.GreeterStub(channel).SayHello(hello_world_pb2.HelloRequest(name="a"))
+
+
+def _started(prom_registry, **labels):
+    return prom_registry.get_sample_value(
+        "grpc_client_started_total",
+        dict(
+            {"grpc_type": "UNARY", "grpc_service": "Greeter", "grpc_method": "SayHello"}, **labels
+        ),
+    )
+
+
+def test_client_metrics_per_registry(greeter_target):
+    first_registry = registry.CollectorRegistry(auto_describe=True)
+    second_registry = registry.CollectorRegistry(auto_describe=True)
+    _say_hello(greeter_target, PromClientInterceptor(registry=first_registry))
+    # Interceptors of the same registry share its metrics
+    _say_hello(greeter_target, PromClientInterceptor(registry=first_registry))
+    _say_hello(greeter_target, PromClientInterceptor(registry=second_registry))
+
+    assert _started(first_registry) == 2
+    assert _started(second_registry) == 1
+
+
+def test_client_metrics_are_created_at_first_use(greeter_target):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    interceptor = PromClientInterceptor(registry=prom_registry)
+    assert not list(prom_registry.collect())
+
+    _say_hello(greeter_target, interceptor)
+    assert {family.name for family in prom_registry.collect()} == {
+        "grpc_client_started",
+        "grpc_client_handled",
+    }
+
+
+def test_client_metrics_const_labels(greeter_target):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    for channel_name in ("first", "second", "second"):
+        _say_hello(
+            greeter_target,
+            PromClientInterceptor(registry=prom_registry, const_labels={"channel": channel_name}),
+        )
+
+    assert _started(prom_registry, channel="first") == 1
+    assert _started(prom_registry, channel="second") == 2
+
+
+def test_client_metrics_const_label_names_of_a_registry():
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    PromClientInterceptor(registry=prom_registry, const_labels={"channel": "first"})
+    # Raised by the constructor, not by the first RPC
+    with pytest.raises(ValueError):
+        PromClientInterceptor(registry=prom_registry, const_labels={"target": "server:6565"})
+    with pytest.raises(ValueError):
+        PromClientInterceptor(registry=prom_registry)
+    # Other registries are not affected
+    PromClientInterceptor(registry=registry.CollectorRegistry(auto_describe=True))
+
+
+def test_client_metrics_are_not_shared_without_registry():
+    first = client_metrics.init_metrics(None)["grpc_client_started_counter"]
+    second = client_metrics.init_metrics(None)["grpc_client_started_counter"]
+    assert first is not second
@@ -0,0 +1,164 @@
+from concurrent import futures
+
+import pytest
+import grpc
+from prometheus_client import Counter
+from prometheus_client import Histogram
+from prometheus_client import registry
+from prometheus_client.openmetrics import exposition
+
+from grpc_prometheus_metrics.compact_metrics import CompactMetrics
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.benchmarks import memory_per_series
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+def _series(prom_registry):
+    # The latencies differ, only the count of the buckets is compared
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): (
+            sample.value if not sample.name.endswith(("_bucket", "_sum")) else None
+        )
+        for family in prom_registry.collect()
+        for sample in family.samples
+        if not sample.name.endswith("_created")
+    }
+
+
+def _run(server_registry, client_registry, sink_class=None):
+    def sink(prom_registry):
+        return sink_class(prom_registry) if sink_class is not None else None
+
+    server_interceptor = PromServerInterceptor(
+        enable_handling_time_histogram=True, registry=server_registry, sink=sink(server_registry)
+    )
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=4), interceptors=(server_interceptor,)
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    client_interceptor = PromClientInterceptor(
+        enable_client_handling_time_histogram=True,
+        registry=client_registry,
+        sink=sink(client_registry),
+    )
+    with grpc.intercept_channel(
+        grpc.insecure_channel("localhost:{}".format(port)), client_interceptor
+    ) as channel:
+        stub = hello_world_grpc.GreeterStub(channel)
+        for name in ("a", "b", "invalid"):
+            try:
+                stub.SayHello(hello_world_pb2.HelloRequest(name=name))
+            except grpc.RpcError:
+                pass
+        list(stub.SayHelloUnaryStream(hello_world_pb2.MultipleHelloResRequest(name="a", res=3)))
+    server.stop(None)
+
+
+def test_compact_metrics_match_the_registry():
+    server_registry = registry.CollectorRegistry()
+    client_registry = registry.CollectorRegistry()
+    _run(server_registry, client_registry)
+
+    compact_server_registry = registry.CollectorRegistry()
+    compact_client_registry = registry.CollectorRegistry()
+    _run(compact_server_registry, compact_client_registry, CompactMetrics)
+
+    assert _series(compact_server_registry) == _series(server_registry)
+    assert _series(compact_client_registry) == _series(client_registry)
+
+
+@pytest.mark.parametrize("name,buckets", [("events_total", (0.1, 1.0)), ("events", (-1.0, 1.0))])
+def test_compact_exposition(name, buckets):
+    prom_registry = registry.CollectorRegistry()
+    counter = Counter(name, "Events.", ["kind"], registry=prom_registry)
+    histogram = Histogram(
+        "latency_seconds", "Latency.", ["kind"], buckets=buckets, registry=prom_registry
+    )
+    compact_registry = registry.CollectorRegistry()
+    compact_metrics = CompactMetrics(compact_registry)
+    compact_counter = compact_metrics.counter(name, "Events.", ["kind"])
+    compact_histogram = compact_metrics.histogram(
+        "latency_seconds", "Latency.", ["kind"], buckets=buckets
+    )
+
+    for metrics in ((counter, histogram), (compact_counter, compact_histogram)):
+        metrics[0].labels(kind="a").inc()
+        metrics[0].labels(kind="b").inc(2.5)
+        for amount in (0.05, 0.1, 0.5, 3.0):
+            metrics[1].labels(kind="a").observe(amount)
+        metrics[1].labels(kind="b").observe(0.5)
+
+    def exposition_lines(collector_registry):
+        return [
+            line
+            for line in exposition.generate_latest(collector_registry).decode().splitlines()
+            if "_created" not in line
+        ]
+
+    assert exposition_lines(compact_registry) == exposition_lines(prom_registry)
+
+
+def test_compact_exemplars():
+    prom_registry = registry.CollectorRegistry()
+    compact_metrics = CompactMetrics(prom_registry)
+    counter = compact_metrics.counter("events_total", "Events.", ["kind"]).labels(kind="a")
+    histogram = compact_metrics.histogram("latency_seconds", "Latency.", ["kind"]).labels(kind="a")
+    counter.inc(exemplar={"trace_id": "abc"})
+    histogram.observe(0.3, {"trace_id": "def"})
+
+    samples = {
+        (sample.name, sample.labels.get("le")): sample.exemplar
+        for family in prom_registry.collect()
+        for sample in family.samples
+    }
+    assert samples[("events_total", None)].labels == {"trace_id": "abc"}
+    assert samples[("latency_seconds_bucket", "0.5")].labels == {"trace_id": "def"}
+    assert samples[("latency_seconds_bucket", "0.25")] is None
+
+
+def test_compact_metrics_validation():
+    compact_metrics = CompactMetrics(registry.CollectorRegistry())
+    counter = compact_metrics.counter("events_total", "Events.", ["kind"])
+    with pytest.raises(ValueError):
+        counter.labels(other="a")
+    with pytest.raises(ValueError):
+        counter.labels(kind="a", other="b")
+    with pytest.raises(ValueError):
+        counter.labels(kind="a").inc(-1)
+    with pytest.raises(ValueError):
+        compact_metrics.histogram("latency_seconds", "Latency.", ["kind"], buckets=(1.0, 0.1))
+    # The names are registered
+    with pytest.raises(ValueError):
+        compact_metrics.counter("events", "Events.", ["kind"])
+
+
+def test_compact_metrics_reconfiguration():
+    prom_registry = registry.CollectorRegistry()
+    interceptor = PromServerInterceptor(
+        enable_handling_time_histogram=True,
+        registry=prom_registry,
+        sink=CompactMetrics(prom_registry),
+    )
+    labels = {"grpc_type": "UNARY", "grpc_service": "helloworld.Greeter", "grpc_method": "A"}
+    interceptor._metrics["grpc_server_handled_histogram"].labels(**labels).observe(0.2)
+
+    # The histogram with the previous buckets is unregistered
+    interceptor.reconfigure(handling_time_buckets=[0.5, 60.0])
+    interceptor._metrics["grpc_server_handled_histogram"].labels(**labels).observe(0.2)
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handling_seconds_bucket", dict(labels, le="0.5")
+        )
+        == 1
+    )
+
+
+@pytest.mark.parametrize("key", list(memory_per_series.DEFINITIONS))
+def test_compact_memory_per_series(key):
+    compact = memory_per_series.bytes_per_series(key, "compact", series=200)
+    assert compact < memory_per_series.bytes_per_series(key, "prometheus_client", series=200) / 2
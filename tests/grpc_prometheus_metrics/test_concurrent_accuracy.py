@@ -0,0 +1,455 @@
+import asyncio
+import itertools
+import random
+import time
+
+from concurrent import futures
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.aio.prometheus_aio_client_interceptor import (
+    PromAioUnaryUnaryClientInterceptor,
+)
+from grpc_prometheus_metrics.aio.prometheus_aio_server_interceptor import PromAioServerInterceptor
+from grpc_prometheus_metrics.array_histograms import ArrayHistograms
+from grpc_prometheus_metrics.auto_buckets import AutoBucketHistograms
+from grpc_prometheus_metrics.background_recorder import BackgroundRecorder
+from grpc_prometheus_metrics.compact_metrics import CompactMetrics
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_async_server import AsyncGreeter
+from tests.integration.hello_world.hello_world_server import Greeter
+
+STREAM_LENGTH = 5
+DEADLINE = 0.5
+CONCURRENCY = 32
+
+_METHODS = {
+    "UNARY": "SayHello",
+    "SERVER_STREAMING": "SayHelloUnaryStream",
+    "CLIENT_STREAMING": "SayHelloStreamUnary",
+    "BIDI_STREAMING": "SayHelloBidiStream",
+}
+
+
+class _Servicer(Greeter):
+    """
+    Waits for the deadline of the calls named "wait", and for the cancellation of the calls
+    whose last request is named "cancel", after sending their initial metadata.
+    """
+
+    def SayHello(self, request, context):
+        if request.name == "wait":
+            while context.is_active():
+                time.sleep(0.01)
+            return hello_world_pb2.HelloReply()
+        return super().SayHello(request, context)
+
+    def SayHelloUnaryStream(self, request, context):
+        if request.name == "wait":
+            while context.is_active():
+                time.sleep(0.01)
+            return
+        yield from super().SayHelloUnaryStream(request, context)
+
+    def SayHelloStreamUnary(self, request_iterator, context):
+        requests = list(request_iterator)
+        if requests[-1].name == "cancel":
+            context.send_initial_metadata(())
+            while context.is_active():
+                time.sleep(0.01)
+            return hello_world_pb2.HelloReply()
+        return super().SayHelloStreamUnary(iter(requests), context)
+
+
+# Name of a call to cancel -> event set once the servicer handles it
+_HANDLING = {}
+_CANCELLED_CALLS = itertools.count()
+
+
+class _AsyncServicer(AsyncGreeter):
+    async def SayHello(self, request, context):
+        if request.name == "wait" or request.name in _HANDLING:
+            if request.name in _HANDLING:
+                _HANDLING.pop(request.name).set()
+            await asyncio.sleep(DEADLINE * 4)
+            return hello_world_pb2.HelloReply()
+        return await super().SayHello(request, context)
+
+
+def _series(name, grpc_type, amount=1, **labels):
+    labels = dict(
+        labels, grpc_type=grpc_type, grpc_service="Greeter", grpc_method=_METHODS[grpc_type]
+    )
+    return (name, tuple(sorted(labels.items()))), amount
+
+
+def _handled(side, grpc_type, code):
+    return _series("grpc_{}_handled_total".format(side), grpc_type, grpc_code=code)
+
+
+def _unary(name):
+    return _series("grpc_{}_started_total".format(name), "UNARY")
+
+
+def _stream_requests(*names):
+    return iter([hello_world_pb2.HelloRequest(name=name) for name in names])
+
+
+def _bidi_requests(*names):
+    return iter([hello_world_pb2.MultipleHelloResRequest(name=name, res=1) for name in names])
+
+
+_VALID = ["a"] * STREAM_LENGTH
+# The stream is failed by its last request, which every message is read and sent before
+_INVALID = ["a"] * (STREAM_LENGTH - 1) + ["invalid"]
+_CANCEL = ["a"] * (STREAM_LENGTH - 1) + ["cancel"]
+
+
+def _cancel(future):
+    # Once the server handles the call
+    future.initial_metadata()
+    future.cancel()
+
+
+async def _cancel_aio(stub):
+    name = "cancel-{}".format(next(_CANCELLED_CALLS))
+    handling = _HANDLING[name] = asyncio.Event()
+    call = stub.SayHello(hello_world_pb2.HelloRequest(name=name))
+    await handling.wait()
+    call.cancel()
+    try:
+        await call
+    except asyncio.CancelledError:
+        pass
+
+
+# Scenario -> calls, call, expected server series, expected client series, following the
+# semantics of the interceptors: the streamed responses are not handled, the streamed
+# requests not started, and the exceptions of the servicer not handled by the server.
+SCENARIOS = {
+    "unary_ok": (
+        300,
+        lambda stub: stub.SayHello(hello_world_pb2.HelloRequest(name="a")),
+        [
+            _series("grpc_server_started_total", "UNARY"),
+            _handled("server", "UNARY", "OK"),
+            _series("grpc_server_handling_seconds_count", "UNARY"),
+        ],
+        [
+            _series("grpc_client_started_total", "UNARY"),
+            _handled("client", "UNARY", "OK"),
+            _series("grpc_client_handling_seconds_count", "UNARY"),
+        ],
+    ),
+    "unary_invalid": (
+        150,
+        lambda stub: stub.SayHello(hello_world_pb2.HelloRequest(name="invalid")),
+        [
+            _series("grpc_server_started_total", "UNARY"),
+            _handled("server", "UNARY", "INVALID_ARGUMENT"),
+            _series("grpc_server_handling_seconds_count", "UNARY"),
+        ],
+        [
+            _series("grpc_client_started_total", "UNARY"),
+            _handled("client", "UNARY", "INVALID_ARGUMENT"),
+            _series("grpc_client_handling_seconds_count", "UNARY"),
+        ],
+    ),
+    "unary_exception": (
+        150,
+        lambda stub: stub.SayHello(hello_world_pb2.HelloRequest(name="unknownError")),
+        [
+            _series("grpc_server_started_total", "UNARY"),
+            _series("grpc_server_handling_seconds_count", "UNARY"),
+        ],
+        [
+            _series("grpc_client_started_total", "UNARY"),
+            _handled("client", "UNARY", "UNKNOWN"),
+            _series("grpc_client_handling_seconds_count", "UNARY"),
+        ],
+    ),
+    "unary_deadline": (
+        30,
+        lambda stub: stub.SayHello(hello_world_pb2.HelloRequest(name="wait"), timeout=DEADLINE),
+        [
+            _series("grpc_server_started_total", "UNARY"),
+            _handled("server", "UNARY", "CANCELLED"),
+            _series("grpc_server_handling_seconds_count", "UNARY"),
+        ],
+        [
+            _series("grpc_client_started_total", "UNARY"),
+            _handled("client", "UNARY", "DEADLINE_EXCEEDED"),
+            _series("grpc_client_handling_seconds_count", "UNARY"),
+        ],
+    ),
+    "server_streaming_ok": (
+        200,
+        lambda stub: list(
+            stub.SayHelloUnaryStream(
+                hello_world_pb2.MultipleHelloResRequest(name="a", res=STREAM_LENGTH)
+            )
+        ),
+        [
+            _series("grpc_server_started_total", "SERVER_STREAMING"),
+            _series("grpc_server_msg_sent_total", "SERVER_STREAMING", STREAM_LENGTH),
+        ],
+        [
+            _series("grpc_client_started_total", "SERVER_STREAMING"),
+            _series("grpc_client_msg_received_total", "SERVER_STREAMING", STREAM_LENGTH),
+            _series("grpc_client_handling_seconds_count", "SERVER_STREAMING"),
+        ],
+    ),
+    "server_streaming_invalid": (
+        100,
+        lambda stub: list(
+            stub.SayHelloUnaryStream(
+                hello_world_pb2.MultipleHelloResRequest(name="invalid", res=STREAM_LENGTH)
+            )
+        ),
+        [_series("grpc_server_started_total", "SERVER_STREAMING")],
+        [
+            _series("grpc_client_started_total", "SERVER_STREAMING"),
+            _series("grpc_client_handling_seconds_count", "SERVER_STREAMING"),
+        ],
+    ),
+    "server_streaming_deadline": (
+        30,
+        lambda stub: list(
+            stub.SayHelloUnaryStream(
+                hello_world_pb2.MultipleHelloResRequest(name="wait", res=STREAM_LENGTH),
+                timeout=DEADLINE,
+            )
+        ),
+        [_series("grpc_server_started_total", "SERVER_STREAMING")],
+        [
+            _series("grpc_client_started_total", "SERVER_STREAMING"),
+            _series("grpc_client_handling_seconds_count", "SERVER_STREAMING"),
+        ],
+    ),
+    "client_streaming_ok": (
+        200,
+        lambda stub: stub.SayHelloStreamUnary(_stream_requests(*_VALID)),
+        [
+            _series("grpc_server_msg_received_total", "CLIENT_STREAMING", STREAM_LENGTH),
+            _handled("server", "CLIENT_STREAMING", "OK"),
+            _series("grpc_server_handling_seconds_count", "CLIENT_STREAMING"),
+        ],
+        [
+            _series("grpc_client_started_total", "CLIENT_STREAMING"),
+            _series("grpc_client_msg_sent_total", "CLIENT_STREAMING", STREAM_LENGTH),
+            _series("grpc_client_handling_seconds_count", "CLIENT_STREAMING"),
+        ],
+    ),
+    "client_streaming_invalid": (
+        100,
+        lambda stub: stub.SayHelloStreamUnary(_stream_requests(*_INVALID)),
+        [
+            _series("grpc_server_msg_received_total", "CLIENT_STREAMING", STREAM_LENGTH),
+            _handled("server", "CLIENT_STREAMING", "INVALID_ARGUMENT"),
+            _series("grpc_server_handling_seconds_count", "CLIENT_STREAMING"),
+        ],
+        [
+            _series("grpc_client_started_total", "CLIENT_STREAMING"),
+            _series("grpc_client_msg_sent_total", "CLIENT_STREAMING", STREAM_LENGTH),
+            _series("grpc_client_handling_seconds_count", "CLIENT_STREAMING"),
+        ],
+    ),
+    "client_streaming_cancelled": (
+        30,
+        lambda stub: _cancel(stub.SayHelloStreamUnary.future(_stream_requests(*_CANCEL))),
+        [
+            _series("grpc_server_msg_received_total", "CLIENT_STREAMING", STREAM_LENGTH),
+            _handled("server", "CLIENT_STREAMING", "CANCELLED"),
+            _series("grpc_server_handling_seconds_count", "CLIENT_STREAMING"),
+        ],
+        [
+            _series("grpc_client_started_total", "CLIENT_STREAMING"),
+            _series("grpc_client_msg_sent_total", "CLIENT_STREAMING", STREAM_LENGTH),
+            _series("grpc_client_handling_seconds_count", "CLIENT_STREAMING"),
+        ],
+    ),
+    "bidi_streaming_ok": (
+        200,
+        lambda stub: list(stub.SayHelloBidiStream(_bidi_requests(*_VALID))),
+        [
+            _series("grpc_server_msg_received_total", "BIDI_STREAMING", STREAM_LENGTH),
+            _series("grpc_server_msg_sent_total", "BIDI_STREAMING", STREAM_LENGTH),
+        ],
+        [
+            _series("grpc_client_msg_sent_total", "BIDI_STREAMING", STREAM_LENGTH),
+            _series("grpc_client_msg_received_total", "BIDI_STREAMING", STREAM_LENGTH),
+        ],
+    ),
+    "bidi_streaming_invalid": (
+        100,
+        lambda stub: list(stub.SayHelloBidiStream(_bidi_requests(*_INVALID))),
+        [
+            _series("grpc_server_msg_received_total", "BIDI_STREAMING", STREAM_LENGTH),
+            _series("grpc_server_msg_sent_total", "BIDI_STREAMING", STREAM_LENGTH - 1),
+        ],
+        [
+            _series("grpc_client_msg_sent_total", "BIDI_STREAMING", STREAM_LENGTH),
+            _series("grpc_client_msg_received_total", "BIDI_STREAMING", STREAM_LENGTH - 1),
+        ],
+    ),
+}
+
+
+def _expected(scenarios, index):
+    expected = {}
+    for calls, _, *series in scenarios.values():
+        for key, amount in series[index]:
+            expected[key] = expected.get(key, 0) + calls * amount
+    return expected
+
+
+def _samples(prom_registry):
+    # The series created before their first event are left out
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in prom_registry.collect()
+        for sample in family.samples
+        if sample.value
+        and not sample.name.endswith(("_bucket", "_sum", "_created"))
+        and not sample.name.startswith(("grpc_recorder", "grpc_histogram_bucket_layout"))
+    }
+
+
+def _interceptor_kwargs(prom_registry, backend):
+    if backend == "recorder":
+        return {
+            "registry": prom_registry,
+            "sink": BackgroundRecorder(prom_registry, flush_interval=0.01).start(),
+        }
+    if backend == "compact":
+        return {"registry": prom_registry, "sink": CompactMetrics(prom_registry)}
+    if backend == "array":
+        return {"registry": prom_registry, "sink": ArrayHistograms(prom_registry)}
+    if backend == "auto_buckets":
+        # The layouts are chosen while the calls run
+        sink = AutoBucketHistograms(prom_registry, warmup_observations=50, min_observations=20)
+        return {"registry": prom_registry, "sink": sink}
+    return {"registry": prom_registry}
+
+
+def _assert_accurate(server_registry, client_registry, scenarios):
+    assert _samples(server_registry) == _expected(scenarios, 0)
+    assert _samples(client_registry) == _expected(scenarios, 1)
+    for prom_registry in (server_registry, client_registry):
+        assert prom_registry.get_sample_value("grpc_recorder_dropped_events_total") in (None, 0)
+
+
+def _schedule(scenarios):
+    schedule = [name for name, (calls, *_) in scenarios.items() for _ in range(calls)]
+    random.Random(0).shuffle(schedule)
+    return schedule
+
+
+@pytest.mark.parametrize("backend", ["registry", "recorder", "compact", "array", "auto_buckets"])
+def test_concurrent_calls_accuracy(backend):
+    server_registry = registry.CollectorRegistry()
+    client_registry = registry.CollectorRegistry()
+    server_kwargs = _interceptor_kwargs(server_registry, backend)
+    client_kwargs = _interceptor_kwargs(client_registry, backend)
+
+    # More workers than concurrent calls, so no call waits for a worker past its deadline
+    server_executor = futures.ThreadPoolExecutor(max_workers=2 * CONCURRENCY)
+    server = grpc.server(
+        server_executor,
+        interceptors=(PromServerInterceptor(enable_handling_time_histogram=True, **server_kwargs),),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(_Servicer(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    interceptor = PromClientInterceptor(enable_client_handling_time_histogram=True, **client_kwargs)
+    with grpc.intercept_channel(
+        grpc.insecure_channel("localhost:{}".format(port)), interceptor
+    ) as channel:
+        stub = hello_world_grpc.GreeterStub(channel)
+
+        def call(name):
+            try:
+                SCENARIOS[name][1](stub)
+            except grpc.RpcError:
+                pass
+
+        with futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+            list(executor.map(call, _schedule(SCENARIOS)))
+    server.stop(None)
+    # The handlers count the calls after the clients saw them end
+    server_executor.shutdown(wait=True)
+    for kwargs in (server_kwargs, client_kwargs):
+        if isinstance(kwargs.get("sink"), BackgroundRecorder):
+            kwargs["sink"].stop()
+
+    _assert_accurate(server_registry, client_registry, SCENARIOS)
+
+
+# The grpc.aio server interceptor instruments the unary calls
+AIO_SCENARIOS = {name: scenario for name, scenario in SCENARIOS.items() if name.startswith("unary")}
+AIO_SCENARIOS["unary_cancelled"] = (
+    30,
+    _cancel_aio,
+    [
+        _series("grpc_server_started_total", "UNARY"),
+        _handled("server", "UNARY", "CANCELLED"),
+        _series("grpc_server_handling_seconds_count", "UNARY"),
+    ],
+    [
+        _series("grpc_client_started_total", "UNARY"),
+        _handled("client", "UNARY", "CANCELLED"),
+        _series("grpc_client_handling_seconds_count", "UNARY"),
+    ],
+)
+
+
+@pytest.mark.parametrize("backend", ["registry", "recorder", "compact", "array", "auto_buckets"])
+def test_concurrent_aio_calls_accuracy(backend):
+    server_registry = registry.CollectorRegistry()
+    client_registry = registry.CollectorRegistry()
+    server_kwargs = _interceptor_kwargs(server_registry, backend)
+    client_kwargs = _interceptor_kwargs(client_registry, backend)
+
+    async def _run():
+        server = grpc.aio.server(
+            interceptors=(
+                PromAioServerInterceptor(
+                    enable_handling_time_histogram=True, unary_only=True, **server_kwargs
+                ),
+            )
+        )
+        hello_world_grpc.add_GreeterServicer_to_server(_AsyncServicer(), server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        interceptor = PromAioUnaryUnaryClientInterceptor(
+            enable_client_handling_time_histogram=True, **client_kwargs
+        )
+        async with grpc.aio.insecure_channel(
+            "localhost:{}".format(port), interceptors=[interceptor]
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            # As many calls in flight as the threads of the sync test, so the calls do not
+            # wait for the others past their deadline
+            semaphore = asyncio.Semaphore(CONCURRENCY)
+
+            async def call(name):
+                async with semaphore:
+                    try:
+                        await AIO_SCENARIOS[name][1](stub)
+                    except grpc.RpcError:
+                        pass
+
+            await asyncio.gather(*(call(name) for name in _schedule(AIO_SCENARIOS)))
+        await server.stop(None)
+
+    asyncio.run(_run())
+    for kwargs in (server_kwargs, client_kwargs):
+        if isinstance(kwargs.get("sink"), BackgroundRecorder):
+            kwargs["sink"].stop()
+
+    _assert_accurate(server_registry, client_registry, AIO_SCENARIOS)
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+
+
+@pytest.fixture(scope="function")
+def deadline_server(grpc_channel_factory):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    handled = threading.Event()
+
+    def sleep(request, context):
+        time.sleep(float(request))
+        handled.set()
+        return b""
+
+    channel = grpc_channel_factory(
+        server_interceptors=(
+            PromServerInterceptor(registry=prom_registry, enable_deadline_metrics=True),
+        ),
+        handlers={"Slow": {"Sleep": grpc.unary_unary_rpc_method_handler(sleep)}},
+    )
+    return channel.unary_unary("/Slow/Sleep"), prom_registry, handled
+
+
+def _labels(**labels):
+    return dict({"grpc_type": "UNARY", "grpc_service": "Slow", "grpc_method": "Sleep"}, **labels)
+
+
+def test_deadline_remaining_and_wasted_time(deadline_server):
+    sleep, prom_registry, handled = deadline_server
+    # grpc rounds the timeout up, the time remaining may exceed it a little
+    sleep(b"0", timeout=8)
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_deadline_remaining_seconds_bucket", _labels(le="10.0")
+        )
+        == 1
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_deadline_remaining_seconds_bucket", _labels(le="5.0")
+        )
+        == 0
+    )
+
+    with pytest.raises(grpc.RpcError) as error:
+        sleep(b"0.5", timeout=0.1)
+    assert error.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    assert handled.wait(5)
+    # The interceptor records the call right after the handler returns
+    for _ in range(500):
+        wasted = prom_registry.get_sample_value(
+            "grpc_server_wasted_total", _labels(reason="deadline_exceeded")
+        )
+        if wasted:
+            break
+        time.sleep(0.01)
+    assert wasted == 1
+    wasted_seconds = prom_registry.get_sample_value(
+        "grpc_server_wasted_seconds_total", _labels(reason="deadline_exceeded")
+    )
+    # The handler sleeps about 0.4s past the deadline
+    assert 0 < wasted_seconds < 0.5
+    assert (
+        prom_registry.get_sample_value("grpc_server_wasted_total", _labels(reason="cancelled"))
+        is None
+    )
+
+
+def test_no_deadline_is_not_observed(deadline_server):
+    sleep, prom_registry, _ = deadline_server
+    sleep(b"0")
+    assert (
+        prom_registry.get_sample_value("grpc_server_deadline_remaining_seconds_count", _labels())
+        is None
+    )
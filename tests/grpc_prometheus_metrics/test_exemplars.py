@@ -0,0 +1,94 @@
+import pytest
+from prometheus_client import registry
+from prometheus_client.openmetrics.exposition import generate_latest
+from prometheus_client.openmetrics.parser import text_string_to_metric_families
+
+from grpc_prometheus_metrics import exemplars
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+
+TRACE_ID = "0af7651916cd43dd8448eb211c80319c"
+
+
+def _traceparent(span_number):
+    return "00-{}-{:016x}-01".format(TRACE_ID, span_number)
+
+
+def _exemplars(prom_registry, sample_name):
+    families = text_string_to_metric_families(generate_latest(prom_registry).decode())
+    return [
+        sample.exemplar
+        for family in families
+        for sample in family.samples
+        if sample.name == sample_name and sample.exemplar is not None
+    ]
+
+
+@pytest.fixture(scope="function")
+def exemplar_registries(grpc_channel_factory):
+    server_registry = registry.CollectorRegistry(auto_describe=True)
+    client_registry = registry.CollectorRegistry(auto_describe=True)
+    client_interceptor = PromClientInterceptor(
+        enable_client_handling_time_histogram=True,
+        registry=client_registry,
+        exemplar_extractor=exemplars.traceparent_extractor,
+        exemplar_min_interval=60,
+    )
+    channel = grpc_channel_factory(
+        server_interceptors=(
+            PromServerInterceptor(
+                enable_handling_time_histogram=True,
+                registry=server_registry,
+                exemplar_extractor=exemplars.traceparent_extractor,
+                exemplar_min_interval=60,
+            ),
+        ),
+        client_interceptor=client_interceptor,
+    )
+    return hello_world_grpc.GreeterStub(channel), server_registry, client_registry
+
+
+@pytest.mark.parametrize("target_count", [1, 10])
+def test_exemplars_are_rate_limited_per_series(target_count, exemplar_registries):
+    stub, server_registry, client_registry = exemplar_registries
+    for i in range(target_count):
+        stub.SayHello(
+            hello_world_pb2.HelloRequest(name=str(i)), metadata=(("traceparent", _traceparent(i)),)
+        )
+
+    for prom_registry, prefix in [
+        (server_registry, "grpc_server"),
+        (client_registry, "grpc_client"),
+    ]:
+        handled = _exemplars(prom_registry, prefix + "_handled_total")
+        buckets = _exemplars(prom_registry, prefix + "_handling_seconds_bucket")
+        # Only the first call of the window is kept as exemplar of each series
+        assert [e.labels for e in handled] == [
+            {"trace_id": TRACE_ID, "span_id": _traceparent(0)[36:52]}
+        ]
+        assert buckets
+        assert all(e.labels["span_id"] == "0" * 16 for e in buckets)
+
+
+def test_exemplars_without_traceparent(exemplar_registries):
+    stub, server_registry, _ = exemplar_registries
+    stub.SayHello(hello_world_pb2.HelloRequest(name="untraced"))
+    assert _exemplars(server_registry, "grpc_server_handled_total") == []
+
+
+@pytest.mark.parametrize(
+    "metadata, expected",
+    [
+        (
+            (("traceparent", _traceparent(7)),),
+            {"trace_id": TRACE_ID, "span_id": "0000000000000007"},
+        ),
+        ((("traceparent", "garbage"),), None),
+        ((("other", "value"),), None),
+        (None, None),
+    ],
+)
+def test_traceparent_extractor(metadata, expected):
+    assert exemplars.traceparent_extractor(metadata) == expected
@@ -0,0 +1,69 @@
+from concurrent import futures
+from types import SimpleNamespace
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+def _collect_samples(legacy, skip_exceptions, stream_request_generator, bidi_request_generator):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    interceptor = PromServerInterceptor(
+        legacy=legacy,
+        enable_handling_time_histogram=True,
+        skip_exceptions=skip_exceptions,
+        log_exceptions=False,
+        registry=prom_registry,
+    )
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), interceptors=(interceptor,))
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    with grpc.insecure_channel("localhost:{}".format(port)) as channel:
+        stub = hello_world_grpc.GreeterStub(channel)
+        for name in ("a", "b", "invalid"):
+            try:
+                stub.SayHello(hello_world_pb2.HelloRequest(name=name))
+            except grpc.RpcError:
+                pass
+        list(stub.SayHelloUnaryStream(hello_world_pb2.MultipleHelloResRequest(name="a", res=3)))
+        stub.SayHelloStreamUnary(stream_request_generator(4))
+        list(stub.SayHelloBidiStream(bidi_request_generator(2, 2)))
+    server.stop(0)
+
+    # The latencies differ, only compare their count
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in prom_registry.collect()
+        for sample in family.samples
+        if not sample.name.endswith(("_bucket", "_sum", "_created"))
+    }
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_fast_path_matches_the_general_wrapper(
+    legacy, stream_request_generator, bidi_request_generator
+):
+    fast_samples = _collect_samples(legacy, False, stream_request_generator, bidi_request_generator)
+    general_samples = _collect_samples(
+        legacy, True, stream_request_generator, bidi_request_generator
+    )
+    assert fast_samples
+    assert fast_samples == general_samples
+
+
+def test_fast_path_caches_the_wrapped_handlers():
+    interceptor = PromServerInterceptor(registry=registry.CollectorRegistry())
+    handler = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+
+    def continuation(handler_call_details):  # pylint: disable=unused-argument
+        return handler
+
+    details = SimpleNamespace(method="/helloworld.Greeter/SayHello", invocation_metadata=())
+    wrapped_handler = interceptor.intercept_service(continuation, details)
+    assert interceptor.intercept_service(continuation, details) is wrapped_handler
@@ -0,0 +1,88 @@
+import pytest
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import heavy_hitters
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+
+
+@pytest.fixture(scope="function")
+def heavy_hitters_stub(grpc_channel_factory):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    tracker = heavy_hitters.HeavyHitterTracker(k=2, registry=prom_registry)
+    channel = grpc_channel_factory(
+        server_interceptors=(PromServerInterceptor(registry=prom_registry, heavy_hitters=tracker),)
+    )
+    return hello_world_grpc.GreeterStub(channel), prom_registry
+
+
+def test_heavy_hitters_exports_top_k_and_other(
+    heavy_hitters_stub, stream_request_generator, bidi_request_generator
+):
+    stub, prom_registry = heavy_hitters_stub
+    for i in range(5):
+        stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+    for _ in range(3):
+        list(stub.SayHelloUnaryStream(hello_world_pb2.MultipleHelloResRequest(name="a", res=2)))
+    stub.SayHelloStreamUnary(stream_request_generator(2))
+    list(stub.SayHelloBidiStream(bidi_request_generator(1, 1)))
+
+    samples = {
+        (sample.labels["grpc_method"], sample.labels["peer"]): sample.value
+        for family in prom_registry.collect()
+        if family.name == "grpc_server_heavy_hitter_requests"
+        for sample in family.samples
+    }
+    # Every call comes from the same client whatever its connection port
+    peer = next(peer for method, peer in samples if method == "SayHello")
+    assert samples == {
+        ("SayHello", peer): 5,
+        ("SayHelloUnaryStream", peer): 3,
+        ("other", "other"): 2,
+    }
+
+    hello_bytes = prom_registry.get_sample_value(
+        "grpc_server_heavy_hitter_bytes",
+        {"peer": peer, "grpc_service": "Greeter", "grpc_method": "SayHello"},
+    )
+    assert hello_bytes == sum(
+        hello_world_pb2.HelloRequest(name=str(i)).ByteSize()
+        + hello_world_pb2.HelloReply(message="Hello, %s!" % i).ByteSize()
+        for i in range(5)
+    )
+
+
+def test_space_saving_keeps_the_heaviest_keys():
+    sketch = heavy_hitters.SpaceSaving(capacity=3)
+    for key, weight in [("a", 10), ("b", 5), ("c", 1), ("d", 1), ("e", 1), ("a", 10)]:
+        sketch.add(key, weight)
+
+    top = sketch.top(2)
+    assert top == [("a", 20), ("b", 5)]
+    assert sketch.total == 28
+
+
+@pytest.mark.parametrize(
+    "peer, expected",
+    [
+        ("ipv4:127.0.0.1:53412", "ipv4:127.0.0.1"),
+        ("ipv6:[::1]:53412", "ipv6:[::1]"),
+        ("unix:/tmp/socket", "unix:/tmp/socket"),
+    ],
+)
+def test_peer_address(peer, expected):
+    assert heavy_hitters.peer_address(peer) == expected
+
+
+def test_space_saving_replaces_the_lightest_key():
+    sketch = heavy_hitters.SpaceSaving(capacity=3)
+    for key, weight in [("a", 1), ("b", 2), ("c", 3), ("a", 5), ("d", 1)]:
+        sketch.add(key, weight)
+
+    # "b" became the lightest key once "a" grew, "d" inherits its weight
+    assert dict(sketch.top(3)) == {"a": 6, "c": 3, "d": 3}
+    sketch.add("e", 0.5)
+    assert dict(sketch.top(3)) == {"a": 6, "d": 3, "e": 3.5}
+    with pytest.raises(ValueError):
+        sketch.add("a", -1)
@@ -0,0 +1,93 @@
+import subprocess
+import sys
+
+from types import SimpleNamespace
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+
+_IMPORT_SCRIPT = """
+import sys
+import {module}
+assert "prometheus_client" not in sys.modules
+{module}.{interceptor}()
+assert "prometheus_client" not in sys.modules
+"""
+
+
+def _family_names(prom_registry):
+    return {family.name for family in prom_registry.collect()}
+
+
+def _import_time_us(stderr, module):
+    # python -X importtime lines: "import time: self [us] | cumulative | imported package"
+    for line in stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    return None
+
+
+@pytest.mark.parametrize(
+    "module, interceptor",
+    [
+        ("grpc_prometheus_metrics.prometheus_server_interceptor", "PromServerInterceptor"),
+        ("grpc_prometheus_metrics.prometheus_client_interceptor", "PromClientInterceptor"),
+    ],
+)
+def test_interceptors_import_prometheus_client_lazily(module, interceptor, record_property):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            _IMPORT_SCRIPT.format(module=module, interceptor=interceptor),
+        ],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    import_time = _import_time_us(result.stderr, module)
+    assert import_time is not None
+    # Cold start cost of the interceptor module, grpc included, reported in the junit xml
+    record_property("import_time_us", import_time)
+
+
+def test_server_metrics_are_registered_at_first_use():
+    prom_registry = registry.CollectorRegistry()
+    interceptor = PromServerInterceptor(registry=prom_registry)
+    assert _family_names(prom_registry) == set()
+
+    handler = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+    details = SimpleNamespace(method="/helloworld.Greeter/SayHello", invocation_metadata=())
+    context = SimpleNamespace(_state=SimpleNamespace(client=None, code=None))
+    wrapped = interceptor.intercept_service(lambda handler_call_details: handler, details)
+    wrapped.unary_unary(hello_world_pb2.HelloRequest(name="a"), context)
+
+    # Only the counters of a unary call, the handling time histogram is disabled
+    assert _family_names(prom_registry) == {"grpc_server_started", "grpc_server_handled"}
+
+
+def test_interceptors_of_a_registry_share_the_metrics():
+    prom_registry = registry.CollectorRegistry()
+    details = SimpleNamespace(method="/helloworld.Greeter/SayHello", metadata=None)
+    request = hello_world_pb2.HelloRequest(name="a")
+    call = SimpleNamespace(code=lambda: grpc.StatusCode.OK)
+    for _ in range(2):
+        interceptor = PromClientInterceptor(registry=prom_registry)
+        interceptor.intercept_unary_unary(lambda details, request: call, details, request)
+
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_started_total",
+            {"grpc_type": "UNARY", "grpc_service": "helloworld.Greeter", "grpc_method": "SayHello"},
+        )
+        == 2
+    )
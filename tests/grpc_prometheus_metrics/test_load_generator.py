@@ -0,0 +1,64 @@
+import pytest
+
+from tests.integration.hello_world import load_generator
+
+
+def _started_handled_errors(counted):
+    return counted["started"], counted["handled"], counted["errors"]
+
+
+@pytest.mark.parametrize("use_aio", [False, True])
+def test_load_generator_report(use_aio):
+    report = load_generator.run(
+        concurrency=4, calls=40, duration=60, payload=64, error_rate=0.2, use_aio=use_aio
+    )
+
+    assert list(report) == list(load_generator.KINDS)
+    assert sum(result["calls"] for result in report.values()) == 40
+    for result in report.values():
+        assert result["calls"] == 10
+        assert 0 < result["p50"] <= result["p90"] <= result["p99"]
+    unary = report["unary"]
+    assert 0 < unary["errors"] < unary["calls"]
+    expected = (unary["calls"], unary["calls"], unary["errors"])
+    assert _started_handled_errors(unary["client"]) == expected
+    assert _started_handled_errors(unary["server"]) == expected
+    if use_aio:
+        # The grpc.aio interceptors only instrument the unary calls
+        for kind in ("server_streaming", "client_streaming", "bidi_streaming"):
+            assert (
+                report[kind]["server"]
+                == report[kind]["client"]
+                == dict.fromkeys(("started", "handled", "msg_received", "msg_sent", "errors"), 0)
+            )
+        return
+
+    server_streaming = report["server_streaming"]
+    assert server_streaming["server"]["started"] == server_streaming["calls"]
+    assert server_streaming["client"]["started"] == server_streaming["calls"]
+    assert (
+        server_streaming["server"]["msg_sent"]
+        == server_streaming["client"]["msg_received"]
+        == server_streaming["msg_received"]
+    )
+    client_streaming = report["client_streaming"]
+    assert client_streaming["server"]["handled"] == client_streaming["calls"]
+    assert client_streaming["server"]["errors"] == client_streaming["errors"]
+    assert client_streaming["client"]["started"] == client_streaming["calls"]
+    assert client_streaming["client"]["msg_sent"] == client_streaming["msg_sent"]
+    # The failed calls may not receive all the messages sent
+    assert 0 < client_streaming["server"]["msg_received"] <= client_streaming["msg_sent"]
+    bidi_streaming = report["bidi_streaming"]
+    assert bidi_streaming["client"]["msg_sent"] == bidi_streaming["msg_sent"]
+    assert (
+        bidi_streaming["server"]["msg_sent"]
+        == bidi_streaming["client"]["msg_received"]
+        == bidi_streaming["msg_received"]
+    )
+
+
+def test_load_generator_without_interceptors():
+    report = load_generator.run(kinds=("unary",), concurrency=2, calls=10, interceptors=False)
+
+    assert report["unary"]["calls"] == 10
+    assert report["unary"]["server"]["started"] == report["unary"]["client"]["started"] == 0
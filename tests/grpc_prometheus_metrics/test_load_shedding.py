@@ -0,0 +1,131 @@
+import functools
+import threading
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import load_shedding
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+
+
+@pytest.fixture(scope="function")
+def shedding_server(grpc_channel_factory):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    shedder = load_shedding.LoadShedder(
+        functools.partial(load_shedding.AIMDLimit, initial_limit=1, max_limit=1),
+        registry=prom_registry,
+    )
+    started = threading.Event()
+    unblock = threading.Event()
+
+    def block(request, context):
+        started.set()
+        unblock.wait(5)
+        return request
+
+    def block_stream(request, context):
+        yield block(request, context)
+
+    channel = grpc_channel_factory(
+        server_interceptors=(PromServerInterceptor(registry=prom_registry, load_shedder=shedder),),
+        handlers={
+            "Blocking": {
+                "Block": grpc.unary_unary_rpc_method_handler(block),
+                "BlockStream": grpc.unary_stream_rpc_method_handler(block_stream),
+            }
+        },
+        max_workers=4,
+    )
+
+    yield channel, prom_registry, started, unblock
+    unblock.set()
+
+
+def test_load_shedding_rejects_over_the_limit(shedding_server):
+    channel, prom_registry, started, unblock = shedding_server
+    block = channel.unary_unary("/Blocking/Block")
+    labels = {"grpc_service": "Blocking", "grpc_method": "Block"}
+
+    first = block.future(b"first")
+    assert started.wait(5)
+    with pytest.raises(grpc.RpcError) as error:
+        block(b"second")
+    assert error.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert prom_registry.get_sample_value("grpc_server_concurrency_in_flight", labels) == 1
+    assert prom_registry.get_sample_value("grpc_server_shed_total", labels) == 1
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total",
+            dict(labels, grpc_type="UNARY", grpc_code="RESOURCE_EXHAUSTED"),
+        )
+        == 1
+    )
+    # The rejected call is started, as the calls handled by the behavior
+    assert (
+        prom_registry.get_sample_value("grpc_server_started_total", dict(labels, grpc_type="UNARY"))
+        == 2
+    )
+
+    unblock.set()
+    assert first.result() == b"first"
+    assert block(b"third") == b"third"
+    assert prom_registry.get_sample_value("grpc_server_concurrency_in_flight", labels) == 0
+    assert prom_registry.get_sample_value("grpc_server_concurrency_limit", labels) == 1
+
+
+def test_load_shedding_streamed_responses(shedding_server):
+    channel, prom_registry, started, unblock = shedding_server
+    labels = {"grpc_service": "Blocking", "grpc_method": "BlockStream"}
+    block_stream = channel.unary_stream("/Blocking/BlockStream")
+
+    first = block_stream(b"first")
+    assert started.wait(5)
+    with pytest.raises(grpc.RpcError) as error:
+        list(block_stream(b"second"))
+    assert error.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    unblock.set()
+    assert list(first) == [b"first"]
+
+    assert prom_registry.get_sample_value("grpc_server_shed_total", labels) == 1
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_started_total", dict(labels, grpc_type="SERVER_STREAMING")
+        )
+        == 2
+    )
+    # The streamed responses are not counted as handled, shed or not
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total",
+            dict(labels, grpc_type="SERVER_STREAMING", grpc_code="RESOURCE_EXHAUSTED"),
+        )
+        is None
+    )
+
+
+def test_aimd_limit():
+    limit = load_shedding.AIMDLimit(initial_limit=10, max_limit=12, timeout=1.0)
+    # Not using the limit does not grow it
+    assert limit.update(0.1, 2, False) == 10
+    assert limit.update(0.1, 5, False) == 11
+    assert limit.update(0.1, 11, False) == 12
+    assert limit.update(0.1, 11, False) == 12
+    assert limit.update(0.1, 11, True) == pytest.approx(10.8)
+    assert limit.update(2.0, 11, False) == pytest.approx(9.72)
+
+
+def test_gradient_limit_follows_the_latency():
+    limit = load_shedding.GradientLimit(initial_limit=20, max_limit=100)
+    for _ in range(50):
+        limit.update(0.01, 20, False)
+    grown = limit.limit
+    assert grown > 20
+
+    for _ in range(50):
+        limit.update(0.1, int(limit.limit), False)
+    assert limit.limit < grown
+
+    shrunk = limit.limit
+    limit.update(0.1, int(limit.limit), True)
+    assert limit.limit < shrunk
@@ -0,0 +1,251 @@
+import asyncio
+from concurrent import futures
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.aio.prometheus_aio_client_interceptor import (
+    PromAioUnaryUnaryClientInterceptor,
+)
+from grpc_prometheus_metrics.aio.prometheus_aio_server_interceptor import PromAioServerInterceptor
+from grpc_prometheus_metrics.metadata_labels import MetadataLabel
+from grpc_prometheus_metrics.method_filter import MethodFilter
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_async_server import AsyncGreeter
+from tests.integration.hello_world.hello_world_server import Greeter
+
+_TENANTS = ("acme", "acme", "globex", "initech", None)
+
+
+def _labels(**labels):
+    return dict(
+        {"grpc_type": "UNARY", "grpc_service": "Greeter", "grpc_method": "SayHello"}, **labels
+    )
+
+
+def _say_hellos(interceptors, client_interceptor=None):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), interceptors=interceptors)
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    channel = grpc.insecure_channel("localhost:{}".format(port))
+    if client_interceptor is not None:
+        channel = grpc.intercept_channel(channel, client_interceptor)
+    with channel:
+        stub = hello_world_grpc.GreeterStub(channel)
+        for tenant in _TENANTS:
+            metadata = None if tenant is None else (("x-tenant-id", tenant),)
+            stub.SayHello(hello_world_pb2.HelloRequest(name="a"), metadata=metadata)
+        list(stub.SayHelloUnaryStream(hello_world_pb2.MultipleHelloResRequest(name="a", res=2)))
+    server.stop(0)
+
+
+def test_metadata_label_values():
+    label = MetadataLabel(max_values=2)
+    assert label.value((("x-tenant-id", "acme"),)) == "acme"
+    assert label.value((("x-tenant-id", "globex"),)) == "globex"
+    assert label.value((("x-tenant-id", "initech"),)) == "other"
+    # The admitted values keep their series
+    assert label.value((("x-tenant-id", "acme"),)) == "acme"
+    assert label.value(None) == ""
+
+    allowlisted = MetadataLabel(allowlist=["initech"])
+    assert allowlisted.value((("x-tenant-id", "initech"),)) == "initech"
+    assert allowlisted.value((("x-tenant-id", "acme"),)) == "other"
+
+
+@pytest.mark.parametrize("skip_exceptions", [False, True])
+def test_server_metrics_by_tenant(skip_exceptions):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    interceptor = PromServerInterceptor(
+        enable_handling_time_histogram=True,
+        skip_exceptions=skip_exceptions,
+        registry=prom_registry,
+        metadata_label=MetadataLabel(max_values=2),
+    )
+    _say_hellos((interceptor,))
+
+    for tenant, count in (("acme", 2), ("globex", 1), ("other", 1), ("", 1)):
+        assert (
+            prom_registry.get_sample_value("grpc_server_started_total", _labels(tenant=tenant))
+            == count
+        )
+        assert (
+            prom_registry.get_sample_value(
+                "grpc_server_handled_total", _labels(tenant=tenant, grpc_code="OK")
+            )
+            == count
+        )
+        assert (
+            prom_registry.get_sample_value(
+                "grpc_server_handling_seconds_count", _labels(tenant=tenant)
+            )
+            == count
+        )
+    # The message counters do not take the label
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_msg_sent_total",
+            {
+                "grpc_type": "SERVER_STREAMING",
+                "grpc_service": "Greeter",
+                "grpc_method": "SayHelloUnaryStream",
+            },
+        )
+        == 2
+    )
+
+
+def test_client_metrics_by_tenant():
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    interceptor = PromClientInterceptor(
+        enable_client_handling_time_histogram=True,
+        registry=prom_registry,
+        metadata_label=MetadataLabel(allowlist=["acme"], metrics=["grpc_client_handled_counter"]),
+    )
+    _say_hellos((), interceptor)
+
+    assert prom_registry.get_sample_value("grpc_client_started_total", _labels()) == 5
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_handled_total", _labels(tenant="acme", grpc_code="OK")
+        )
+        == 2
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_handled_total", _labels(tenant="other", grpc_code="OK")
+        )
+        == 2
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_client_handled_total", _labels(tenant="", grpc_code="OK")
+        )
+        == 1
+    )
+
+
+async def _aio_excluded_then_instrumented(server_interceptor):
+    server = grpc.aio.server(interceptors=(server_interceptor,))
+    hello_world_grpc.add_GreeterServicer_to_server(AsyncGreeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel("localhost:{}".format(port)) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            responses = stub.SayHelloUnaryStream(
+                hello_world_pb2.MultipleHelloResRequest(name="a", res=2),
+                metadata=(("x-tenant-id", "acme"),),
+            )
+            assert len([response async for response in responses]) == 2
+            await stub.SayHello(
+                hello_world_pb2.HelloRequest(name="a"), metadata=(("x-tenant-id", "globex"),)
+            )
+    finally:
+        await server.stop(0)
+
+
+@pytest.mark.parametrize(
+    "exclusion",
+    [
+        {"method_filter": MethodFilter(exclude=["*/SayHelloUnaryStream"])},
+        {"unary_only": True},
+    ],
+)
+def test_aio_excluded_calls_take_no_metadata_label_value(exclusion):
+    server_registry = registry.CollectorRegistry(auto_describe=True)
+    asyncio.run(
+        _aio_excluded_then_instrumented(
+            PromAioServerInterceptor(
+                registry=server_registry,
+                metadata_label=MetadataLabel(max_values=1),
+                **exclusion,
+            )
+        )
+    )
+
+    assert (
+        server_registry.get_sample_value(
+            "grpc_server_handled_total", _labels(tenant="globex", grpc_code="OK")
+        )
+        == 1
+    )
+    assert (
+        server_registry.get_sample_value(
+            "grpc_server_handled_total", _labels(tenant="other", grpc_code="OK")
+        )
+        is None
+    )
+
+
+def test_metadata_label_names_of_a_registry():
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    PromServerInterceptor(registry=prom_registry, metadata_label=MetadataLabel())
+    # The same label on other metrics, or another label, is refused by the constructor
+    with pytest.raises(ValueError):
+        PromServerInterceptor(
+            registry=prom_registry,
+            metadata_label=MetadataLabel(metrics=["grpc_server_handled_counter"]),
+        )
+    with pytest.raises(ValueError):
+        PromAioServerInterceptor(
+            registry=prom_registry, metadata_label=MetadataLabel(label="region")
+        )
+    with pytest.raises(ValueError):
+        PromServerInterceptor(registry=prom_registry)
+    # Another instance of the same label
+    PromAioServerInterceptor(registry=prom_registry, metadata_label=MetadataLabel())
+
+
+async def _aio_say_hellos(server_interceptor, client_interceptor):
+    server = grpc.aio.server(interceptors=(server_interceptor,))
+    hello_world_grpc.add_GreeterServicer_to_server(AsyncGreeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(
+            "localhost:{}".format(port), interceptors=(client_interceptor,)
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            for tenant in _TENANTS:
+                metadata = None if tenant is None else (("x-tenant-id", tenant),)
+                await stub.SayHello(hello_world_pb2.HelloRequest(name="a"), metadata=metadata)
+    finally:
+        await server.stop(0)
+
+
+@pytest.mark.parametrize("enable_deadline_metrics", [False, True])
+def test_aio_metrics_by_tenant(enable_deadline_metrics):
+    server_registry = registry.CollectorRegistry(auto_describe=True)
+    client_registry = registry.CollectorRegistry(auto_describe=True)
+    asyncio.run(
+        _aio_say_hellos(
+            PromAioServerInterceptor(
+                unary_only=True,
+                enable_deadline_metrics=enable_deadline_metrics,
+                registry=server_registry,
+                metadata_label=MetadataLabel(allowlist=["acme", "globex"]),
+            ),
+            PromAioUnaryUnaryClientInterceptor(
+                registry=client_registry, metadata_label=MetadataLabel(max_values=1)
+            ),
+        )
+    )
+
+    for tenant, count in (("acme", 2), ("globex", 1), ("other", 1), ("", 1)):
+        assert (
+            server_registry.get_sample_value(
+                "grpc_server_handled_total", _labels(tenant=tenant, grpc_code="OK")
+            )
+            == count
+        )
+    for tenant, count in (("acme", 2), ("other", 2), ("", 1)):
+        assert (
+            client_registry.get_sample_value("grpc_client_started_total", _labels(tenant=tenant))
+            == count
+        )
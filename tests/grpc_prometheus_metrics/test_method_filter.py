@@ -0,0 +1,78 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.method_filter import MethodFilter
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+
+
+@pytest.mark.parametrize(
+    "method_filter, method, instrumented",
+    [
+        (MethodFilter(), "/helloworld.Greeter/SayHello", True),
+        (MethodFilter(), "/grpc.health.v1.Health/Check", False),
+        (MethodFilter(), "/grpc.reflection.v1alpha.ServerReflection/ServerReflectionInfo", False),
+        (MethodFilter(exclude=None), "/grpc.health.v1.Health/Check", True),
+        (MethodFilter(include=["/helloworld.*"]), "/helloworld.Greeter/SayHello", True),
+        (MethodFilter(include=["/helloworld.*"]), "/other.Greeter/SayHello", False),
+        (
+            MethodFilter(exclude=[re.compile("Stream$")]),
+            "/helloworld.Greeter/SayHelloStream",
+            False,
+        ),
+        (MethodFilter(exclude=[re.compile("Stream$")]), "/helloworld.Greeter/SayHello", True),
+    ],
+)
+def test_method_filter(method_filter, method, instrumented):
+    assert method_filter.instrumented(method) is instrumented
+    # Cached
+    assert method_filter.instrumented(method) is instrumented
+
+
+@pytest.mark.parametrize("skip_exceptions", [False, True])
+def test_server_interceptor_returns_the_handler_of_excluded_methods(skip_exceptions):
+    prom_registry = registry.CollectorRegistry()
+    interceptor = PromServerInterceptor(
+        registry=prom_registry, skip_exceptions=skip_exceptions, method_filter=MethodFilter()
+    )
+    handler = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+
+    def continuation(handler_call_details):  # pylint: disable=unused-argument
+        return handler
+
+    health_check = SimpleNamespace(method="/grpc.health.v1.Health/Check", invocation_metadata=())
+    assert interceptor.intercept_service(continuation, health_check) is handler
+
+    say_hello = SimpleNamespace(method="/helloworld.Greeter/SayHello", invocation_metadata=())
+    assert interceptor.intercept_service(continuation, say_hello) is not handler
+    assert "grpc.health.v1.Health" not in {
+        sample.labels.get("grpc_service")
+        for family in prom_registry.collect()
+        for sample in family.samples
+    }
+
+
+def test_client_interceptor_skips_excluded_methods():
+    prom_registry = registry.CollectorRegistry()
+    interceptor = PromClientInterceptor(
+        registry=prom_registry, method_filter=MethodFilter(include=["/helloworld.Greeter/*"])
+    )
+    call = SimpleNamespace(code=lambda: grpc.StatusCode.OK)
+
+    def continuation(client_call_details, request):  # pylint: disable=unused-argument
+        return call
+
+    for method in ("/helloworld.Greeter/SayHello", "/grpc.health.v1.Health/Check"):
+        details = SimpleNamespace(method=method, metadata=None)
+        assert interceptor.intercept_unary_unary(continuation, details, None) is call
+
+    assert {
+        sample.labels["grpc_service"]
+        for family in prom_registry.collect()
+        for sample in family.samples
+        if sample.name == "grpc_client_started_total"
+    } == {"helloworld.Greeter"}
@@ -0,0 +1,71 @@
+import functools
+
+import pytest
+from prometheus_client import registry
+from prometheus_client.parser import text_string_to_metric_families
+
+from grpc_prometheus_metrics import metrics_service
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+
+
+@pytest.fixture(scope="function")
+def grpc_metrics_service_channel(grpc_channel_factory):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    return grpc_channel_factory(
+        server_interceptors=(PromServerInterceptor(registry=prom_registry),),
+        add_servicers=(
+            functools.partial(
+                metrics_service.add_metrics_service_to_server,
+                registry=prom_registry,
+                interval=0.05,
+            ),
+        ),
+        max_workers=4,
+    )
+
+
+def _samples(text, sample_name):
+    return [
+        sample
+        for family in text_string_to_metric_families(text.decode())
+        for sample in family.samples
+        if sample.name == sample_name
+    ]
+
+
+@pytest.mark.parametrize("target_count", [1, 10])
+def test_metrics_service_snapshot(target_count, grpc_metrics_service_channel):
+    stub = hello_world_grpc.GreeterStub(grpc_metrics_service_channel)
+    for i in range(target_count):
+        stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+
+    snapshot = metrics_service.MetricsServiceStub(grpc_metrics_service_channel).Snapshot(b"")
+    started = _samples(snapshot, "grpc_server_started_total")
+    assert [s.value for s in started if s.labels["grpc_method"] == "SayHello"] == [target_count]
+
+
+def test_metrics_service_watch_sends_only_changed_series(grpc_metrics_service_channel):
+    stub = hello_world_grpc.GreeterStub(grpc_metrics_service_channel)
+    stub.SayHello(hello_world_pb2.HelloRequest(name="first"))
+
+    watch = metrics_service.MetricsServiceStub(grpc_metrics_service_channel).Watch(b"")
+    first = next(watch)
+    assert _samples(first, "grpc_server_handled_total")[0].value == 1
+
+    list(stub.SayHelloUnaryStream(hello_world_pb2.MultipleHelloResRequest(name="stream", res=3)))
+    sent = []
+    for _, delta in zip(range(20), watch):
+        # The handled counter did not change, so it is never sent again
+        assert _samples(delta, "grpc_server_handled_total") == []
+        sent = [
+            s.value
+            for s in _samples(delta, "grpc_server_msg_sent_total")
+            if s.labels["grpc_method"] == "SayHelloUnaryStream"
+        ]
+        if sent:
+            break
+    watch.cancel()
+
+    assert sent == [3]
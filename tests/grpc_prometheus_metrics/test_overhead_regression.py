@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from tests.benchmarks import interceptor_overhead
+
+# The overheads relative to a round trip, measured by `make perf-baselines`
+BASELINES_PATH = os.environ.get(
+    "GRPC_PROMETHEUS_PERF_BASELINES",
+    os.path.join(os.path.dirname(interceptor_overhead.__file__), "baselines.json"),
+)
+# Increase of the relative overhead over its baseline failing the gate, e.g. 1.0 for +100%,
+# generous as the ratio of the interceptor to the round trip still varies between machines
+TOLERANCE = float(os.environ.get("GRPC_PROMETHEUS_PERF_TOLERANCE", "1.0"))
+
+
+@pytest.mark.parametrize("path", sorted(interceptor_overhead.GATED_PATHS))
+def test_overhead_regression(path, record_property):
+    baseline = interceptor_overhead.load_baselines(BASELINES_PATH)[path]
+    median, mad = interceptor_overhead.median_and_mad(interceptor_overhead.relative_overheads(path))
+    record_property("relative_overhead", median)
+    record_property("relative_overhead_mad", mad)
+
+    # The deviation between the rounds widens the limit by the noise of the machine
+    limit = baseline * (1 + TOLERANCE) + 3 * mad
+    assert median <= limit, (
+        "The {} overhead is {:.1%} of a round trip, over the {:.1%} baseline and its "
+        "tolerance, run make perf-baselines if expected".format(path, median, baseline)
+    )
+
+
+def test_baselines_of_the_gated_paths():
+    assert set(interceptor_overhead.load_baselines(BASELINES_PATH)) == set(
+        interceptor_overhead.GATED_PATHS
+    )
@@ -0,0 +1,139 @@
+import os
+import signal
+import threading
+from types import SimpleNamespace
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics.method_filter import MethodFilter
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from grpc_prometheus_metrics.reconfiguration import reconfigure_on_signal
+
+_LABELS = {"grpc_type": "UNARY", "grpc_service": "helloworld.Greeter", "grpc_method": "SayHello"}
+
+
+_HANDLER = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+
+
+def _server_call(interceptor, method="/helloworld.Greeter/SayHello", handler=_HANDLER):
+    details = SimpleNamespace(method=method, invocation_metadata=())
+    return interceptor.intercept_service(lambda handler_call_details: handler, details)
+
+
+def _call(wrapped_handler):
+    context = SimpleNamespace(_state=SimpleNamespace(client=None, code=None))
+    wrapped_handler.unary_unary(b"", context)
+
+
+def test_server_histogram_and_buckets_reconfiguration():
+    prom_registry = registry.CollectorRegistry()
+    interceptor = PromServerInterceptor(registry=prom_registry)
+    _call(_server_call(interceptor))
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) is None
+
+    interceptor.reconfigure(enable_handling_time_histogram=True)
+    _call(_server_call(interceptor))
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) == 1
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 2
+
+    in_flight = _server_call(interceptor)
+    interceptor.reconfigure(handling_time_buckets=[0.5, 60.0])
+    # The calls in flight keep their configuration, and the histogram they started with
+    _call(in_flight)
+    _call(_server_call(interceptor))
+    # The new histogram restarts its series
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) == 1
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handling_seconds_bucket", dict(_LABELS, le="60.0")
+        )
+        == 1
+    )
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 4
+
+
+def test_server_calls_in_flight_keep_their_configuration():
+    prom_registry = registry.CollectorRegistry()
+    # The per call features take the general wrapper
+    interceptor = PromServerInterceptor(registry=prom_registry, skip_exceptions=True)
+    in_flight = _server_call(interceptor)
+
+    interceptor.reconfigure(enable_handling_time_histogram=True)
+    _call(in_flight)
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) is None
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 1
+
+    _call(_server_call(interceptor))
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) == 1
+
+
+def test_server_buckets_reconfiguration_of_a_shared_registry():
+    prom_registry = registry.CollectorRegistry()
+    first = PromServerInterceptor(enable_handling_time_histogram=True, registry=prom_registry)
+    second = PromServerInterceptor(enable_handling_time_histogram=True, registry=prom_registry)
+    _call(_server_call(second))
+
+    first.reconfigure(handling_time_buckets=[0.5, 60.0])
+    # The other interceptor observes the histogram registered in place of the shared one
+    _call(_server_call(second))
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handling_seconds_bucket", dict(_LABELS, le="60.0")
+        )
+        == 1
+    )
+
+    with pytest.raises(ValueError):
+        PromServerInterceptor(registry=prom_registry)
+    PromServerInterceptor(registry=prom_registry, handling_time_buckets=[0.5, 60.0])
+
+
+def test_server_method_filter_reconfiguration():
+    interceptor = PromServerInterceptor(registry=registry.CollectorRegistry())
+    assert _server_call(interceptor) is not _HANDLER
+
+    interceptor.reconfigure(method_filter=MethodFilter(exclude=["/helloworld.Greeter/*"]))
+    assert _server_call(interceptor) is _HANDLER
+
+    with pytest.raises(TypeError):
+        interceptor.reconfigure(legacy=True)
+
+
+def test_client_histogram_reconfiguration():
+    prom_registry = registry.CollectorRegistry()
+    interceptor = PromClientInterceptor(registry=prom_registry)
+    details = SimpleNamespace(method="/helloworld.Greeter/SayHello", metadata=None)
+    call = SimpleNamespace(code=lambda: grpc.StatusCode.OK)
+
+    interceptor.intercept_unary_unary(lambda details, request: call, details, None)
+    interceptor.reconfigure(enable_client_handling_time_histogram=True)
+    interceptor.intercept_unary_unary(lambda details, request: call, details, None)
+
+    assert prom_registry.get_sample_value("grpc_client_started_total", _LABELS) == 2
+    assert prom_registry.get_sample_value("grpc_client_handling_seconds_count", _LABELS) == 1
+
+
+def test_reconfigure_on_signal():
+    prom_registry = registry.CollectorRegistry()
+    interceptor = PromServerInterceptor(registry=prom_registry)
+    reconfigured = threading.Event()
+
+    def load_options():
+        reconfigured.set()
+        return {"enable_handling_time_histogram": True}
+
+    previous_handler = reconfigure_on_signal([interceptor], load_options, signal.SIGUSR1)
+    try:
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert reconfigured.wait(5)
+    finally:
+        signal.signal(signal.SIGUSR1, previous_handler)
+    for thread in threading.enumerate():
+        if thread.name == "grpc-prometheus-reconfigure":
+            thread.join()
+
+    _call(_server_call(interceptor))
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) == 1
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import slow_calls
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+
+
+@pytest.fixture(scope="function")
+def slow_call_stub(grpc_channel_factory):
+    recorder = slow_calls.SlowCallRecorder(
+        capacity=16, threshold=0, method_thresholds={"/Greeter/SayHelloStreamUnary": 60}
+    )
+    channel = grpc_channel_factory(
+        server_interceptors=(
+            PromServerInterceptor(
+                registry=registry.CollectorRegistry(), slow_call_recorder=recorder
+            ),
+        )
+    )
+    return hello_world_grpc.GreeterStub(channel), recorder
+
+
+def test_slow_calls_unary(slow_call_stub):
+    stub, recorder = slow_call_stub
+    stub.SayHello(hello_world_pb2.HelloRequest(name="slow"))
+    with pytest.raises(grpc.RpcError):
+        stub.SayHello(hello_world_pb2.HelloRequest(name="invalid"))
+
+    invalid, ok = recorder.recent()
+    assert ok.method == "/Greeter/SayHello"
+    assert ok.code == "OK"
+    assert (ok.messages_received, ok.messages_sent) == (1, 1)
+    assert ok.request_bytes == hello_world_pb2.HelloRequest(name="slow").ByteSize()
+    assert ok.response_bytes > 0
+    assert ok.peer.startswith("ipv")
+    assert invalid.code == "INVALID_ARGUMENT"
+
+
+def test_slow_calls_streams(slow_call_stub, stream_request_generator, bidi_request_generator):
+    stub, recorder = slow_call_stub
+    list(stub.SayHelloUnaryStream(hello_world_pb2.MultipleHelloResRequest(name="a", res=5)))
+    list(stub.SayHelloBidiStream(bidi_request_generator(3, 1)))
+    # Below the per method threshold
+    stub.SayHelloStreamUnary(stream_request_generator(4))
+
+    bidi, unary_stream = recorder.recent()
+    assert unary_stream.method == "/Greeter/SayHelloUnaryStream"
+    assert (unary_stream.messages_received, unary_stream.messages_sent) == (1, 5)
+    assert bidi.method == "/Greeter/SayHelloBidiStream"
+    assert (bidi.messages_received, bidi.messages_sent) == (3, 3)
+    assert bidi.response_bytes is None
+
+
+def test_slow_call_recorder_keeps_the_last_calls():
+    recorder = slow_calls.SlowCallRecorder(capacity=4, threshold=0)
+    for i in range(10):
+        recorder.add(slow_calls.SlowCall("/S/M", "peer", "OK", i % 7, 1, 1, None, None, i))
+
+    assert [call.timestamp for call in recorder.recent()] == [9, 8, 7, 6]
+    assert [call.duration for call in recorder.slowest(2)] == [6, 2]
+
+    responses = []
+    body = slow_calls.make_wsgi_app(recorder)(
+        {"QUERY_STRING": "order=slowest"}, lambda status, headers: responses.append(status)
+    )
+    assert responses == ["200 OK"]
+    assert [call["duration"] for call in json.loads(body[0])["calls"]] == [6, 2, 1, 0]
@@ -0,0 +1,147 @@
+from types import SimpleNamespace
+
+import pytest
+import grpc
+from prometheus_client import registry
+
+from grpc_prometheus_metrics import server_metrics
+from grpc_prometheus_metrics import snapshot
+from grpc_prometheus_metrics.array_histograms import ArrayHistograms
+from grpc_prometheus_metrics.auto_buckets import AutoBucketHistograms
+from grpc_prometheus_metrics.background_recorder import BackgroundRecorder
+from grpc_prometheus_metrics.compact_metrics import CompactMetrics
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+
+_LABELS = {"grpc_type": "UNARY", "grpc_service": "helloworld.Greeter", "grpc_method": "SayHello"}
+_HANDLER = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+
+
+def _call(interceptor, count=1):
+    details = SimpleNamespace(method="/helloworld.Greeter/SayHello", invocation_metadata=())
+    for _ in range(count):
+        handler = interceptor.intercept_service(lambda handler_call_details: _HANDLER, details)
+        context = SimpleNamespace(_state=SimpleNamespace(client=None, code=None))
+        handler.unary_unary(b"", context)
+
+
+def _save(path, count, identity="pod-0", **kwargs):
+    prom_registry = registry.CollectorRegistry()
+    _call(PromServerInterceptor(registry=prom_registry, **kwargs), count)
+    snapshot.MetricsSnapshot(str(path), prom_registry, identity=identity).save()
+
+
+@pytest.mark.parametrize(
+    "sink_class",
+    [None, BackgroundRecorder, CompactMetrics, ArrayHistograms, AutoBucketHistograms],
+)
+def test_restore_at_first_use(tmp_path, sink_class):
+    path = tmp_path / "metrics.snapshot"
+    _save(path, 3, enable_handling_time_histogram=True)
+    assert not (tmp_path / "metrics.snapshot.tmp").exists()
+
+    prom_registry = registry.CollectorRegistry()
+    sink = sink_class(prom_registry) if sink_class is not None else None
+    metrics_snapshot = snapshot.MetricsSnapshot(str(path), prom_registry, identity="pod-0")
+    assert metrics_snapshot.restore() == 3
+    # Restored once
+    assert metrics_snapshot.restore() == 0
+
+    # The metrics are created, and restored, by the first call
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) is None
+    _call(
+        PromServerInterceptor(
+            registry=prom_registry, sink=sink, enable_handling_time_histogram=True
+        )
+    )
+
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 4
+    handled_labels = dict(_LABELS, grpc_code="OK")
+    assert prom_registry.get_sample_value("grpc_server_handled_total", handled_labels) == 4
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) == 4
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handling_seconds_bucket", dict(_LABELS, le="+Inf")
+        )
+        == 4
+    )
+
+
+def test_restore_created_metrics(tmp_path):
+    path = tmp_path / "metrics.snapshot"
+    _save(path, 2)
+
+    prom_registry = registry.CollectorRegistry()
+    interceptor = PromServerInterceptor(registry=prom_registry)
+    _call(interceptor)
+    snapshot.MetricsSnapshot(str(path), prom_registry, identity="pod-0").restore()
+
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 3
+
+
+def test_restore_in_the_registry_of_the_snapshot(tmp_path, monkeypatch):
+    path = tmp_path / "metrics.snapshot"
+    _save(path, 2)
+    created = []
+    monkeypatch.setattr(server_metrics, "METRIC_LISTENERS", [])
+
+    prom_registry = registry.CollectorRegistry()
+    snapshot.MetricsSnapshot(str(path), prom_registry, identity="pod-0").restore()
+    server_metrics.METRIC_LISTENERS.append(lambda registry, name: created.append(name))
+    other_registry = registry.CollectorRegistry()
+    _call(PromServerInterceptor(registry=other_registry))
+    assert other_registry.get_sample_value("grpc_server_started_total", _LABELS) == 1
+    names = list(created)
+
+    # The snapshot stops listening once restored, without hiding the metric to the others
+    _call(PromServerInterceptor(registry=prom_registry))
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 3
+    assert len(server_metrics.METRIC_LISTENERS) == 1
+    assert created == names * 2
+
+
+def test_identity_policy(tmp_path):
+    path = tmp_path / "metrics.snapshot"
+    _save(path, 2, identity="pod-0")
+
+    assert snapshot.MetricsSnapshot(str(path), registry.CollectorRegistry(), "pod-1").restore() == 0
+
+    prom_registry = registry.CollectorRegistry()
+    policy = snapshot.ALWAYS
+    assert snapshot.MetricsSnapshot(str(path), prom_registry, "pod-1", policy).restore() == 2
+    _call(PromServerInterceptor(registry=prom_registry))
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 3
+
+
+def test_changed_buckets_are_not_restored(tmp_path):
+    path = tmp_path / "metrics.snapshot"
+    _save(path, 2, enable_handling_time_histogram=True)
+
+    prom_registry = registry.CollectorRegistry()
+    snapshot.MetricsSnapshot(str(path), prom_registry, identity="pod-0").restore()
+    _call(
+        PromServerInterceptor(
+            registry=prom_registry,
+            enable_handling_time_histogram=True,
+            handling_time_buckets=[1.0, 10.0],
+        )
+    )
+
+    assert prom_registry.get_sample_value("grpc_server_started_total", _LABELS) == 3
+    assert prom_registry.get_sample_value("grpc_server_handling_seconds_count", _LABELS) == 1
+
+
+@pytest.mark.parametrize("content", [b"", b"GPMS", b"not a snapshot file"])
+def test_unreadable_snapshot(tmp_path, content):
+    path = tmp_path / "metrics.snapshot"
+    path.write_bytes(content)
+    assert snapshot.MetricsSnapshot(str(path), registry.CollectorRegistry()).restore() == 0
+    assert snapshot.MetricsSnapshot(str(tmp_path / "missing")).restore() == 0
+
+
+def test_saves_at_stop(tmp_path):
+    path = tmp_path / "metrics.snapshot"
+    prom_registry = registry.CollectorRegistry()
+    _call(PromServerInterceptor(registry=prom_registry))
+    metrics_snapshot = snapshot.MetricsSnapshot(str(path), prom_registry, interval=60).start()
+    metrics_snapshot.stop()
+    assert path.read_bytes().startswith(snapshot.MAGIC)
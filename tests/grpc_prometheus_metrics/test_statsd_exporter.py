@@ -0,0 +1,112 @@
+from concurrent import futures
+import socket
+
+import pytest
+import grpc
+
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from grpc_prometheus_metrics.statsd_exporter import StatsdExporter
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+@pytest.fixture(scope="function")
+def udp_listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(5)
+    yield sock
+    sock.close()
+
+
+def _receive_lines(sock):
+    datagrams = [sock.recv(65535)]
+    sock.settimeout(0.2)
+    try:
+        while True:
+            datagrams.append(sock.recv(65535))
+    except socket.timeout:
+        pass
+    return datagrams, [line for d in datagrams for line in d.decode().split("\n")]
+
+
+def _instrumented_stub(exporter):
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(PromServerInterceptor(enable_handling_time_histogram=True, sink=exporter),),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    channel = grpc.intercept_channel(
+        grpc.insecure_channel("localhost:{}".format(port)), PromClientInterceptor(sink=exporter)
+    )
+    return server, channel, hello_world_grpc.GreeterStub(channel)
+
+
+@pytest.mark.parametrize("target_count", [1, 10, 100])
+def test_statsd_exporter_aggregates_counters(target_count, udp_listener):
+    exporter = StatsdExporter(port=udp_listener.getsockname()[1], dogstatsd=True)
+    server, channel, stub = _instrumented_stub(exporter)
+    for i in range(target_count):
+        stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+    channel.close()
+    server.stop(0)
+
+    exporter.flush()
+    _, lines = _receive_lines(udp_listener)
+
+    tags = "|#grpc_type:UNARY,grpc_service:Greeter,grpc_method:SayHello"
+    assert "grpc_server_started:{}|c{}".format(target_count, tags) in lines
+    assert "grpc_client_started:{}|c{}".format(target_count, tags) in lines
+    timings = [line for line in lines if line.startswith("grpc_server_handling_seconds:")]
+    assert len(timings) == target_count
+    assert all(line.endswith("|ms" + tags) for line in timings)
+
+
+def test_statsd_exporter_packs_mtu_sized_datagrams(udp_listener):
+    exporter = StatsdExporter(port=udp_listener.getsockname()[1], max_packet_size=512)
+    metric = exporter.histogram("latency_seconds", "", ["grpc_method"])
+    for i in range(200):
+        metric.labels(grpc_method="Method{}".format(i % 7)).observe(0.001 * i)
+
+    exporter.flush()
+    datagrams, lines = _receive_lines(udp_listener)
+
+    assert len(datagrams) > 1
+    assert all(len(datagram) <= 512 for datagram in datagrams)
+    assert len(lines) == 200
+    assert "latency_seconds.Method0:0|ms" in lines
+
+
+def test_statsd_exporter_background_flush(udp_listener):
+    exporter = StatsdExporter(port=udp_listener.getsockname()[1], flush_interval=0.05).start()
+    exporter.counter("calls_total", "", ["grpc_method"]).labels(grpc_method="Check").inc(3)
+    _, lines = _receive_lines(udp_listener)
+    exporter.stop()
+
+    assert lines == ["calls.Check:3|c"]
+
+
+def test_statsd_exporter_decimal_notation(udp_listener):
+    exporter = StatsdExporter(port=udp_listener.getsockname()[1])
+    exporter.histogram("latency_seconds", "", ["grpc_method"]).labels(grpc_method="A").observe(1e-8)
+    exporter.counter("bytes_total", "", ["grpc_method"]).labels(grpc_method="A").inc(2.5e-5)
+    exporter.stop()
+    _, lines = _receive_lines(udp_listener)
+
+    assert sorted(lines) == ["bytes.A:0.000025|c", "latency_seconds.A:0.00001|ms"]
+    assert exporter._socket.fileno() == -1
+
+
+def test_statsd_exporter_restart_after_stop(udp_listener):
+    exporter = StatsdExporter(port=udp_listener.getsockname()[1], flush_interval=0.05).start()
+    exporter.stop()
+    exporter.start()
+    exporter.counter("calls_total", "", ["grpc_method"]).labels(grpc_method="Check").inc()
+    _, lines = _receive_lines(udp_listener)
+    exporter.stop()
+
+    assert lines == ["calls.Check:1|c"]
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from prometheus_client import Counter
+from prometheus_client import registry
+from prometheus_client.parser import text_string_to_metric_families
+
+from grpc_prometheus_metrics.aio.textfile_exporter import AioTextfileExporter
+from grpc_prometheus_metrics.textfile_exporter import TextfileExporter
+
+
+def _registry():
+    prom_registry = registry.CollectorRegistry()
+    counter = Counter(
+        "grpc_server_started_total", "Started", ["grpc_method"], registry=prom_registry
+    )
+    return prom_registry, counter
+
+
+def _samples(path):
+    return {
+        (sample.name, sample.labels.get("grpc_method")): sample.value
+        for family in text_string_to_metric_families(path.read_text())
+        for sample in family.samples
+        if not sample.name.endswith("_created")
+    }
+
+
+def test_writes_changed_metrics_only(tmp_path):
+    path = tmp_path / "grpc.prom"
+    prom_registry, counter = _registry()
+    counter.labels(grpc_method="SayHello").inc(3)
+    exporter = TextfileExporter(str(path), prom_registry)
+
+    assert exporter.write()
+    assert _samples(path) == {("grpc_server_started_total", "SayHello"): 3}
+    assert not exporter.write()
+
+    counter.labels(grpc_method="SayHello").inc()
+    assert exporter.write()
+    assert _samples(path) == {("grpc_server_started_total", "SayHello"): 4}
+    assert exporter.writes == 2
+    assert [file.name for file in tmp_path.iterdir()] == ["grpc.prom"]
+
+
+def test_cpu_bound():
+    exporter = TextfileExporter("grpc.prom", interval=10, max_cpu_fraction=0.01)
+    assert exporter.next_wait(0.05) == 10
+    assert exporter.next_wait(0.5) == pytest.approx(50)
+
+
+def test_start_stop(tmp_path):
+    path = tmp_path / "grpc.prom"
+    prom_registry, counter = _registry()
+    exporter = TextfileExporter(str(path), prom_registry, interval=60).start()
+    counter.labels(grpc_method="SayHello").inc()
+    exporter.stop()
+    assert _samples(path) == {("grpc_server_started_total", "SayHello"): 1}
+
+
+@pytest.mark.parametrize("openmetrics", [False, True])
+def test_aio_exporter(tmp_path, openmetrics):
+    path = tmp_path / "grpc.prom"
+    prom_registry, counter = _registry()
+    counter.labels(grpc_method="SayHello").inc(2)
+    Counter("grpc_client_started_total", "Started", registry=prom_registry).inc()
+    exporter = AioTextfileExporter(
+        str(path), prom_registry, interval=60, openmetrics=openmetrics, max_slice_seconds=0
+    )
+
+    async def _run():
+        await exporter.start()
+        await asyncio.sleep(0.1)
+        await exporter.stop()
+
+    asyncio.run(_run())
+
+    assert exporter.writes == 1
+    # The families rendered one at a time make a single exposition
+    assert (
+        path.read_bytes()
+        == TextfileExporter(str(path), prom_registry, openmetrics=openmetrics).render()
+    )
@@ -1,4 +1,5 @@
 import requests
+from prometheus_client.metrics_core import Metric
 from prometheus_client.parser import text_string_to_metric_families
 
 
@@ -9,5 +10,8 @@ def get_server_metric(metric_name):
         )
     )
     target_metric = list(filter(lambda x: x.name == metric_name, metrics))
-    assert len(target_metric) == 1
+    assert len(target_metric) <= 1
+    if not target_metric:
+        # The metrics are registered at their first use
+        return Metric(metric_name, "", "untyped")
     return target_metric[0]
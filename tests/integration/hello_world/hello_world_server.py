@@ -37,11 +37,19 @@ class Greeter(hello_world_grpc.GreeterServicer):
     def SayHelloStreamUnary(self, request_iterator, context):
         names = ""
         for request in request_iterator:
+            if request.name == "invalid":
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details('Consarnit!')
+                return None
             names += request.name + " "
         return hello_world_pb2.HelloReply(message="Hello, %s!" % names)
 
     def SayHelloBidiStream(self, request_iterator, context):
         for request in request_iterator:
+            if request.name == "invalid":
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details('Consarnit!')
+                return
             yield hello_world_pb2.HelloReply(message="Hello, %s!" % request.name)
 
 
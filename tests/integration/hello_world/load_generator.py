@@ -0,0 +1,448 @@
+"""
+Generates load on the hello world Greeter through the instrumented server and client.
+
+The workers call the four RPC kinds in turn, against an in-process server or --target, and
+the throughput and latency percentiles measured by the generator are reported next to the
+calls and messages counted by the interceptors. With --aio, the grpc.aio interceptors only
+instrument the unary calls, the streaming calls are still generated. With --no-interceptors,
+the load is also generated without the interceptors, and their overhead is reported.
+
+    python -m tests.integration.hello_world.load_generator [--aio] [--concurrency 8]
+        [--duration 10] [--payload 16] [--stream-length 10] [--error-rate 0.1]
+        [--no-interceptors]
+"""
+import argparse
+import asyncio
+import random
+import threading
+
+from concurrent import futures
+from timeit import default_timer
+
+import grpc
+from prometheus_client import registry
+
+import tests.integration.hello_world.hello_world_pb2 as hello_world_pb2
+import tests.integration.hello_world.hello_world_pb2_grpc as hello_world_grpc
+from grpc_prometheus_metrics.aio.prometheus_aio_client_interceptor import (
+    PromAioUnaryUnaryClientInterceptor,
+)
+from grpc_prometheus_metrics.aio.prometheus_aio_server_interceptor import PromAioServerInterceptor
+from grpc_prometheus_metrics.background_recorder import BackgroundRecorder
+from grpc_prometheus_metrics.prometheus_client_interceptor import PromClientInterceptor
+from grpc_prometheus_metrics.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world.hello_world_async_server import AsyncGreeter
+from tests.integration.hello_world.hello_world_server import Greeter
+
+# RPC kind -> grpc_type label
+KINDS = {
+    "unary": "UNARY",
+    "server_streaming": "SERVER_STREAMING",
+    "client_streaming": "CLIENT_STREAMING",
+    "bidi_streaming": "BIDI_STREAMING",
+}
+
+
+class _Worker:
+    """
+    Calls the RPC kinds in turn and records the latency and the code of every call, and the
+    messages sent and received.
+    """
+
+    def __init__(self, index, kinds, calls, deadline, payload, stream_length, error_rate, seed):
+        self._index = index
+        self._kinds = kinds
+        self._calls = calls
+        self._deadline = deadline
+        self._name = "x" * payload
+        self._stream_length = stream_length
+        self._error_rate = error_rate
+        self._random = random.Random(seed + index)
+        # RPC kind -> latencies, status code -> count, and messages
+        self.latencies = {kind: [] for kind in kinds}
+        self.codes = {kind: {} for kind in kinds}
+        self.sent = dict.fromkeys(kinds, 0)
+        self.received = dict.fromkeys(kinds, 0)
+
+    def next_call(self, count):
+        if count == self._calls or default_timer() >= self._deadline:
+            return None
+        name = "invalid" if self._random.random() < self._error_rate else self._name
+        return self._kinds[(self._index + count) % len(self._kinds)], name
+
+    def requests(self, kind, name):
+        if kind == "client_streaming":
+            request = hello_world_pb2.HelloRequest(name=name)
+        else:
+            request = self.multiple_request(name, 1)
+        for _ in range(self._stream_length):
+            # Counted as the channel takes them, a failed call may not take them all
+            self.sent[kind] += 1
+            yield request
+
+    def multiple_request(self, name, res):
+        return hello_world_pb2.MultipleHelloResRequest(name=name, res=res)
+
+    def record(self, kind, start, code):
+        self.latencies[kind].append(default_timer() - start)
+        codes = self.codes[kind]
+        codes[code] = codes.get(code, 0) + 1
+
+    def run(self, stub):
+        count = 0
+        call = self.next_call(count)
+        while call is not None:
+            kind, name = call
+            start = default_timer()
+            code = "OK"
+            try:
+                if kind == "unary":
+                    self.sent[kind] += 1
+                    stub.SayHello(hello_world_pb2.HelloRequest(name=name))
+                    self.received[kind] += 1
+                elif kind == "server_streaming":
+                    self.sent[kind] += 1
+                    for _ in stub.SayHelloUnaryStream(
+                        self.multiple_request(name, self._stream_length)
+                    ):
+                        self.received[kind] += 1
+                elif kind == "client_streaming":
+                    stub.SayHelloStreamUnary(self.requests(kind, name))
+                    self.received[kind] += 1
+                else:
+                    for _ in stub.SayHelloBidiStream(self.requests(kind, name)):
+                        self.received[kind] += 1
+            except grpc.RpcError as e:
+                code = e.code().name
+            self.record(kind, start, code)
+            count += 1
+            call = self.next_call(count)
+
+    async def run_async(self, stub):
+        count = 0
+        call = self.next_call(count)
+        while call is not None:
+            kind, name = call
+            start = default_timer()
+            code = "OK"
+            try:
+                if kind == "unary":
+                    self.sent[kind] += 1
+                    await stub.SayHello(hello_world_pb2.HelloRequest(name=name))
+                    self.received[kind] += 1
+                elif kind == "server_streaming":
+                    self.sent[kind] += 1
+                    async for _ in stub.SayHelloUnaryStream(
+                        self.multiple_request(name, self._stream_length)
+                    ):
+                        self.received[kind] += 1
+                elif kind == "client_streaming":
+                    await stub.SayHelloStreamUnary(self.requests(kind, name))
+                    self.received[kind] += 1
+                else:
+                    async for _ in stub.SayHelloBidiStream(self.requests(kind, name)):
+                        self.received[kind] += 1
+            except grpc.RpcError as e:
+                code = e.code().name
+            self.record(kind, start, code)
+            count += 1
+            call = self.next_call(count)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+# Counters of the interceptors, by family name suffix
+_COUNTERS = ("started", "handled", "msg_received", "msg_sent")
+
+
+def _counted(prom_registry, side, grpc_type):
+    """
+    Returns the calls started and handled, the failed calls and the messages counted by the
+    interceptors of a side.
+    """
+    counted = dict.fromkeys(_COUNTERS + ("errors",), 0)
+    if prom_registry is None:
+        return counted
+    families = {"grpc_{}_{}".format(side, suffix): suffix for suffix in _COUNTERS}
+    for family in prom_registry.collect():
+        key = families.get(family.name)
+        if key is None:
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_total") and sample.labels["grpc_type"] == grpc_type:
+                counted[key] += int(sample.value)
+                if key == "handled" and sample.labels["grpc_code"] != "OK":
+                    counted["errors"] += int(sample.value)
+    return counted
+
+
+def _interceptor_kwargs(prom_registry, recorder):
+    if recorder:
+        return {"registry": prom_registry, "sink": BackgroundRecorder(prom_registry).start()}
+    return {"registry": prom_registry}
+
+
+def _stop_recorder(kwargs):
+    if "sink" in kwargs:
+        kwargs["sink"].stop()
+
+
+def _run_sync(workers, target, server_kwargs, client_kwargs, concurrency, interceptors):
+    server = None
+    if target is None:
+        server_executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+        server = grpc.server(
+            server_executor,
+            interceptors=(
+                (PromServerInterceptor(enable_handling_time_histogram=True, **server_kwargs),)
+                if interceptors
+                else ()
+            ),
+        )
+        hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+        target = "localhost:{}".format(server.add_insecure_port("localhost:0"))
+        server.start()
+    try:
+        channel = grpc.insecure_channel(target)
+        if interceptors:
+            interceptor = PromClientInterceptor(
+                enable_client_handling_time_histogram=True, **client_kwargs
+            )
+            channel = grpc.intercept_channel(channel, interceptor)
+        with channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            threads = [threading.Thread(target=worker.run, args=(stub,)) for worker in workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    finally:
+        if server is not None:
+            server.stop(None)
+            # The handlers count the calls after the clients saw them end
+            server_executor.shutdown(wait=True)
+
+
+async def _run_async(workers, target, server_kwargs, client_kwargs, interceptors):
+    server = None
+    if target is None:
+        server = grpc.aio.server(
+            interceptors=(
+                (
+                    PromAioServerInterceptor(
+                        enable_handling_time_histogram=True, unary_only=True, **server_kwargs
+                    ),
+                )
+                if interceptors
+                else ()
+            )
+        )
+        hello_world_grpc.add_GreeterServicer_to_server(AsyncGreeter(), server)
+        target = "localhost:{}".format(server.add_insecure_port("localhost:0"))
+        await server.start()
+    try:
+        client_interceptors = []
+        if interceptors:
+            client_interceptors.append(
+                PromAioUnaryUnaryClientInterceptor(
+                    enable_client_handling_time_histogram=True, **client_kwargs
+                )
+            )
+        async with grpc.aio.insecure_channel(target, interceptors=client_interceptors) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            await asyncio.gather(*(worker.run_async(stub) for worker in workers))
+    finally:
+        if server is not None:
+            await server.stop(None)
+
+
+def run(
+    kinds=tuple(KINDS),
+    concurrency=8,
+    duration=10.0,
+    calls=None,
+    payload=16,
+    stream_length=10,
+    error_rate=0.1,
+    use_aio=False,
+    target=None,
+    recorder=False,
+    seed=0,
+    interceptors=True,
+):
+    """
+    Generates the load and returns its report by RPC kind: the calls, failed calls and
+    messages of the generator, their throughput and latency percentiles, and under "server"
+    and "client" the calls started and handled, failed calls and messages counted by the
+    interceptors.
+
+    Every worker stops after ``calls / concurrency`` calls or ``duration`` seconds. The
+    interceptors record into their own registries, through a ``BackgroundRecorder`` with
+    ``recorder=True``; the server ones are not reported against a ``target``. With
+    ``interceptors=False``, the server and the channel are not instrumented and count
+    nothing, the baseline of the overhead of the interceptors.
+    """
+    server_registry = None
+    client_registry = None
+    if interceptors:
+        if target is None:
+            server_registry = registry.CollectorRegistry()
+        client_registry = registry.CollectorRegistry()
+    server_kwargs = _interceptor_kwargs(server_registry, recorder) if server_registry else {}
+    client_kwargs = _interceptor_kwargs(client_registry, recorder) if client_registry else {}
+
+    start = default_timer()
+    workers = [
+        _Worker(
+            index,
+            list(kinds),
+            None if calls is None else calls // concurrency + (index < calls % concurrency),
+            start + duration,
+            payload,
+            stream_length,
+            error_rate,
+            seed,
+        )
+        for index in range(concurrency)
+    ]
+    if use_aio:
+        asyncio.run(_run_async(workers, target, server_kwargs, client_kwargs, interceptors))
+    else:
+        _run_sync(workers, target, server_kwargs, client_kwargs, concurrency, interceptors)
+    elapsed = default_timer() - start
+    _stop_recorder(server_kwargs)
+    _stop_recorder(client_kwargs)
+
+    report = {}
+    for kind in kinds:
+        latencies = sorted(latency for worker in workers for latency in worker.latencies[kind])
+        errors = sum(
+            count
+            for worker in workers
+            for code, count in worker.codes[kind].items()
+            if code != "OK"
+        )
+        report[kind] = {
+            "calls": len(latencies),
+            "errors": errors,
+            "msg_sent": sum(worker.sent[kind] for worker in workers),
+            "msg_received": sum(worker.received[kind] for worker in workers),
+            "throughput": len(latencies) / elapsed,
+            "p50": _percentile(latencies, 0.5),
+            "p90": _percentile(latencies, 0.9),
+            "p99": _percentile(latencies, 0.99),
+            "server": _counted(server_registry, "server", KINDS[kind]),
+            "client": _counted(client_registry, "client", KINDS[kind]),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--kinds", default=",".join(KINDS), help="comma separated RPC kinds")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--calls", type=int, default=None, help="total calls, all kinds")
+    parser.add_argument("--payload", type=int, default=16, help="bytes per request")
+    parser.add_argument("--stream-length", type=int, default=10, help="messages per stream")
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--aio", action="store_true", help="grpc.aio server and client")
+    parser.add_argument("--target", default=None, help="server address, in-process if unset")
+    parser.add_argument("--recorder", action="store_true", help="record through a recorder")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-interceptors", action="store_true", help="also run without, report the overhead"
+    )
+    args = parser.parse_args()
+
+    def generate(interceptors):
+        return run(
+            kinds=args.kinds.split(","),
+            concurrency=args.concurrency,
+            duration=args.duration,
+            calls=args.calls,
+            payload=args.payload,
+            stream_length=args.stream_length,
+            error_rate=args.error_rate,
+            use_aio=args.aio,
+            target=args.target,
+            recorder=args.recorder,
+            seed=args.seed,
+            interceptors=interceptors,
+        )
+
+    baseline = generate(False) if args.no_interceptors else None
+    report = generate(True)
+    print(
+        "{:<18} {:>8} {:>7} {:>9} {:>8} {:>8} {:>8}".format(
+            "kind", "calls", "errors", "calls/s", "p50 ms", "p90 ms", "p99 ms"
+        )
+    )
+    for kind, result in report.items():
+        print(
+            "{:<18} {:>8} {:>7} {:>9.0f} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+                kind,
+                result["calls"],
+                result["errors"],
+                result["throughput"],
+                result["p50"] * 1e3,
+                result["p90"] * 1e3,
+                result["p99"] * 1e3,
+            )
+        )
+    print()
+    print(
+        "{:<18} {:>23} {:>23} {:>23}".format(
+            "started/handled/errors", "generator", "server", "client"
+        )
+    )
+    for kind, result in report.items():
+        print(
+            "{:<18} {:>23} {:>23} {:>23}".format(
+                kind,
+                "{calls}/{calls}/{errors}".format(**result),
+                "{started}/{handled}/{errors}".format(**result["server"]),
+                "{started}/{handled}/{errors}".format(**result["client"]),
+            )
+        )
+    print()
+    print(
+        "{:<18} {:>23} {:>23} {:>23}".format("msg sent/received", "generator", "server", "client")
+    )
+    for kind, result in report.items():
+        print(
+            "{:<18} {:>23} {:>23} {:>23}".format(
+                kind,
+                "{msg_sent}/{msg_received}".format(**result),
+                # The server receives the messages sent by the client
+                "{msg_received}/{msg_sent}".format(**result["server"]),
+                "{msg_sent}/{msg_received}".format(**result["client"]),
+            )
+        )
+    print("server, client: counted by the interceptors, 0 if not counted")
+    if baseline is not None:
+        print()
+        print(
+            "{:<18} {:>12} {:>12} {:>10} {:>14}".format(
+                "overhead", "calls/s", "bare", "delta %", "p50 delta us"
+            )
+        )
+        for kind, result in report.items():
+            bare = baseline[kind]
+            print(
+                "{:<18} {:>12.0f} {:>12.0f} {:>10.1f} {:>14.1f}".format(
+                    kind,
+                    result["throughput"],
+                    bare["throughput"],
+                    100 * (bare["throughput"] - result["throughput"]) / bare["throughput"],
+                    (result["p50"] - bare["p50"]) * 1e6,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()